@@ -0,0 +1,364 @@
+"""TrafficFlow 本地基准测试
+
+启动一个本地字节服务器（独立子进程），分别用同步和异步管理器跑一组固定场景，
+统计吞吐、每GB耗费的CPU时间、峰值内存和限速精度，结果写入JSON便于版本间对比：
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json   # 与上次结果对比，退步超过阈值时退出码为1
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from concurrency import ConcurrencyController
+from log_config import setup_logging
+from traffic_flow import engine_class, load_config
+
+MB = 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+_BLOCK = b'\0' * BLOCK_SIZE
+_PATH_RE = re.compile(r'^/bytes/(\d+)$')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ByteHandler(BaseHTTPRequestHandler):
+    """GET /bytes/<n> 返回 n 个零字节
+
+    查询参数: chunked=1 使用分块传输编码；latency=毫秒 在发送响应头前延迟；
+    rate=KB/s 按连接整形发送速度。支持单个 Range 请求。
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        parts = urlsplit(self.path)
+        match = _PATH_RE.match(parts.path)
+        if not match:
+            self._send_empty(404)
+            return
+        query = parse_qs(parts.query)
+        size = int(match.group(1))
+        chunked = query.get('chunked', ['0'])[0] == '1'
+        latency = float(query.get('latency', ['0'])[0]) / 1000
+        rate = float(query.get('rate', ['0'])[0]) * 1024
+
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            byte_range = self._parse_range(range_header, size)
+            if byte_range is None:
+                self._send_empty(416, {'Content-Range': f'bytes */{size}'})
+                return
+            start, end = byte_range
+            status = 206
+
+        if latency > 0:
+            time.sleep(latency)
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if send_body:
+            try:
+                self._send_body(length, chunked, rate)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    @staticmethod
+    def _parse_range(value, size):
+        match = _RANGE_RE.match(value.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        if not match.group(1):
+            # bytes=-N 表示最后 N 个字节
+            start, end = max(0, size - int(match.group(2))), size - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_body(self, length, chunked, rate):
+        write = self.wfile.write
+        # 整形时缩小块以获得更平滑的发送速度
+        block_size = min(BLOCK_SIZE, max(4096, int(rate / 50))) if rate > 0 else BLOCK_SIZE
+        started = time.monotonic()
+        sent = 0
+        while sent < length:
+            size = min(block_size, length - sent)
+            if chunked:
+                write(b'%x\r\n' % size + _BLOCK[:size] + b'\r\n')
+            else:
+                write(_BLOCK[:size])
+            sent += size
+            if rate > 0:
+                delay = started + sent / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        if chunked:
+            write(b'0\r\n\r\n')
+
+
+def _serve_forever(conn, host):
+    server = ThreadingHTTPServer((host, 0), ByteHandler)
+    server.daemon_threads = True
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def start_byte_server(host='127.0.0.1'):
+    """在子进程中启动字节服务器，返回 (进程, 端口)；服务端开销不计入被测进程"""
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_serve_forever, args=(child_conn, host),
+                              name='benchmark-byte-server', daemon=True)
+    process.start()
+    port = parent_conn.recv()
+    return process, port
+
+
+# 每个场景: engine 为 sync/async；files 为 (字节数, 数量)；query 附加到URL上；
+# transport 为异步引擎的传输实现，event_loop 为 asyncio/uvloop
+SCENARIOS = [
+    {'name': 'sync-stream', 'engine': 'sync', 'files': (32 * MB, 8), 'concurrency': 4},
+    {'name': 'sync-sink', 'engine': 'sync', 'files': (32 * MB, 8), 'concurrency': 4, 'sink_mode': True},
+    {'name': 'async-stream', 'engine': 'async', 'files': (32 * MB, 8), 'concurrency': 4},
+    {'name': 'async-sink', 'engine': 'async', 'files': (32 * MB, 8), 'concurrency': 4, 'sink_mode': True},
+    {'name': 'async-raw', 'engine': 'async', 'files': (32 * MB, 8), 'concurrency': 4, 'transport': 'raw'},
+    {'name': 'sync-rate-limited', 'engine': 'sync', 'files': (8 * MB, 4), 'concurrency': 4,
+     'max_speed_kbps': 8192},
+    {'name': 'async-rate-limited', 'engine': 'async', 'files': (8 * MB, 4), 'concurrency': 4,
+     'max_speed_kbps': 8192},
+    {'name': 'async-small-chunked', 'engine': 'async', 'files': (1 * MB, 64), 'concurrency': 8,
+     'query': 'chunked=1&latency=20'},
+    {'name': 'async-raw-chunked', 'engine': 'async', 'files': (1 * MB, 64), 'concurrency': 8,
+     'query': 'chunked=1&latency=20', 'transport': 'raw'},
+    {'name': 'async-range', 'engine': 'async', 'files': (128 * MB, 2), 'concurrency': 2,
+     'range_streams': 4, 'query': 'rate=16384'},
+    {'name': 'sync-shaped', 'engine': 'sync', 'files': (4 * MB, 8), 'concurrency': 8,
+     'query': 'rate=2048'},
+]
+
+
+def _scenario_urls(scenario, port, scale):
+    size, count = scenario['files']
+    size = max(1, int(size * scale))
+    query = scenario.get('query')
+    url = f"http://127.0.0.1:{port}/bytes/{size}" + (f"?{query}" if query else '')
+    return [url] * count
+
+
+def _run_engine(scenario, urls):
+    """在当前进程中运行一个场景，返回 (下载字节数, 耗时)"""
+    max_speed_kbps = scenario.get('max_speed_kbps', 0)
+    concurrency = scenario['concurrency']
+    # 基准要求可重复，固定并发数，不启用自适应调整
+    options = dict(max_memory_mb=scenario.get('max_memory_mb', 1024),
+                   chunk_size=scenario.get('chunk_size', 65536),
+                   sink_mode=scenario.get('sink_mode', False),
+                   concurrency=ConcurrencyController(concurrency, adaptive=False))
+    # 两个引擎走同一条运行路径 (manager.run)，只有引擎本身不同
+    cls = engine_class(scenario['engine'])
+    config = dict(load_config(cls.engine), interval=0, repeat_count=1, schedule_mode='rounds',
+                  max_speed_kbps=max_speed_kbps, per_download_speed_kbps=0, max_workers=concurrency,
+                  range_streams=scenario.get('range_streams', 1),
+                  async_transport=scenario.get('transport', 'aiohttp'),
+                  event_loop=scenario.get('event_loop', 'asyncio'))
+    manager = cls(**options, **cls.engine_options(config))
+    started = time.monotonic()
+    manager.run(urls, config)
+    elapsed = time.monotonic() - started
+    manager.close()
+    return manager.downloaded_bytes, elapsed
+
+
+def _measure(conn, scenario, urls, verbose):
+    """子进程入口：运行场景并把测量结果发回父进程"""
+    output = sys.stdout if verbose else io.StringIO()
+    # 日志由后台线程写到 stdout，不受 redirect_stdout 影响，静默时直接关闭
+    setup_logging(level='DEBUG' if verbose else 'CRITICAL')
+    cpu_started = time.process_time()
+    try:
+        with contextlib.redirect_stdout(output):
+            downloaded, elapsed = _run_engine(scenario, urls)
+    except Exception as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+        return
+    cpu_seconds = time.process_time() - cpu_started
+    # Linux 上 ru_maxrss 的单位是 KB
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    conn.send({
+        'downloaded_bytes': downloaded,
+        'elapsed_seconds': elapsed,
+        'cpu_seconds': cpu_seconds,
+        'peak_rss_mb': peak_rss_mb,
+    })
+
+
+def run_scenario(scenario, port, scale=1.0, verbose=False):
+    """在独立子进程中运行一个场景，保证峰值内存和CPU时间互不干扰"""
+    urls = _scenario_urls(scenario, port, scale)
+    expected = sum(int(urlsplit(url).path.rsplit('/', 1)[1]) for url in urls)
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(child_conn, scenario, urls, verbose),
+                              name=f"benchmark-{scenario['name']}")
+    process.start()
+    child_conn.close()
+    try:
+        raw = parent_conn.recv()
+    except EOFError:
+        raw = {'error': f"子进程异常退出 (exitcode={process.exitcode})"}
+    process.join()
+
+    result = {'name': scenario['name'], 'engine': scenario['engine'], 'expected_bytes': expected}
+    if 'error' in raw:
+        result['error'] = raw['error']
+        return result
+    downloaded = raw['downloaded_bytes']
+    elapsed = raw['elapsed_seconds']
+    gigabytes = downloaded / (1024 * MB)
+    result.update(raw)
+    result['complete'] = downloaded >= expected
+    result['throughput_mb_s'] = downloaded / MB / elapsed if elapsed > 0 else 0.0
+    result['cpu_seconds_per_gb'] = raw['cpu_seconds'] / gigabytes if gigabytes > 0 else None
+    max_speed_kbps = scenario.get('max_speed_kbps', 0)
+    if max_speed_kbps > 0:
+        achieved_kbps = downloaded / 1024 / elapsed if elapsed > 0 else 0.0
+        result['rate_limit_kbps'] = max_speed_kbps
+        result['achieved_kbps'] = achieved_kbps
+        result['rate_accuracy'] = achieved_kbps / max_speed_kbps
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """与基线结果对比，返回退步描述列表"""
+    previous = {item['name']: item for item in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None or 'error' in old:
+            continue
+        if 'error' in result:
+            regressions.append(f"{result['name']}: 运行失败 ({result['error']})")
+            continue
+        if 'rate_accuracy' in result:
+            if abs(result['rate_accuracy'] - 1) > abs(old['rate_accuracy'] - 1) + tolerance:
+                regressions.append(f"{result['name']}: 限速精度 {old['rate_accuracy']:.3f} -> {result['rate_accuracy']:.3f}")
+        elif result['throughput_mb_s'] < old['throughput_mb_s'] * (1 - tolerance):
+            regressions.append(f"{result['name']}: 吞吐 {old['throughput_mb_s']:.1f} -> {result['throughput_mb_s']:.1f} MB/s")
+        old_cpu, new_cpu = old.get('cpu_seconds_per_gb'), result.get('cpu_seconds_per_gb')
+        if old_cpu and new_cpu and new_cpu > old_cpu * (1 + tolerance):
+            regressions.append(f"{result['name']}: CPU {old_cpu:.2f} -> {new_cpu:.2f} 秒/GB")
+        if result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{result['name']}: 峰值内存 {old['peak_rss_mb']:.1f} -> {result['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def print_result(result):
+    if 'error' in result:
+        print(f"✗ {result['name']:<22} 失败: {result['error']}")
+        return
+    cpu = result['cpu_seconds_per_gb']
+    cpu_text = f"{cpu:6.2f} 秒/GB" if cpu is not None else "   无数据"
+    line = (f"{'✓' if result['complete'] else '⚠️'} {result['name']:<22} "
+            f"{result['throughput_mb_s']:8.1f} MB/s  CPU {cpu_text}  ")
+    line += f"峰值内存 {result['peak_rss_mb']:6.1f} MB"
+    if 'rate_accuracy' in result:
+        line += f"  限速精度 {result['rate_accuracy']:.3f} ({result['achieved_kbps']:.0f}/{result['rate_limit_kbps']} KB/s)"
+    print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='TrafficFlow 本地基准测试')
+    parser.add_argument('--output', help='把结果写入该JSON文件')
+    parser.add_argument('--baseline', help='与之前的JSON结果对比，退步超过阈值时退出码为1')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='允许的退步比例 (默认 0.1，即10%%)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='按比例缩放所有场景的文件大小，例如 0.25 用于快速检查')
+    parser.add_argument('--only', help='只运行名称包含该字符串的场景，逗号分隔')
+    parser.add_argument('--verbose', action='store_true', help='显示下载管理器的输出')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = SCENARIOS
+    if args.only:
+        patterns = [item.strip() for item in args.only.split(',') if item.strip()]
+        scenarios = [s for s in SCENARIOS if any(p in s['name'] for p in patterns)]
+
+    server, port = start_byte_server()
+    print(f"本地字节服务器: http://127.0.0.1:{port}/bytes/<n>")
+    results = []
+    try:
+        for scenario in scenarios:
+            result = run_scenario(scenario, port, scale=args.scale, verbose=args.verbose)
+            print_result(result)
+            results.append(result)
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n⚠️ 与基线相比出现退步:")
+            for item in regressions:
+                print(f"   {item}")
+            sys.exit(1)
+        print("\n与基线相比没有超过阈值的退步")
+
+
+if __name__ == "__main__":
+    main()
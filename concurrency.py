@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+
+import psutil
+
+from log_config import get_logger
+
+logger = get_logger('concurrency')
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# cgroup v1 未设置限制时给出接近 2^63 的页对齐值，超过该值视为无限制
+_UNLIMITED = 1 << 60
+
+
+def _read_int(path):
+    """读取 cgroup 文件中的整数，'max'、不存在或无限制时返回 None"""
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if value < _UNLIMITED else None
+
+
+def _read_stat(path, key):
+    """读取 memory.stat 中的一项，不存在时返回 0"""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _cgroup_paths():
+    """从 /proc/self/cgroup 读取当前进程所在的 cgroup，返回 (v2路径, v1 memory控制器路径)"""
+    v2 = v1 = None
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                parts = line.rstrip('\n').split(':', 2)
+                if len(parts) != 3:
+                    continue
+                hierarchy, controllers, path = parts
+                if hierarchy == '0' and not controllers:
+                    v2 = path
+                elif 'memory' in controllers.split(','):
+                    v1 = path
+    except OSError:
+        pass
+    return v2, v1
+
+
+def read_cgroup_memory():
+    """读取容器的 cgroup 内存限制和工作集用量（字节），返回 (limit, usage)，未设置限制时 limit 为 None
+
+    优先 cgroup v2 (memory.max)，其次 v1 (memory.limit_in_bytes)；容器内通常只挂载了自己的 cgroup，
+    所以先按 /proc/self/cgroup 中的路径查找，再回退到挂载点根目录。
+    用量扣除了可回收的 inactive_file 页缓存，与 docker stats 的口径一致。
+    """
+    v2, v1 = _cgroup_paths()
+    candidates = []
+    if v2 is not None:
+        for base in (os.path.join(CGROUP_ROOT, v2.lstrip('/')), CGROUP_ROOT):
+            candidates.append((base, 'memory.max', 'memory.current', 'inactive_file'))
+    memory_root = os.path.join(CGROUP_ROOT, 'memory')
+    bases = [os.path.join(memory_root, v1.lstrip('/'))] if v1 else []
+    for base in bases + [memory_root]:
+        candidates.append((base, 'memory.limit_in_bytes', 'memory.usage_in_bytes', 'total_inactive_file'))
+
+    for base, limit_file, usage_file, inactive_key in candidates:
+        limit_path = os.path.join(base, limit_file)
+        if not os.path.exists(limit_path):
+            continue
+        usage = _read_int(os.path.join(base, usage_file))
+        if usage is not None:
+            usage = max(0, usage - _read_stat(os.path.join(base, 'memory.stat'), inactive_key))
+        return _read_int(limit_path), usage
+    return None, None
+
+
+def memory_budget_mb(max_memory_mb):
+    """把配置的内存限制收紧到 cgroup 限制以内，返回 (预算MB, cgroup限制MB或None)"""
+    limit, _ = read_cgroup_memory()
+    if limit is None:
+        return max_memory_mb, None
+    limit_mb = limit / (1024 * 1024)
+    return min(max_memory_mb, limit_mb * 0.9), limit_mb
+
+
+def available_memory_mb():
+    """可用内存 (MB)：宿主机可用内存与 cgroup 剩余额度中较小的一个，返回 (MB, 来源)"""
+    available = psutil.virtual_memory().available
+    source = '系统'
+    limit, usage = read_cgroup_memory()
+    if limit is not None:
+        remaining = max(0, limit - (usage or 0))
+        if remaining < available:
+            available, source = remaining, 'cgroup'
+    return available / (1024 * 1024), source
+
+
+def initial_concurrency(default):
+    """按可用内存（每个下载约预留 10 MB，最多用可用内存的10%）给出启动时的并发数"""
+    try:
+        available, source = available_memory_mb()
+    except Exception as e:
+        logger.warning(f"内存检测失败，使用默认并发数: {e}")
+        return default
+    concurrency = max(1, min(default, int(available * 0.1 / 10)))
+    logger.info(f"可用内存: {available:.1f} MB ({source}), 初始并发数: {concurrency}")
+    return concurrency
+
+
+class ConcurrencyController:
+    """按实测吞吐自适应调整在途下载数（梯度探测 + 乘性减）
+
+    每个采样周期测一次总吞吐，然后把并发数试探性地调高（或调低）约四分之一，下个周期比较吞吐变化：
+    新增的下载至少带来按平均份额估算的一半吞吐才保留，说明链路还有余量，继续往上试探；
+    否则退回原值并保持 cooldown 个周期，之后改为向下试探，减少下载后吞吐几乎不变就保留，
+    把多余的连接和内存让出来。已达到全局限速时只向下试探，内存接近预算或任务不足以填满槽位时不再增加；
+    内存管理器暂停接纳时并发减半。
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, interval=2.0, adaptive=True,
+                 cooldown=30, samples=10):
+        self.adaptive = adaptive
+        self.min_limit = max(1, min_limit)
+        # 固定并发时上下限都等于初始值
+        self.max_limit = max(self.min_limit, max_limit) if adaptive else max(1, initial)
+        self.limit = max(self.min_limit, min(self.max_limit, initial))
+        self.interval = interval
+        self.cooldown = cooldown
+        self.samples = samples
+        # 最近一个周期的总吞吐 (字节/秒)
+        self.throughput = 0.0
+        self.increases = 0
+        self.decreases = 0
+        # 进行中的试探 (试探前的并发数, 试探前的吞吐)
+        self._probe = None
+        self._direction = 1
+        # 调整后跳过一个周期，等新下载建立连接后再测量
+        self._settle = 0
+        self._hold = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def update(self, throughput, active, rate_target=0.0, memory_paused=False, memory_high=False):
+        """根据一个采样周期的测量值调整并发上限，返回新的上限"""
+        limit = self.limit
+        if memory_paused:
+            self._probe = None
+            self._hold = self.cooldown
+            return self._set(limit // 2, '内存接近上限')
+        if active < 0.5 or throughput <= 0:
+            # 没有下载在途（轮次间隔或任务已领完），不做判断
+            return limit
+        self.throughput = throughput
+        if self._settle > 0:
+            self._settle -= 1
+            return limit
+
+        if self._probe is not None:
+            prev_limit, prev_throughput = self._probe
+            self._probe = None
+            # 按平均每个下载贡献的吞吐估算这次增减的下载应带来的变化
+            expected = prev_throughput / prev_limit * abs(limit - prev_limit)
+            if limit > prev_limit:
+                kept = throughput - prev_throughput >= expected * 0.5
+            else:
+                kept = prev_throughput - throughput < expected * 0.5
+            if not kept:
+                # 试探无效：退回原值，冷却后换个方向试探
+                self._hold = self.cooldown
+                self._direction = -self._direction
+                return self._set(prev_limit)
+        elif self._hold > 0:
+            self._hold -= 1
+            return limit
+
+        at_target = rate_target > 0 and throughput >= rate_target * 0.95
+        # 平均在途数明显低于上限，说明瓶颈是任务数而不是链路
+        app_limited = active < limit - max(1.0, limit * 0.2)
+        if at_target:
+            self._direction = -1
+        if self._direction > 0 and (memory_high or app_limited or limit >= self.max_limit):
+            return limit
+        if self._direction < 0 and (app_limited or limit <= self.min_limit):
+            self._direction = 1
+            return limit
+        # 每次试探约为当前并发的四分之一，吞吐变化明显高于测量抖动
+        step = max(1, round(limit / 4))
+        self._probe = (limit, throughput)
+        return self._set(limit + self._direction * step)
+
+    def _set(self, new_limit, reason=None):
+        new_limit = max(self.min_limit, min(self.max_limit, new_limit))
+        if new_limit > self.limit:
+            self.increases += 1
+        elif new_limit < self.limit:
+            self.decreases += 1
+            if reason:
+                logger.warning(f"⚠️ {reason}，并发数降为 {new_limit}")
+        if new_limit != self.limit:
+            self._settle = 1
+        self.limit = new_limit
+        return new_limit
+
+    def start(self, manager):
+        """启动后台采样线程，周期性调整 manager.max_active_downloads"""
+        manager.max_active_downloads = self.limit
+        if not self.adaptive or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(manager,),
+                                        name='concurrency-controller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台采样线程"""
+        self._stop_event.set()
+
+    def _run(self, manager):
+        governor = manager.memory_governor
+        # 导出计数器单调递增，不受每轮重置统计影响
+        last_bytes = manager.metrics.downloaded_bytes()
+        last_time = time.monotonic()
+        active_sum = 0
+        count = 0
+        while not self._stop_event.wait(self.interval / self.samples):
+            active_sum += manager.active_downloads
+            count += 1
+            if count < self.samples:
+                continue
+            now = time.monotonic()
+            total = manager.metrics.downloaded_bytes()
+            throughput = (total - last_bytes) / (now - last_time)
+            manager.max_active_downloads = self.update(
+                throughput, active_sum / count,
+                rate_target=manager.rate_limiter.rate,
+                memory_paused=not governor.admission.is_set(),
+                memory_high=governor.rss_mb >= governor.max_memory_mb * governor.gc_ratio
+            )
+            last_bytes, last_time = total, now
+            active_sum = count = 0
+
+    def summary(self):
+        """返回便于打印的控制器状态"""
+        if not self.adaptive:
+            return f"固定 {self.limit}"
+        return (f"当前 {self.limit} (范围 {self.min_limit}-{self.max_limit}), "
+                f"最近吞吐 {self.throughput / (1024 * 1024):.2f} MB/s, "
+                f"调高 {self.increases} 次 / 调低 {self.decreases} 次")
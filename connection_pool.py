@@ -0,0 +1,120 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+# 预热请求的标记，连接统计据此把预热与正常下载分开计数
+WARM_REQUEST = {'warm': True}
+
+
+class PoolPolicy:
+    """连接池配置
+
+    limit_per_host: 每个主机最多同时打开的连接数，0 表示只受总并发限制
+    keepalive: 空闲连接保留的秒数，超过后关闭
+    warm: 按轮调度时，在轮次间隔的最后一秒为本轮下载过的每个主机预先建立的连接数，0 表示关闭
+    """
+
+    def __init__(self, limit_per_host=0, keepalive=60, warm=0):
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.warm = warm
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取连接池配置"""
+        return cls(
+            limit_per_host=int(os.getenv('POOL_LIMIT_PER_HOST', '0')),
+            keepalive=float(os.getenv('POOL_KEEPALIVE', '60')),
+            warm=int(os.getenv('POOL_WARM', '0'))
+        )
+
+    def describe(self):
+        """返回便于打印的连接池配置描述"""
+        per_host = f"每主机 {self.limit_per_host} 个连接" if self.limit_per_host > 0 else "每主机不限"
+        text = f"{per_host} / 空闲保留 {self.keepalive:g}s"
+        if self.warm > 0:
+            text += f" / 轮次间隔中每主机预热 {self.warm} 个连接"
+        return text
+
+    def aiohttp_options(self, limit):
+        """转换为 aiohttp TCPConnector 的参数，limit 为总连接数上限"""
+        return dict(limit=limit, limit_per_host=self.limit_per_host, keepalive_timeout=self.keepalive)
+
+
+class ConnectionStats:
+    """连接复用统计：请求数、建立的连接数（含预热）和预热的连接数
+
+    复用率 = 1 - 下载时新建的连接数 / 请求数，在预热连接上发出的请求计为复用。
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connects = 0
+        self.warmed = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self, warm=False):
+        with self._lock:
+            self.connects += 1
+            if warm:
+                self.warmed += 1
+
+    def reuse_ratio(self):
+        """请求中使用已有连接的比例"""
+        with self._lock:
+            requests, cold = self.requests, self.connects - self.warmed
+        if requests <= 0:
+            return 0.0
+        return max(0.0, 1 - cold / requests)
+
+    def summary(self):
+        """返回便于打印的复用统计"""
+        text = (f"请求 {self.requests} 次, 新建连接 {self.connects - self.warmed} 次, "
+                f"复用率 {self.reuse_ratio() * 100:.0f}%")
+        if self.warmed:
+            text += f", 预热连接 {self.warmed} 次"
+        return text
+
+    def trace_config(self):
+        """创建统计 aiohttp 请求和新建连接的 TraceConfig"""
+        import aiohttp
+
+        async def on_request_start(session, context, params):
+            if not context.trace_request_ctx:
+                self.record_request()
+
+        async def on_connection_create_end(session, context, params):
+            self.record_connect(warm=bool(context.trace_request_ctx))
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+
+class WarmTargets:
+    """记录本轮成功下载过的主机 (scheme://host:port -> 一个URL)，供轮次间隔预热连接
+
+    最多记录 max_hosts 个主机，超长URL列表下内存占用有上限。
+    """
+
+    def __init__(self, max_hosts=64):
+        self.max_hosts = max_hosts
+        self._targets = {}
+
+    def note(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}".lower()
+        if origin not in self._targets and len(self._targets) < self.max_hosts:
+            self._targets[origin] = url
+
+    def urls(self):
+        return list(self._targets.values())
+
+    def clear(self):
+        """每轮开始时清空，只为上一轮实际下载过的主机预热"""
+        self._targets.clear()
@@ -0,0 +1,234 @@
+import asyncio
+import contextvars
+import ipaddress
+import socket
+import threading
+import time
+
+# 当前请求新建连接时解析器给出的首选IP，用于把连接失败归到具体IP上
+_connect_attempt = contextvars.ContextVar('dns_connect_attempt', default=None)
+
+
+def is_ip_address(host):
+    """判断主机名是否已经是IP地址"""
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+
+class _Entry:
+    __slots__ = ('addresses', 'expires_at', 'cursor')
+
+    def __init__(self, addresses, expires_at):
+        self.addresses = addresses
+        self.expires_at = expires_at
+        self.cursor = 0
+
+
+class DNSCache:
+    """两个下载引擎共用的DNS缓存
+
+    按 TTL 缓存主机的全部 A/AAAA 记录，每次新建连接时按轮询顺序返回地址，
+    把连接分散到 CDN 的各个节点；连接失败的IP在 failure_cooldown 秒内排到最后。
+    重新解析失败时继续使用过期的记录，避免DNS抖动导致整轮下载失败。
+    """
+
+    def __init__(self, ttl=120, failure_cooldown=30, stale_retry=10):
+        self.ttl = ttl
+        self.failure_cooldown = failure_cooldown
+        self.stale_retry = stale_retry
+        self._lock = threading.Lock()
+        self._entries = {}
+        # 同一主机并发解析时只发起一次查询
+        self._resolving_locks = {}
+        self._pending = {}
+        # IP -> 恢复使用的时间
+        self._unhealthy = {}
+        self.hits = 0
+        self.lookups = 0
+        self.lookup_errors = 0
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            return entry
+        return None
+
+    def _store(self, key, infos):
+        """保存 getaddrinfo 的结果，按IP去重并保持系统给出的顺序，返回缓存项"""
+        addresses = []
+        seen = set()
+        for family, _, _, _, sockaddr in infos:
+            if sockaddr[0] not in seen:
+                seen.add(sockaddr[0])
+                addresses.append((family, sockaddr))
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                # 保留轮询位置，刷新后仍然继续分散
+                entry.addresses = addresses
+                entry.expires_at = time.monotonic() + self.ttl
+            else:
+                entry = self._entries[key] = _Entry(addresses, time.monotonic() + self.ttl)
+            return entry
+
+    def _stale(self, key, error):
+        """解析失败：有旧记录时继续使用，否则抛出原异常"""
+        with self._lock:
+            self.lookup_errors += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                raise error
+            entry.expires_at = time.monotonic() + self.stale_retry
+            return entry
+
+    def _ordered(self, entry):
+        """从轮询位置开始排列地址，暂停使用的IP放在最后作为兜底（调用方持有锁）"""
+        count = len(entry.addresses)
+        start = entry.cursor % count
+        entry.cursor += 1
+        rotated = entry.addresses[start:] + entry.addresses[:start]
+        now = time.monotonic()
+        healthy = [a for a in rotated if self._unhealthy.get(a[1][0], 0) <= now]
+        if len(healthy) == count:
+            return rotated
+        return healthy + [a for a in rotated if self._unhealthy.get(a[1][0], 0) > now]
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is None:
+                return None
+            self.hits += 1
+            return self._ordered(entry)
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        """同步解析，返回 [(family, sockaddr), ...]，首个地址为本次连接的首选"""
+        key = (host.lower(), port, family)
+        addresses = self._cached(key)
+        if addresses is not None:
+            return addresses
+        with self._lock:
+            resolving = self._resolving_locks.setdefault(key, threading.Lock())
+        with resolving:
+            # 等锁期间其他线程可能已经完成解析
+            addresses = self._cached(key)
+            if addresses is not None:
+                return addresses
+            try:
+                infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+            except OSError as e:
+                entry = self._stale(key, e)
+            else:
+                entry = self._store(key, infos)
+        with self._lock:
+            return self._ordered(entry)
+
+    async def async_resolve(self, host, port, family=socket.AF_UNSPEC):
+        """异步解析，语义同 resolve()"""
+        key = (host.lower(), port, family)
+        addresses = self._cached(key)
+        if addresses is not None:
+            return addresses
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_task(self._async_lookup(key, host, port, family))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        entry = await asyncio.shield(pending)
+        with self._lock:
+            return self._ordered(entry)
+
+    async def _async_lookup(self, key, host, port, family):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM)
+        except OSError as e:
+            return self._stale(key, e)
+        return self._store(key, infos)
+
+    def mark_failure(self, ip):
+        """记录一次连接失败，该IP暂停使用一段时间"""
+        with self._lock:
+            self._unhealthy[ip] = time.monotonic() + self.failure_cooldown
+
+    def mark_success(self, ip):
+        """连接成功，恢复该IP"""
+        if ip in self._unhealthy:
+            with self._lock:
+                self._unhealthy.pop(ip, None)
+
+    def begin_attempt(self):
+        """在发起请求前调用，之后新建连接时解析器会把首选IP记到返回的列表里"""
+        attempt = []
+        _connect_attempt.set(attempt)
+        return attempt
+
+    def finish_attempt(self, attempt, peer_ip=None, failed=False):
+        """根据请求结果更新IP健康状态；复用已有连接时 attempt 为空，不做处理"""
+        if not attempt:
+            return
+        preferred = attempt[0]
+        if failed:
+            self.mark_failure(preferred)
+            return
+        if peer_ip:
+            self.mark_success(peer_ip)
+            if peer_ip != preferred:
+                # 首选IP连接失败后回退到了其他地址
+                self.mark_failure(preferred)
+
+    def summary(self):
+        """返回便于打印的缓存统计"""
+        now = time.monotonic()
+        with self._lock:
+            hosts = len({key[0] for key in self._entries})
+            ips = len({a[1][0] for entry in self._entries.values() for a in entry.addresses})
+            unhealthy = sum(1 for until in self._unhealthy.values() if until > now)
+            hits, lookups, errors = self.hits, self.lookups, self.lookup_errors
+        text = f"命中 {hits} 次, 解析 {lookups} 次, {hosts} 个主机 / {ips} 个IP"
+        if errors:
+            text += f", 解析失败 {errors} 次"
+        if unhealthy:
+            text += f", 暂停使用 {unhealthy} 个IP"
+        return text
+
+
+_resolver_class = None
+
+
+def create_aiohttp_resolver(cache):
+    """创建使用 DNSCache 的 aiohttp 解析器，需配合 TCPConnector(use_dns_cache=False)"""
+    global _resolver_class
+    if _resolver_class is None:
+        from aiohttp.abc import AbstractResolver
+
+        class CachingResolver(AbstractResolver):
+            def __init__(self, cache):
+                self.cache = cache
+
+            async def resolve(self, host, port=0, family=socket.AF_INET):
+                addresses = await self.cache.async_resolve(host, port, family)
+                attempt = _connect_attempt.get()
+                if attempt is not None and addresses:
+                    attempt.append(addresses[0][1][0])
+                return [
+                    {
+                        'hostname': host,
+                        'host': sockaddr[0],
+                        'port': sockaddr[1],
+                        'family': addr_family,
+                        'proto': 0,
+                        'flags': socket.AI_NUMERICHOST | socket.AI_NUMERICSERV,
+                    }
+                    for addr_family, sockaddr in addresses
+                ]
+
+            async def close(self):
+                pass
+
+        _resolver_class = CachingResolver
+    return _resolver_class(cache)
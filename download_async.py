@@ -1,303 +1,551 @@
 import aiohttp
 import asyncio
-import os
-import signal
-import sys
+import threading
 import time
-import psutil
-import gc
-from throttler import throttle
+from contextlib import asynccontextmanager
+from connection_pool import WARM_REQUEST
+from dns_cache import create_aiohttp_resolver
+from log_config import get_logger
+from profiling import LoopLagMonitor, current_download, phase_trace_config
+from range_split import SegmentPlanner, parse_content_range_total
+from raw_http import RawHTTPClient, setup_event_loop
+from rate_limiter import per_download_limiter, reserve_all
+from socket_tuning import create_tuned_connector
+from timeouts import StalledStreamError
+from traffic_flow import BaseTrafficFlowManager, main
+from url_catalog import CatalogScheduler
+from wire_bytes import response_head_size
 
-class AsyncTrafficFlowManager:
-    def __init__(self, max_memory_mb=100, chunk_size=8192):
-        self.running = True
-        self.downloaded_bytes = 0
-        self.start_time = time.time()
-        self.max_memory_mb = max_memory_mb
-        self.chunk_size = chunk_size
-        self.active_downloads = 0
-        self.max_active_downloads = 5  # 异步版本可以支持更高并发
-        
-        # 根据内存限制调整并发数
-        self.adjust_concurrency_based_on_memory()
-        
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+logger = get_logger('async')
+
+class AsyncTrafficFlowManager(BaseTrafficFlowManager):
+    """异步IO引擎：单个事件循环内的协程并发下载，适合URL多、并发高的场景"""
+
+    engine = 'asyncio'
+    DEFAULT_INITIAL_CONCURRENCY = 5
+    DEFAULT_MAX_CONCURRENCY = 32
+    DEFAULT_INTERVAL = 1
+
+    def __init__(self, *args, range_streams=1, range_min_size_mb=16, transport='aiohttp', **kwargs):
+        super().__init__(*args, **kwargs)
+        # 大文件分段并发下载：每个文件最多 range_streams 个 Range 连接
+        self.range_streams = max(1, range_streams)
+        self.range_min_size = range_min_size_mb * 1024 * 1024
+        # URL -> 文件大小 (支持 Range) 或 None (不支持/文件太小)，避免每轮重复探测
+        self._range_support = {}
+        # 单连接下载的传输实现：aiohttp，或 raw（BufferedProtocol 直接计数丢弃，CPU 占用更低）
+        self.transport = transport
+        self.raw_client = None
+        # 事件循环延迟：回调或分块循环长时间占用事件循环时所有下载都会变慢
+        self.loop_lag = LoopLagMonitor()
+        self.metrics.add_histogram('trafficflow_event_loop_lag_seconds', '事件循环的调度延迟',
+                                   self.loop_lag.histogram)
     
-    def adjust_concurrency_based_on_memory(self):
-        """根据可用内存调整并发数"""
-        try:
-            available_memory = psutil.virtual_memory().available / (1024 * 1024)
-            safe_concurrency = max(1, min(20, int(available_memory * 0.1 / 10)))
-            self.max_active_downloads = min(self.max_active_downloads, safe_concurrency)
-            print(f"可用内存: {available_memory:.1f} MB, 设置最大并发数: {self.max_active_downloads}")
-        except Exception as e:
-            print(f"内存检测失败，使用默认并发数: {e}")
+    @classmethod
+    def engine_options(cls, config):
+        return {
+            'range_streams': config['range_streams'],
+            'range_min_size_mb': config['range_min_size_mb'],
+            'transport': config['async_transport'],
+        }
+    
+    async def wait_for_memory_safe(self):
+        """等待内存管理器放行新下载；暂停接纳超过 memory_wait_timeout 秒后不再等待，由调用方跳过"""
+        while self.running:
+            # 停滞后每次调用仍等待1秒，跳过不会空转
+            if await self.memory_governor.async_wait_for_admission(timeout=1):
+                return True
+            if self.memory_governor.stalled(self.memory_wait_timeout):
+                break
+        return self.memory_governor.admission.is_set()
     
-    def signal_handler(self, signum, frame):
-        print(f"\n接收到信号 {signum}，正在停止程序...")
-        self.running = False
+    async def wait_for_breakers(self):
+        """URL被熔断跳过后等到最早的熔断器重新放行，避免在熔断中的来源之间空转；分段等待以便响应停止信号"""
+        deadline = time.monotonic() + self.health.retry_after()
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(1.0, remaining))
     
-    def get_memory_usage(self):
-        """获取当前内存使用量"""
+    async def wait_for_worker_slot(self, index, exhausted):
+        """编号超出当前并发上限的协程（流量计划暂停时为全部协程）暂停领取任务，直到可以继续、任务领完或程序停止"""
+        while (self.running and (index >= self.max_active_downloads or self.paused)
+               and not exhausted.is_set()):
+            await asyncio.sleep(0.5)
+        return self.running and not exhausted.is_set()
+
+    def create_session(self):
+        """创建下载用的 ClientSession"""
+        # 丢弃模式下放大读缓冲，减少传输层暂停/恢复次数，每次取到更大的数据块
+        read_bufsize = self.sink_buffer_size if self.sink_mode else 2 ** 16
+        # 总连接数按并发上限分配，分段下载时每个文件最多占用 range_streams 个连接
+        options = self.pool_policy.aiohttp_options(limit=self.concurrency.max_limit * self.range_streams)
+        if self.dns_cache is not None:
+            options.update(resolver=create_aiohttp_resolver(self.dns_cache), use_dns_cache=False)
+        if self.socket_profile.enabled:
+            connector = create_tuned_connector(self.socket_profile, **options)
+        else:
+            connector = aiohttp.TCPConnector(**options)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout_policy.aiohttp_timeout(),
+            read_bufsize=read_bufsize,
+            trace_configs=[self.connection_stats.trace_config(), phase_trace_config(self.metrics)],
+            # 线路字节模式：请求不压缩的响应，服务器仍然压缩时也不解压
+            headers=self.request_headers,
+            auto_decompress=not self.wire_bytes
+        )
+
+    @asynccontextmanager
+    async def open_session(self):
+        """打开本次运行使用的连接：aiohttp 会话，raw 传输时另外创建原始HTTP客户端"""
+        async with self.create_session() as session:
+            if self.transport == 'raw':
+                self.raw_client = RawHTTPClient(self.dns_cache, buffer_size=self.sink_buffer_size,
+                                                keepalive=self.pool_policy.keepalive,
+                                                connection_stats=self.connection_stats,
+                                                socket_profile=self.socket_profile, metrics=self.metrics)
+            try:
+                yield session
+            finally:
+                if self.raw_client is not None:
+                    self.raw_client.close()
+
+    async def _open(self, session, url, policy, headers=None):
+        """发起请求并等待响应头，超过首字节超时则放弃"""
+        started = time.monotonic()
+        attempt = self.dns_cache.begin_attempt() if self.dns_cache is not None else None
         try:
-            process = psutil.Process(os.getpid())
-            return process.memory_info().rss / (1024 * 1024)
-        except:
-            return 0
+            response = await asyncio.wait_for(
+                session.get(url, headers=headers, timeout=policy.aiohttp_timeout()),
+                policy.first_byte
+            )
+        except (aiohttp.ClientConnectorError, asyncio.TimeoutError):
+            # 解析失败时 attempt 为空，只有建立连接失败才会记到首选IP上
+            if attempt:
+                self.dns_cache.finish_attempt(attempt, failed=True)
+            raise
+        stripe = self.metrics.stripe()
+        stripe.observe_ttfb(time.monotonic() - started)
+        if self.wire_bytes:
+            version = response.version
+            stripe.downloaded_bytes += response_head_size(
+                f"{version.major}.{version.minor}", response.status, response.reason or '', response.raw_headers)
+        if attempt:
+            self.dns_cache.finish_attempt(attempt, peer_ip=self._peer_ip(response))
+        return response
+
+    @staticmethod
+    def _transport(response):
+        """响应所用连接的传输；小文件可能在返回前已读完并释放连接，此时从协议对象获取"""
+        connection = response.connection
+        protocol = connection.protocol if connection is not None else getattr(response, '_protocol', None)
+        return protocol.transport if protocol is not None else None
+
+    @classmethod
+    def _peer_ip(cls, response):
+        """响应所用连接的对端IP"""
+        transport = cls._transport(response)
+        peer = transport.get_extra_info('peername') if transport is not None else None
+        return peer[0] if peer else None
+
+    async def _consume_response(self, response, limiters, watchdog=None):
+        """读取响应体并立即丢弃，返回 (字节数, 分块数)；程序停止时提前返回"""
+        total_size = 0
+        chunk_count = 0
+        limited = any(limiter is not None and limiter.enabled for limiter in limiters)
+        stripe = self.metrics.stripe()
+        progress = current_download.get()
+        started = time.monotonic()
+        
+        if self.sink_mode:
+            chunks = response.content.iter_any()
+        else:
+            chunks = response.content.iter_chunked(self.chunk_size)
+        
+        try:
+            async for chunk in chunks:
+                if not self.running:
+                    break
+                
+                chunk_len = len(chunk)
+                total_size += chunk_len
+                stripe.downloaded_bytes += chunk_len
+                if progress is not None:
+                    progress.bytes += chunk_len
+                chunk_count += 1
+                
+                # 立即丢弃chunk
+                del chunk
+                
+                if watchdog is not None:
+                    watchdog.update(chunk_len)
+                
+                if limited:
+                    delay = reserve_all(limiters, chunk_len)
+                    if delay > 0:
+                        if watchdog is not None:
+                            watchdog.pause(delay)
+                        await asyncio.sleep(delay)
+        except StalledStreamError as e:
+            # 记录中断前已收到的字节数和分块数，分段下载据此归还剩余区间
+            e.received = total_size
+            e.chunks = chunk_count
+            raise
+        
+        stripe.observe_phase('body', time.monotonic() - started)
+        return total_size, chunk_count
     
-    def is_memory_safe(self):
-        """检查内存是否安全"""
-        memory_usage = self.get_memory_usage()
-        return memory_usage < self.max_memory_mb
+    async def _download_ranges(self, session, url, total_length, limiters, policy, start=0):
+        """用多个并发 Range 请求下载同一个文件的 [start, total_length) 部分，返回 (字节数, 分块数)"""
+        planner = SegmentPlanner(total_length, self.range_streams, start=start)
+        total_size = 0
+        chunk_count = 0
+        stalls = 0
+        
+        async def stream_worker():
+            nonlocal total_size, chunk_count, stalls
+            while self.running:
+                segment = planner.next_segment()
+                if segment is None:
+                    return
+                start, end = segment
+                started = time.monotonic()
+                headers = {'Range': f'bytes={start}-{end}'}
+                try:
+                    async with await self._open(session, url, policy, headers) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise aiohttp.ClientPayloadError(f"服务器未按Range返回数据 (HTTP {response.status})")
+                        size, chunks = await self._consume_response(response, limiters, policy.watchdog())
+                except StalledStreamError as e:
+                    # 停滞的区间换一条新连接重新下载，多次停滞则整个文件判定失败
+                    stalls += 1
+                    total_size += e.received
+                    chunk_count += e.chunks
+                    if stalls > self.range_streams * 2:
+                        raise
+                    planner.requeue(start + e.received, end)
+                    continue
+                total_size += size
+                chunk_count += chunks
+                planner.report(size, time.monotonic() - started)
+        
+        tasks = [asyncio.ensure_future(stream_worker()) for _ in range(self.range_streams)]
+        try:
+            # 任一分段失败即整个文件失败，其余分段立即停止，不再占用带宽和限速令牌
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            # 失败、总截止时间到或被取消时结束所有仍在进行的分段
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return total_size, chunk_count
     
-    async def wait_for_memory_safe(self, timeout=30):
-        """等待内存使用降到安全水平"""
-        start_time = time.time()
-        while self.running and time.time() - start_time < timeout:
-            if self.is_memory_safe():
-                return True
-            print(f"内存使用过高 ({self.get_memory_usage():.1f} MB)，等待释放...")
-            await asyncio.sleep(1)
-        return self.is_memory_safe()
+    async def _download_single(self, session, url, limiters, policy):
+        """单连接下载整个文件，返回 (字节数, 分块数)"""
+        if self.raw_client is not None:
+            result = await self.raw_client.download(
+                url, self.metrics.stripe(), limiters, policy, policy.watchdog(), lambda: self.running,
+                wire_bytes=self.wire_bytes, progress=current_download.get())
+            stripe = self.metrics.stripe()
+            stripe.observe_ttfb(result.ttfb)
+            stripe.observe_phase('body', result.body)
+            return result.size, result.reads
+        async with await self._open(session, url, policy) as response:
+            response.raise_for_status()
+            # 读完响应后连接归还连接池，先取得传输以便结束时采样 TCP_INFO
+            transport = self._transport(response) if self.socket_profile.enabled else None
+            result = await self._consume_response(response, limiters, policy.watchdog())
+            if transport is not None:
+                self.socket_profile.observe(transport.get_extra_info('socket'))
+            return result
     
-    def load_urls_from_file(self, filename='urls.txt'):
-        """从文件加载URL列表"""
-        urls = []
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        urls.append(line)
-            print(f"从 {filename} 加载了 {len(urls)} 个URL")
-        else:
-            urls = [
-                "https://httpbin.org/bytes/102400",
-                "https://httpbin.org/bytes/1048576",
-                "https://httpbin.org/bytes/5242880",
-            ]
-            print(f"使用默认测试URL ({len(urls)} 个)")
-        return urls
+    async def _download_body(self, session, url, limiters, policy, expected_size=None):
+        """下载一个文件的响应体，大文件且服务器支持 Range 时自动分段并发，返回 (字节数, 分块数, 连接数)"""
+        # urls.txt 标注了大小且小于分段阈值时无需探测
+        known_small = expected_size is not None and expected_size < self.range_min_size
+        if (self.range_streams <= 1 or known_small or
+                (url in self._range_support and self._range_support[url] is None)):
+            size, chunks = await self._download_single(session, url, limiters, policy)
+            return size, chunks, 1
+        
+        probe_size = probe_chunks = 0
+        total_length = self._range_support.get(url)
+        if total_length is None:
+            # 用 1 字节的 Range 请求探测：返回 206 说明支持分段；返回 200 则直接把它当作单连接下载
+            async with await self._open(session, url, policy, {'Range': 'bytes=0-0'}) as response:
+                response.raise_for_status()
+                if response.status == 206:
+                    total_length = parse_content_range_total(response.headers.get('Content-Range'))
+                probe_size, probe_chunks = await self._consume_response(response, limiters, policy.watchdog())
+                if response.status != 206:
+                    self._remember_range_support(url, None)
+                    return probe_size, probe_chunks, 1
+            
+            if total_length is None or total_length < self.range_min_size:
+                self._remember_range_support(url, None)
+                # 单连接重新下载整个文件，探测取回的字节包含在其中，不再重复计入文件大小
+                size, chunks = await self._download_single(session, url, limiters, policy)
+                return size, chunks + probe_chunks, 1
+            self._remember_range_support(url, total_length)
+        
+        # 探测已取回文件开头的字节，分段从其后开始，文件大小不多算也不重复下载
+        size, chunks = await self._download_ranges(session, url, total_length, limiters, policy,
+                                                   start=probe_size)
+        return size + probe_size, chunks + probe_chunks, self.range_streams
 
-    async def async_download_and_discard(self, session, url, timeout=30, max_speed_kbps=0):
-        """异步下载文件并丢弃，支持限速"""
+    def _remember_range_support(self, url, total_length):
+        """缓存URL的分段探测结果；超长URL列表下只保留最近的记录，内存占用有上限"""
+        if len(self._range_support) >= 4096 and url not in self._range_support:
+            del self._range_support[next(iter(self._range_support))]
+        self._range_support[url] = total_length
+
+    async def async_download_and_discard(self, session, url, timeout=None, max_speed_kbps=0,
+                                         expected_size=None):
+        """异步下载文件并丢弃，支持限速；timeout 为该URL的 TimeoutPolicy，默认使用全局配置，
+        expected_size 为 urls.txt 中标注的预期大小"""
         if not self.running:
             return False
             
-        # 检查内存安全
-        if not self.is_memory_safe():
-            print(f"⚠️ 内存使用过高，跳过下载: {url}")
+        # 内存接近上限时暂缓接纳新下载，长时间不能回落时跳过URL
+        if not await self.wait_for_memory_safe():
+            if self.running:
+                logger.warning(f"⚠️ 内存长时间高于上限，跳过: {url}", extra={'throttle': True, 'url': url})
+            self.health.release(url)
             return False
         
+        policy = timeout or self.timeout_policy
+        
         # 并发控制
         self.active_downloads += 1
+        started = time.monotonic()
+        # 分段下载的子任务继承上下文，共同累加这个下载的进度
+        progress = self.inflight.start(url)
+        token = current_download.set(progress)
         
         try:
-            async with session.get(url, timeout=timeout) as response:
-                response.raise_for_status()
-                
-                total_size = 0
-                chunk_count = 0
-                
-                if max_speed_kbps > 0:
-                    # 计算限速参数
-                    bytes_per_second = max_speed_kbps * 1024
-                    chunk_size = min(self.chunk_size, 4096)
-                    calls_per_second = bytes_per_second / chunk_size
-                    
-                    @throttle(rate=calls_per_second if calls_per_second > 0 else 1)
-                    async def process_chunk(chunk):
-                        nonlocal total_size, chunk_count
-                        if not self.running:
-                            return False
-                        
-                        chunk_size = len(chunk)
-                        total_size += chunk_size
-                        self.downloaded_bytes += chunk_size
-                        chunk_count += 1
-                        
-                        # 定期垃圾回收
-                        if chunk_count % 100 == 0:
-                            gc.collect()
-                        
-                        # 立即丢弃chunk
-                        del chunk
-                        return True
-                
-                    async for chunk in response.content.iter_chunked(chunk_size):
-                        if not self.running:
-                            return False
-                        await process_chunk(chunk)
-                else:
-                    # 无速度限制
-                    async for chunk in response.content.iter_chunked(min(self.chunk_size, 4096)):
-                        if not self.running:
-                            return False
-                        
-                        chunk_size = len(chunk)
-                        total_size += chunk_size
-                        self.downloaded_bytes += chunk_size
-                        chunk_count += 1
-                        
-                        # 定期垃圾回收
-                        if chunk_count % 100 == 0:
-                            gc.collect()
-                        
-                        # 立即丢弃chunk
-                        del chunk
-                
-                # 最终垃圾回收
-                gc.collect()
-                
-                speed_info = ""
-                if max_speed_kbps > 0:
-                    speed_info = f" (限速: {max_speed_kbps} KB/s)"
-                    
-                memory_info = f" [内存: {self.get_memory_usage():.1f} MB]"
-                print(f"✓ 成功下载并丢弃: {url} (大小: {total_size} 字节, 分块: {chunk_count}){speed_info}{memory_info}")
-                return True
-                
+            # 单文件限速器与全局限速器按字节计量，取两者中最严格的等待时间
+            # 突发量与线程引擎相同，两个引擎按同样的精度执行单文件限速
+            file_limiter = per_download_limiter(max_speed_kbps, self.pacing_granularity)
+            limiters = (self.rate_limiter, file_limiter)
+            
+            download = self._download_body(session, url, limiters, policy, expected_size)
+            if policy.total_deadline > 0:
+                # 总截止时间覆盖整个文件（含所有分段连接）
+                download = asyncio.wait_for(download, policy.total_deadline)
+            total_size, chunk_count, streams = await download
+            if not self.running:
+                return False
+            
+            self._record_success(url, total_size, chunk_count, started, max_speed_kbps,
+                                 expected_size, streams)
+            return True
+        
+        except asyncio.TimeoutError as e:
+            self._record_failure(url, e, started, f"超时 ({policy.describe()})")
+            return False
         except Exception as e:
-            print(f"✗ 下载失败 {url}: {e}")
+            self._record_failure(url, e, started)
             return False
         finally:
+            current_download.reset(token)
+            self.inflight.finish(progress)
             self.active_downloads -= 1
 
-    def print_statistics(self):
-        """打印统计信息"""
-        elapsed_time = time.time() - self.start_time
-        total_mb = self.downloaded_bytes / (1024 * 1024)
-        avg_speed = total_mb / elapsed_time if elapsed_time > 0 else 0
-        memory_usage = self.get_memory_usage()
+    async def warm_connections(self, session):
+        """为本轮下载过的主机预先建立连接
+
+        raw 传输直接建立空闲连接；aiohttp 没有公开的预连接接口，对每条连接发送一个 HEAD 请求，
+        结束后连接留在连接池中（不计入请求统计）。
+        """
+        count = self._warm_count()
+        urls = self.warm_targets.urls()
+        if count <= 0 or not urls:
+            return
+        policy = self.timeout_policy
+        
+        async def warm(url):
+            try:
+                if self.raw_client is not None:
+                    await self.raw_client.warm(url, count, policy)
+                    return
+                async with session.head(url, allow_redirects=False, trace_request_ctx=WARM_REQUEST,
+                                        timeout=policy.aiohttp_timeout()) as response:
+                    await response.read()
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                logger.debug(f"预热连接失败 {url}: {e}")
         
-        print(f"\n📊 统计信息:")
-        print(f"   运行时间: {elapsed_time:.1f} 秒")
-        print(f"   总下载量: {total_mb:.2f} MB")
-        print(f"   平均速度: {avg_speed:.2f} MB/s")
-        print(f"   内存使用: {memory_usage:.1f} MB / {self.max_memory_mb} MB")
-        print(f"   活跃下载: {self.active_downloads}/{self.max_active_downloads}")
+        if self.raw_client is not None:
+            await asyncio.gather(*[warm(url) for url in urls])
+        else:
+            await asyncio.gather(*[warm(url) for url in urls for _ in range(count)])
+        logger.debug(f"已为 {len(urls)} 个主机预热 {count} 个连接")
 
     async def async_batch_download(self, urls, interval=1, repeat_count=None, 
-                                 max_speed_kbps=0, per_download_speed_kbps=0):
-        """异步批量下载，支持限速"""
+                                 max_speed_kbps=0, per_download_speed_kbps=0, stats_interval=30):
+        """异步批量下载，支持限速；urls 可以是URL列表或 URLCatalog，每 stats_interval 秒输出一次统计"""
         count = 0
+        last_stats = time.monotonic()
+        catalog = self._catalog(urls)
+        self._start_run(max_speed_kbps)
         
-        # 重置统计
-        self.downloaded_bytes = 0
-        self.start_time = time.time()
-        
-        # 设置超时
-        timeout = aiohttp.ClientTimeout(total=30)
-        
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with self.open_session() as session:
             while self.running and (repeat_count is None or count < repeat_count):
                 count += 1
-                print(f"\n--- 第 {count} 轮下载开始 ---")
-                print(f"异步并发下载: {self.max_active_downloads} 最大并发")
-                
-                if max_speed_kbps > 0:
-                    print(f"全局限速: {max_speed_kbps} KB/s")
-                if per_download_speed_kbps > 0:
-                    print(f"单文件限速: {per_download_speed_kbps} KB/s")
+                self.warm_targets.clear()
+                logger.debug(f"\n--- 第 {count} 轮下载开始 ---\n"
+                             f"异步并发下载: {self.max_active_downloads} 最大并发 (上限 {self.concurrency.max_limit})")
                 
                 # 检查内存状态
-                if not self.is_memory_safe():
-                    print("⚠️ 内存使用过高，等待释放...")
-                    if not await self.wait_for_memory_safe():
-                        print("❌ 内存释放超时，跳过本轮下载")
-                        continue
+                if not self.memory_governor.admission.is_set():
+                    logger.warning("⚠️ 内存使用过高，等待释放...")
+                    # 长时间不能回落时照常开始本轮，由每个下载自行跳过
+                    await self.wait_for_memory_safe()
                 
-                # 使用信号量限制并发
-                semaphore = asyncio.Semaphore(self.max_active_downloads)
+                # 固定数量的协程从目录中逐条领取URL，在途任务数与列表长度无关
+                entries = catalog.entries()
+                finished = 0
+                success_count = 0
+                skipped = 0
+                exhausted = threading.Event()
                 
-                async def download_with_semaphore(url):
-                    async with semaphore:
-                        return await self.async_download_and_discard(
-                            session, url, 
-                            max_speed_kbps=per_download_speed_kbps
+                async def worker(index):
+                    nonlocal finished, success_count, skipped
+                    while await self.wait_for_worker_slot(index, exhausted):
+                        entry = next(entries, None)
+                        if entry is None:
+                            exhausted.set()
+                            return
+                        # 熔断中的URL本轮跳过，槽位留给能正常下载的来源
+                        if not self.health.allow(entry.url):
+                            skipped += 1
+                            continue
+                        ok = await self.async_download_and_discard(
+                            session, entry.url,
+                            max_speed_kbps=entry.speed_kbps or per_download_speed_kbps,
+                            expected_size=entry.size
                         )
+                        finished += 1
+                        if ok:
+                            success_count += 1
                 
-                # 创建所有下载任务
-                tasks = [download_with_semaphore(url) for url in urls]
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                # 统计结果
-                success_count = sum(1 for r in results if r is True)
-                print(f"本轮完成: {success_count}/{len(urls)} 个文件")
+                # 按并发上限启动协程，编号超出当前并发数的协程暂停等待
+                try:
+                    await asyncio.gather(*[worker(i) for i in range(self.concurrency.max_limit)])
+                finally:
+                    entries.close()
                 
-                # 打印统计信息
-                self.print_statistics()
+                last_stats = self._finish_round(count, success_count, finished, skipped,
+                                                last_stats, stats_interval)
                 
                 if (self.running and 
                     (repeat_count is None or count < repeat_count)):
-                    print(f"等待 {interval} 秒后开始下一轮...")
+                    logger.debug(f"等待 {interval} 秒后开始下一轮...")
                     
-                    # 在等待期间强制垃圾回收
-                    gc.collect()
-                    
-                    # 分段等待以便响应停止信号
+                    # 分段等待以便响应停止信号；最后一秒预先建立下一轮要用的连接
                     for i in range(interval):
                         if not self.running:
                             break
-                        # 每5秒检查一次内存
-                        if i % 5 == 0:
-                            memory_usage = self.get_memory_usage()
-                            if memory_usage > self.max_memory_mb * 0.8:
-                                print(f"⚠️ 内存使用较高: {memory_usage:.1f} MB，提前垃圾回收")
-                                gc.collect()
-                        await asyncio.sleep(1)
+                        if i == interval - 1 and self.pool_policy.warm > 0:
+                            warm_started = time.monotonic()
+                            await self.warm_connections(session)
+                            await asyncio.sleep(max(0.0, 1 - (time.monotonic() - warm_started)))
+                        else:
+                            await asyncio.sleep(1)
 
-async def main_async():
-    # 从环境变量获取配置
-    max_memory_mb = int(os.getenv('MAX_MEMORY_MB', '100'))
-    chunk_size = int(os.getenv('CHUNK_SIZE', '8192'))
-    
-    manager = AsyncTrafficFlowManager(
-        max_memory_mb=max_memory_mb,
-        chunk_size=chunk_size
-    )
-    
-    interval = int(os.getenv('DOWNLOAD_INTERVAL', '1'))
-    repeat_count = os.getenv('REPEAT_COUNT')
-    repeat_count = int(repeat_count) if repeat_count else None
-    max_speed_kbps = int(os.getenv('MAX_SPEED_KBPS', '0'))
-    per_download_speed_kbps = int(os.getenv('PER_DOWNLOAD_SPEED_KBPS', '0'))
-    
-    # 加载URL列表
-    urls = manager.load_urls_from_file('/app/urls.txt')
-    
-    print("=" * 60)
-    print("🚀 TrafficFlow - 异步网络流量测试工具")
-    print("=" * 60)
-    print(f"监控 URL 数量: {len(urls)}")
-    print(f"下载间隔: {interval} 秒")
-    print(f"最大并发下载: {manager.max_active_downloads}")
-    print(f"内存限制: {max_memory_mb} MB")
-    print(f"块大小: {chunk_size} 字节")
-    print(f"重复次数: {'无限' if repeat_count is None else repeat_count}")
-    if max_speed_kbps > 0:
-        print(f"全局限速: {max_speed_kbps} KB/s")
-    if per_download_speed_kbps > 0:
-        print(f"单文件限速: {per_download_speed_kbps} KB/s")
-    print("=" * 60)
-    print("按 Ctrl+C 停止程序")
-    
-    try:
-        await manager.async_batch_download(
-            urls=urls,
-            interval=interval,
-            repeat_count=repeat_count,
-            max_speed_kbps=max_speed_kbps,
-            per_download_speed_kbps=per_download_speed_kbps
-        )
-    except Exception as e:
-        print(f"程序异常: {e}")
-    finally:
-        print("\n" + "=" * 60)
-        print("最终统计信息:")
-        manager.print_statistics()
-        print("TrafficFlow 异步版本已停止")
+    async def async_continuous_download(self, urls, repeat_count=None, max_speed_kbps=0,
+                                        per_download_speed_kbps=0, host_weights=None,
+                                        stats_interval=30):
+        """连续调度模式：始终保持 N 个下载在途，任一下载结束立即补位；urls 可以是URL列表或 URLCatalog"""
+        self._start_run(max_speed_kbps)
+        scheduler = CatalogScheduler(self._catalog(urls), host_weights, passes=repeat_count)
+        
+        finished = 0
+        success_count = 0
+        
+        logger.info(f"\n--- 连续调度模式: 保持 {self.max_active_downloads} 个下载在途 (自适应上限 {self.concurrency.max_limit}) ---")
+        
+        exhausted = threading.Event()
+        
+        async with self.open_session() as session:
+            async def worker(index):
+                nonlocal finished, success_count
+                while await self.wait_for_worker_slot(index, exhausted):
+                    # 内存过高时暂缓领取新任务；长时间不能回落时照常领取，由下载跳过，不永久阻塞
+                    await self.wait_for_memory_safe()
+                    entry = scheduler.next()
+                    if entry is None:
+                        exhausted.set()
+                        return
+                    if not self.health.allow(entry.url):
+                        await self.wait_for_breakers()
+                        continue
+                    ok = await self.async_download_and_discard(
+                        session, entry.url,
+                        max_speed_kbps=entry.speed_kbps or per_download_speed_kbps,
+                        expected_size=entry.size
+                    )
+                    finished += 1
+                    if ok:
+                        success_count += 1
+            
+            async def reporter():
+                while self.running:
+                    await asyncio.sleep(stats_interval)
+                    self.print_statistics()
+            
+            reporter_task = asyncio.ensure_future(reporter())
+            try:
+                await asyncio.gather(*[worker(i) for i in range(self.concurrency.max_limit)])
+            finally:
+                reporter_task.cancel()
+        
+        logger.info(f"\n连续调度结束: 成功 {success_count}/{finished} 个文件")
+
+    def statistics_lines(self):
+        return [f"   事件循环延迟: {self.loop_lag.summary()}"]
+
+    def state_lines(self):
+        return [f"   事件循环延迟: 最近 {self.loop_lag.last_lag * 1000:.1f} ms, {self.loop_lag.summary()}"]
+
+    async def run_async(self, catalog, config):
+        """按配置的调度模式运行下载，同时在后台测量事件循环延迟"""
+        monitor = asyncio.ensure_future(self.loop_lag.run())
+        try:
+            await self._run_schedule(catalog, config)
+        finally:
+            monitor.cancel()
+
+    async def _run_schedule(self, catalog, config):
+        if config['schedule_mode'] == 'continuous':
+            await self.async_continuous_download(
+                urls=catalog,
+                repeat_count=config['repeat_count'],
+                max_speed_kbps=config['max_speed_kbps'],
+                per_download_speed_kbps=config['per_download_speed_kbps'],
+                host_weights=config['host_weights'],
+                stats_interval=config['stats_interval']
+            )
+        else:
+            await self.async_batch_download(
+                urls=catalog,
+                interval=config['interval'],
+                repeat_count=config['repeat_count'],
+                max_speed_kbps=config['max_speed_kbps'],
+                per_download_speed_kbps=config['per_download_speed_kbps'],
+                stats_interval=config['stats_interval']
+            )
+
+    def run(self, catalog, config):
+        """在新的事件循环中运行下载，EVENT_LOOP 选择 uvloop 或标准 asyncio"""
+        event_loop = setup_event_loop(config['event_loop'])
+        logger.info(f"事件循环: {event_loop}")
+        asyncio.run(self.run_async(catalog, config))
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
\ No newline at end of file
+    main(default_engine='asyncio')
@@ -1,289 +1,468 @@
 import requests
+import socket
 import time
+import urllib3
 import threading
 from concurrent.futures import ThreadPoolExecutor
-import sys
-import os
-import signal
-import math
-import psutil
-import gc
+from http_pool import HostSessionPool
+from log_config import get_logger
+from rate_limiter import Pacer
+from socket_tuning import SplicePool
+from timeouts import DeadlineExceededError, StalledStreamError
+from traffic_flow import BaseTrafficFlowManager, main
+from url_catalog import CatalogScheduler
+from wire_bytes import response_head_size
 
-class TrafficFlowManager:
-    def __init__(self, max_memory_mb=100, chunk_size=8192):
-        self.running = True
-        self.downloaded_bytes = 0
-        self.start_time = time.time()
-        self.max_memory_mb = max_memory_mb
-        self.chunk_size = chunk_size
-        self.active_downloads = 0
-        self.max_active_downloads = 3
+logger = get_logger('sync')
+
+class TrafficFlowManager(BaseTrafficFlowManager):
+    """线程池引擎：固定数量的线程用 requests 下载，适合URL较少、并发不高的场景"""
+
+    engine = 'thread'
+    DEFAULT_INITIAL_CONCURRENCY = 3
+    DEFAULT_MAX_CONCURRENCY = 16
+    DEFAULT_INTERVAL = 2
+
+    def __init__(self, *args, **kwargs):
+        # 丢弃模式：每个线程复用一块预分配缓冲区，用 readinto 直接读入，不产生 bytes 对象
+        self._thread_local = threading.local()
         
-        # 根据内存限制调整并发数
-        self.adjust_concurrency_based_on_memory()
+        # 下载槽位由条件变量保护，避免线程间丢失更新
+        self._slot_condition = threading.Condition()
+        self.slot_waiters = 0
         
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        super().__init__(*args, **kwargs)
+        
+        # 按主机复用 keep-alive 连接，连接池按并发上限分配；设置了每主机连接数时按它限制并阻塞等待空闲连接
+        socket_options = self.socket_profile.socket_options() if self.socket_profile.enabled else None
+        limit_per_host = self.pool_policy.limit_per_host
+        self.session_pool = HostSessionPool(pool_maxsize=limit_per_host or self.concurrency.max_limit,
+                                            pool_block=limit_per_host > 0, keepalive=self.pool_policy.keepalive,
+                                            dns_cache=self.dns_cache, connection_stats=self.connection_stats,
+                                            socket_options=socket_options, metrics=self.metrics)
+        # splice 丢弃使用的管道，按下载借还
+        self.splice_pool = SplicePool() if self.socket_profile.splice else None
     
-    def adjust_concurrency_based_on_memory(self):
-        """根据可用内存调整并发数"""
-        try:
-            available_memory = psutil.virtual_memory().available / (1024 * 1024)
-            safe_concurrency = max(1, min(10, int(available_memory * 0.1 / 10)))
-            self.max_active_downloads = min(self.max_active_downloads, safe_concurrency)
-            print(f"可用内存: {available_memory:.1f} MB, 设置最大并发数: {self.max_active_downloads}")
-        except Exception as e:
-            print(f"内存检测失败，使用默认并发数: {e}")
+    @classmethod
+    def concurrency_limit(cls, config):
+        # 工作线程数即并发上限
+        return min(config['max_concurrency'], config['max_workers'])
     
-    def signal_handler(self, signum, frame):
-        print(f"\n接收到信号 {signum}，正在停止程序...")
-        self.running = False
+    def wait_for_memory_safe(self):
+        """等待内存管理器放行新下载；暂停接纳超过 memory_wait_timeout 秒后不再等待，由调用方跳过"""
+        while self.running:
+            # 分段等待以便响应停止信号；停滞后每次调用仍等待1秒，跳过不会空转
+            if self.memory_governor.wait_for_admission(timeout=1):
+                return True
+            if self.memory_governor.stalled(self.memory_wait_timeout):
+                break
+        return self.memory_governor.admission.is_set()
     
-    def get_memory_usage(self):
-        """获取当前内存使用量"""
-        try:
-            process = psutil.Process(os.getpid())
-            return process.memory_info().rss / (1024 * 1024)
-        except:
-            return 0
+    def wait_for_breakers(self):
+        """URL被熔断跳过后等到最早的熔断器重新放行，避免在熔断中的来源之间空转；分段等待以便响应停止信号"""
+        deadline = time.monotonic() + self.health.retry_after()
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(1.0, remaining))
     
-    def is_memory_safe(self):
-        """检查内存是否安全"""
-        memory_usage = self.get_memory_usage()
-        return memory_usage < self.max_memory_mb
+    def wait_for_worker_slot(self, index, exhausted):
+        """编号超出当前并发上限的线程（流量计划暂停时为全部线程）暂停领取任务，直到可以继续、任务领完或程序停止"""
+        while (self.running and (index >= self.max_active_downloads or self.paused)
+               and not exhausted.is_set()):
+            exhausted.wait(0.5)
+        return self.running and not exhausted.is_set()
     
-    def wait_for_memory_safe(self, timeout=30):
-        """等待内存使用降到安全水平"""
-        start_time = time.time()
-        while self.running and time.time() - start_time < timeout:
-            if self.is_memory_safe():
-                return True
-            print(f"内存使用过高 ({self.get_memory_usage():.1f} MB)，等待释放...")
-            time.sleep(1)
-        return self.is_memory_safe()
+    def acquire_download_slot(self, timeout=300):
+        """等待并占用一个下载槽位，超时或程序停止时返回 False"""
+        deadline = time.time() + timeout
+        with self._slot_condition:
+            if self.active_downloads >= self.max_active_downloads:
+                logger.debug(f"⚠️ 并发数已达上限({self.max_active_downloads})，等待下载槽位...")
+            self.slot_waiters += 1
+            try:
+                while self.active_downloads >= self.max_active_downloads:
+                    remaining = deadline - time.time()
+                    if not self.running or remaining <= 0:
+                        return False
+                    # 分段等待以便响应停止信号
+                    self._slot_condition.wait(min(1, remaining))
+            finally:
+                self.slot_waiters -= 1
+            self.active_downloads += 1
+            return True
+    
+    def release_download_slot(self):
+        """释放下载槽位并唤醒一个等待者"""
+        with self._slot_condition:
+            self.active_downloads -= 1
+            self._slot_condition.notify()
+
+    def _get_sink_buffer(self):
+        """获取当前线程的预分配接收缓冲区"""
+        buffer = getattr(self._thread_local, 'sink_buffer', None)
+        if buffer is None:
+            buffer = memoryview(bytearray(self.sink_buffer_size))
+            self._thread_local.sink_buffer = buffer
+        return buffer
     
-    def load_urls_from_file(self, filename='urls.txt'):
-        """从文件加载URL列表"""
-        urls = []
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        urls.append(line)
-            print(f"从 {filename} 加载了 {len(urls)} 个URL")
+    def _splice_body(self, response, fp, sock, read_size=None):
+        """用 splice 在内核中丢弃明文HTTP响应体，只返回每段的字节数"""
+        # http.client 的缓冲区中已经读入的部分先正常读出
+        buffered = min(len(fp.fp.peek()), fp.length)
+        if buffered:
+            yield len(fp.read(buffered))
+        sink = self.splice_pool.acquire()
+        spliced = 0
+        try:
+            for moved in sink.discard(sock, fp.length, read_size or self.sink_buffer_size, sock.gettimeout()):
+                fp.length -= moved
+                spliced += moved
+                yield moved
+        except Exception:
+            # 出错时管道中可能残留数据，不再复用
+            sink.close()
+            raise
         else:
-            urls = [
-                "https://httpbin.org/bytes/102400",
-                "https://httpbin.org/bytes/1048576",
-                "https://httpbin.org/bytes/5242880",
-            ]
-            print(f"使用默认测试URL ({len(urls)} 个)")
-        
-        return urls
+            self.splice_pool.release(sink)
+        finally:
+            self.socket_profile.record_splice(spliced)
+        # 让 http.client/urllib3 感知响应结束，以便连接回到连接池
+        response.raw.read()
 
-    def limit_download_speed(self, chunk, max_speed_kbps):
-        """限制下载速度"""
-        if max_speed_kbps <= 0:
-            return
-            
-        chunk_size = len(chunk)
-        expected_time = chunk_size / (max_speed_kbps * 1024 / 8)
-        
-        actual_time = time.time() - getattr(self, '_last_chunk_time', time.time())
-        if actual_time < expected_time:
-            sleep_time = expected_time - actual_time
-            time.sleep(sleep_time)
-        
-        self._last_chunk_time = time.time()
+    def _iter_watched(self, response, fp, sock, read_size, watchdog, idle_timeout):
+        """看门狗开启时逐次读取：每次最多一个系统调用，套接字超时不超过看门狗判定前的剩余时间，
+        慢速涓流或完全停顿都能按时触发总截止时间和最低吞吐检查"""
+        read1 = fp.read1
+        while True:
+            left = watchdog.time_left()
+            timeout = idle_timeout if left is None else min(idle_timeout, max(left, 0.001))
+            sock.settimeout(timeout)
+            try:
+                chunk = read1(read_size)
+            except socket.timeout:
+                # 超时由看门狗的剩余时间决定时，按截止时间或停滞报告
+                if timeout < idle_timeout:
+                    watchdog.expire()
+                raise
+            if not chunk:
+                break
+            yield len(chunk)
+            del chunk
+        # 让 urllib3 感知响应结束，以便连接回到连接池
+        response.raw.read()
+
+    def _iter_chunk_sizes(self, response, chunk_size, read_size=None, watchdog=None, idle_timeout=None):
+        """逐块读取响应体并立即丢弃，只返回每块的字节数；read_size 限制丢弃模式单次读取的大小，
+        watchdog 开启时每次读取的等待不超过它判定前的剩余时间"""
+        fp = getattr(response.raw, '_fp', None)
+        if watchdog is not None and hasattr(fp, 'read1'):
+            sock = self._response_socket(response)
+            if sock is not None:
+                # 读取未解压的原始数据，与丢弃模式和线路字节模式一致
+                yield from self._iter_watched(response, fp, sock, read_size or chunk_size, watchdog, idle_timeout)
+                return
+        sock = self._response_socket(response) if self.splice_pool is not None else None
+        # splice 只用于已知长度的明文响应：TLS 数据必须在用户态解密，分块编码需要解析块边界
+        if (type(sock) is socket.socket and getattr(fp, 'length', None)
+                and not getattr(fp, 'chunked', True)):
+            yield from self._splice_body(response, fp, sock, read_size)
+        elif self.sink_mode and hasattr(fp, 'readinto'):
+            # 直接从底层 http.client 响应 readinto 到复用缓冲区
+            buffer = self._get_sink_buffer()
+            if read_size:
+                buffer = buffer[:read_size]
+            readinto = fp.readinto
+            while True:
+                nbytes = readinto(buffer)
+                if not nbytes:
+                    break
+                yield nbytes
+            # 让 urllib3 感知响应结束，以便连接回到连接池
+            response.raw.read()
+        elif self.wire_bytes:
+            # 线路字节模式跳过 urllib3 的解压（丢弃模式的 readinto 本来就读取未解压的原始数据）
+            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                yield len(chunk)
+                del chunk
+        else:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield len(chunk)
+                del chunk
 
-    def download_and_discard(self, url, timeout=30, max_speed_kbps=0):
-        """下载文件并直接丢弃内容"""
+    def _response_socket(self, response):
+        """响应所在连接的套接字，连接已归还连接池时为 None"""
+        connection = getattr(response.raw, '_connection', None)
+        return getattr(connection, 'sock', None)
+
+    def _set_idle_timeout(self, response, seconds):
+        """收到响应头后把套接字超时从首字节超时切换为空闲读超时"""
+        sock = self._response_socket(response)
+        if sock is not None:
+            sock.settimeout(seconds)
+
+    def download_and_discard(self, url, timeout=None, max_speed_kbps=0, expected_size=None):
+        """下载文件并直接丢弃内容；timeout 为该URL的 TimeoutPolicy，默认使用全局配置，
+        expected_size 为 urls.txt 中标注的预期大小"""
         if not self.running:
             return False
         
-        if not self.is_memory_safe():
-            print(f"⚠️ 内存使用过高，跳过下载: {url}")
+        policy = timeout or self.timeout_policy
+        
+        # 内存接近上限时暂缓接纳新下载，长时间不能回落时跳过URL
+        if not self.wait_for_memory_safe():
+            if self.running:
+                logger.warning(f"⚠️ 内存长时间高于上限，跳过: {url}", extra={'throttle': True, 'url': url})
+            self.health.release(url)
             return False
         
-        with threading.Lock():
-            if self.active_downloads >= self.max_active_downloads:
-                print(f"⚠️ 并发数已达上限({self.max_active_downloads})，等待下载槽位...")
-                time.sleep(1)
-                return self.download_and_discard(url, timeout, max_speed_kbps)
-            
-            self.active_downloads += 1
+        if not self.acquire_download_slot():
+            logger.warning(f"✗ 等待下载槽位超时: {url}", extra={'throttle': True, 'url': url})
+            self.health.release(url)
+            return False
         
+        started = time.monotonic()
+        stripe = self.metrics.stripe()
+        progress = self.inflight.start(url)
         try:
-            chunk_size = min(self.chunk_size, 4096)
-            
-            response = requests.get(url, timeout=timeout, stream=True)
-            response.raise_for_status()
+            session = self.session_pool.get(url)
+            self.connection_stats.record_request()
             
-            total_size = 0
-            chunk_count = 0
-            
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if not self.running:
-                    return False
-                
-                total_size += len(chunk)
-                self.downloaded_bytes += len(chunk)
-                chunk_count += 1
+            with session.get(url, timeout=policy.requests_timeout(), stream=True,
+                             headers=self.request_headers) as response:
+                stripe.observe_ttfb(response.elapsed.total_seconds())
+                if self.wire_bytes:
+                    raw = response.raw
+                    stripe.downloaded_bytes += response_head_size(
+                        f"{raw.version // 10}.{raw.version % 10}", raw.status, raw.reason, raw.headers.items())
+                response.raise_for_status()
+                self._set_idle_timeout(response, policy.idle_read)
+                # 读完响应后连接归还连接池，先取得套接字以便结束时采样 TCP_INFO
+                sock = self._response_socket(response)
                 
-                if chunk_count % 100 == 0:
-                    gc.collect()
+                total_size = 0
+                chunk_count = 0
+                watchdog = policy.watchdog(with_deadline=True)
+                # 每个下载流独立的节拍器：全局预算与单文件预算分层叠加
+                pacer = Pacer.for_download(self.rate_limiter, max_speed_kbps, self.pacing_granularity)
+                read_size = pacer.read_size(self.sink_buffer_size) if pacer.enabled else None
+                body_started = time.monotonic()
                 
-                if max_speed_kbps > 0:
-                    self.limit_download_speed(chunk, max_speed_kbps)
+                chunk_sizes = self._iter_chunk_sizes(response, self.chunk_size, read_size,
+                                                     watchdog, policy.idle_read)
+                for chunk_len in chunk_sizes:
+                    if not self.running:
+                        return False
+                    
+                    total_size += chunk_len
+                    stripe.downloaded_bytes += chunk_len
+                    progress.bytes += chunk_len
+                    chunk_count += 1
+                    
+                    if watchdog is not None:
+                        watchdog.update(chunk_len)
+                    
+                    paced = pacer.pace(chunk_len)
+                    # 限速造成的等待不计入看门狗的吞吐统计
+                    if paced and watchdog is not None:
+                        watchdog.pause(paced)
                 
-                del chunk
+                stripe.observe_phase('body', time.monotonic() - body_started)
+                if self.socket_profile.enabled:
+                    self.socket_profile.observe(sock)
             
-            gc.collect()
-            
-            speed_info = ""
-            if max_speed_kbps > 0:
-                speed_info = f" (限速: {max_speed_kbps} KB/s)"
-                
-            memory_info = f" [内存: {self.get_memory_usage():.1f} MB]"
-            print(f"✓ 成功下载并丢弃: {url} (大小: {total_size} 字节, 分块: {chunk_count}){speed_info}{memory_info}")
+            self._record_success(url, total_size, chunk_count, started, max_speed_kbps, expected_size)
             return True
             
-        except requests.exceptions.RequestException as e:
-            print(f"✗ 下载失败 {url}: {e}")
+        except (requests.exceptions.RequestException, OSError,
+                StalledStreamError, DeadlineExceededError) as e:
+            self._record_failure(url, e, started)
             return False
         finally:
-            self.active_downloads -= 1
-            if 'response' in locals():
-                response.close()
+            self.inflight.finish(progress)
+            self.release_download_slot()
+
+    def state_lines(self):
+        return [f"   等待下载槽位: {self.slot_waiters} 个线程"]
 
-    def print_statistics(self):
-        """打印统计信息"""
-        elapsed_time = time.time() - self.start_time
-        total_mb = self.downloaded_bytes / (1024 * 1024)
-        avg_speed = total_mb / elapsed_time if elapsed_time > 0 else 0
-        memory_usage = self.get_memory_usage()
+    def warm_connections(self):
+        """为本轮下载过的主机预先建立连接，返回新建立的连接数"""
+        count = self._warm_count()
+        urls = self.warm_targets.urls()
+        if count <= 0 or not urls:
+            return 0
+        
+        def warm(url):
+            try:
+                return self.session_pool.warm(url, count, self.timeout_policy.connect)
+            except (OSError, urllib3.exceptions.HTTPError) as e:
+                logger.debug(f"预热连接失败 {url}: {e}")
+                return 0
         
-        print(f"\n📊 统计信息:")
-        print(f"   运行时间: {elapsed_time:.1f} 秒")
-        print(f"   总下载量: {total_mb:.2f} MB")
-        print(f"   平均速度: {avg_speed:.2f} MB/s")
-        print(f"   内存使用: {memory_usage:.1f} MB / {self.max_memory_mb} MB")
-        print(f"   活跃下载: {self.active_downloads}/{self.max_active_downloads}")
+        with ThreadPoolExecutor(max_workers=min(len(urls), 8)) as executor:
+            opened = sum(executor.map(warm, urls))
+        logger.debug(f"已为 {len(urls)} 个主机预热连接，新建 {opened} 个")
+        return opened
 
     def batch_download(self, urls, interval=1, max_workers=5, repeat_count=None, 
-                      max_speed_kbps=0, per_download_speed_kbps=0):
-        """批量下载文件"""
+                      max_speed_kbps=0, per_download_speed_kbps=0, stats_interval=30):
+        """批量下载文件；urls 可以是URL列表或 URLCatalog，每 stats_interval 秒输出一次统计"""
         count = 0
+        last_stats = time.monotonic()
+        catalog = self._catalog(urls)
         
-        max_workers = min(max_workers, self.max_active_downloads)
+        # 线程数按并发上限分配，编号超出当前并发数的线程暂停等待
+        max_workers = min(max_workers, self.concurrency.max_limit)
         
-        self.downloaded_bytes = 0
-        self.start_time = time.time()
+        self._start_run(max_speed_kbps)
         
         while self.running and (repeat_count is None or count < repeat_count):
             count += 1
-            print(f"\n--- 第 {count} 轮下载开始 ---")
-            print(f"并发设置: {max_workers} 工作线程, {self.max_active_downloads} 最大并发下载")
-            
-            if max_speed_kbps > 0:
-                print(f"全局限速: {max_speed_kbps} KB/s")
-            if per_download_speed_kbps > 0:
-                print(f"单文件限速: {per_download_speed_kbps} KB/s")
-            
-            if not self.is_memory_safe():
-                print("⚠️ 内存使用过高，等待释放...")
-                if not self.wait_for_memory_safe():
-                    print("❌ 内存释放超时，跳过本轮下载")
-                    continue
+            self.warm_targets.clear()
+            logger.debug(f"\n--- 第 {count} 轮下载开始 ---\n"
+                         f"并发设置: {max_workers} 工作线程, {self.max_active_downloads} 最大并发下载")
             
-            individual_speed = 0
-            if per_download_speed_kbps > 0:
-                individual_speed = per_download_speed_kbps
-            elif max_speed_kbps > 0 and max_workers > 0:
-                individual_speed = max_speed_kbps / max_workers
+            if not self.memory_governor.admission.is_set():
+                logger.warning("⚠️ 内存使用过高，等待释放...")
+                # 长时间不能回落时照常开始本轮，由每个下载自行跳过
+                self.wait_for_memory_safe()
             
-            download_semaphore = threading.Semaphore(self.max_active_downloads)
+            # 全局限速由共享令牌桶保证，不再按线程数平均分配
+            individual_speed = per_download_speed_kbps
             
-            def download_with_semaphore(url):
-                with download_semaphore:
-                    return self.download_and_discard(url, max_speed_kbps=individual_speed)
+            # 固定数量的线程从目录中逐条领取URL，不为每个URL预先创建任务
+            entries = catalog.entries()
+            entries_lock = threading.Lock()
+            results_lock = threading.Lock()
+            results = {'finished': 0, 'success': 0, 'skipped': 0}
+            exhausted = threading.Event()
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                results = list(executor.map(download_with_semaphore, urls))
+            def worker(index):
+                while self.wait_for_worker_slot(index, exhausted):
+                    with entries_lock:
+                        entry = next(entries, None)
+                    if entry is None:
+                        exhausted.set()
+                        return
+                    # 熔断中的URL本轮跳过，槽位留给能正常下载的来源
+                    if not self.health.allow(entry.url):
+                        with results_lock:
+                            results['skipped'] += 1
+                        continue
+                    ok = self.download_and_discard(
+                        entry.url,
+                        max_speed_kbps=entry.speed_kbps or individual_speed,
+                        expected_size=entry.size
+                    )
+                    with results_lock:
+                        results['finished'] += 1
+                        if ok:
+                            results['success'] += 1
             
-            success_count = sum(1 for r in results if r)
-            print(f"本轮完成: {success_count}/{len(urls)} 个文件")
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for index in range(max_workers):
+                        executor.submit(worker, index)
+            finally:
+                entries.close()
             
-            self.print_statistics()
+            last_stats = self._finish_round(count, results['success'], results['finished'],
+                                            results['skipped'], last_stats, stats_interval)
             
             if (self.running and 
                 (repeat_count is None or count < repeat_count)):
-                print(f"等待 {interval} 秒后开始下一轮...")
-                
-                gc.collect()
+                logger.debug(f"等待 {interval} 秒后开始下一轮...")
                 
+                # 分段等待以便响应停止信号；最后一秒预先建立下一轮要用的连接
                 for i in range(interval):
                     if not self.running:
                         break
-                    if i % 5 == 0:
-                        memory_usage = self.get_memory_usage()
-                        if memory_usage > self.max_memory_mb * 0.8:
-                            print(f"⚠️ 内存使用较高: {memory_usage:.1f} MB，提前垃圾回收")
-                            gc.collect()
-                    time.sleep(1)
+                    if i == interval - 1 and self.pool_policy.warm > 0:
+                        warm_started = time.monotonic()
+                        self.warm_connections()
+                        time.sleep(max(0.0, 1 - (time.monotonic() - warm_started)))
+                    else:
+                        time.sleep(1)
 
-def main():
-    max_memory_mb = int(os.getenv('MAX_MEMORY_MB', '100'))
-    chunk_size = int(os.getenv('CHUNK_SIZE', '8192'))
-    
-    manager = TrafficFlowManager(
-        max_memory_mb=max_memory_mb,
-        chunk_size=chunk_size
-    )
-    
-    interval = int(os.getenv('DOWNLOAD_INTERVAL', '2'))
-    max_workers = int(os.getenv('MAX_WORKERS', '3'))
-    repeat_count = os.getenv('REPEAT_COUNT')
-    repeat_count = int(repeat_count) if repeat_count else None
-    max_speed_kbps = int(os.getenv('MAX_SPEED_KBPS', '0'))
-    per_download_speed_kbps = int(os.getenv('PER_DOWNLOAD_SPEED_KBPS', '0'))
-    
-    urls = manager.load_urls_from_file('/app/urls.txt')
-    
-    print("=" * 60)
-    print("🚀 TrafficFlow - 网络流量测试工具")
-    print("=" * 60)
-    print(f"监控 URL 数量: {len(urls)}")
-    print(f"下载间隔: {interval} 秒")
-    print(f"工作线程: {max_workers}")
-    print(f"最大并发下载: {manager.max_active_downloads}")
-    print(f"内存限制: {max_memory_mb} MB")
-    print(f"块大小: {chunk_size} 字节")
-    print(f"重复次数: {'无限' if repeat_count is None else repeat_count}")
-    if max_speed_kbps > 0:
-        print(f"全局限速: {max_speed_kbps} KB/s")
-    if per_download_speed_kbps > 0:
-        print(f"单文件限速: {per_download_speed_kbps} KB/s")
-    print("=" * 60)
-    print("按 Ctrl+C 停止程序")
-    
-    try:
-        manager.batch_download(
-            urls=urls,
-            interval=interval,
-            max_workers=max_workers,
-            repeat_count=repeat_count,
-            max_speed_kbps=max_speed_kbps,
-            per_download_speed_kbps=per_download_speed_kbps
-        )
-    except Exception as e:
-        print(f"程序异常: {e}")
-    finally:
-        print("\n" + "=" * 60)
-        print("最终统计信息:")
-        manager.print_statistics()
-        print("TrafficFlow 已停止")
+    def continuous_download(self, urls, max_workers=5, repeat_count=None, max_speed_kbps=0,
+                            per_download_speed_kbps=0, host_weights=None, stats_interval=30):
+        """连续调度模式：始终保持 N 个下载在途，任一下载结束立即补位；urls 可以是URL列表或 URLCatalog"""
+        max_workers = min(max_workers, self.concurrency.max_limit)
+        self._start_run(max_speed_kbps)
+        scheduler = CatalogScheduler(self._catalog(urls), host_weights, passes=repeat_count)
+        
+        results_lock = threading.Lock()
+        results = {'finished': 0, 'success': 0}
+        stopped = threading.Event()
+        exhausted = threading.Event()
+        
+        logger.info(f"\n--- 连续调度模式: 保持 {self.max_active_downloads} 个下载在途 (自适应上限 {max_workers}) ---")
+        
+        def worker(index):
+            while self.wait_for_worker_slot(index, exhausted):
+                # 内存过高时暂缓领取新任务；长时间不能回落时照常领取，由下载跳过，不永久阻塞
+                self.wait_for_memory_safe()
+                entry = scheduler.next()
+                if entry is None:
+                    exhausted.set()
+                    return
+                if not self.health.allow(entry.url):
+                    self.wait_for_breakers()
+                    continue
+                ok = self.download_and_discard(
+                    entry.url,
+                    max_speed_kbps=entry.speed_kbps or per_download_speed_kbps,
+                    expected_size=entry.size
+                )
+                with results_lock:
+                    results['finished'] += 1
+                    if ok:
+                        results['success'] += 1
+        
+        def reporter():
+            while self.running and not stopped.wait(stats_interval):
+                self.print_statistics()
+        
+        reporter_thread = threading.Thread(target=reporter, daemon=True)
+        reporter_thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for index in range(max_workers):
+                    executor.submit(worker, index)
+        finally:
+            stopped.set()
+        
+        logger.info(f"\n连续调度结束: 成功 {results['success']}/{results['finished']} 个文件")
+
+    def run(self, catalog, config):
+        """按配置的调度模式运行下载"""
+        if config['schedule_mode'] == 'continuous':
+            self.continuous_download(
+                urls=catalog,
+                max_workers=config['max_workers'],
+                repeat_count=config['repeat_count'],
+                max_speed_kbps=config['max_speed_kbps'],
+                per_download_speed_kbps=config['per_download_speed_kbps'],
+                host_weights=config['host_weights'],
+                stats_interval=config['stats_interval']
+            )
+        else:
+            self.batch_download(
+                urls=catalog,
+                interval=config['interval'],
+                max_workers=config['max_workers'],
+                repeat_count=config['repeat_count'],
+                max_speed_kbps=config['max_speed_kbps'],
+                per_download_speed_kbps=config['per_download_speed_kbps'],
+                stats_interval=config['stats_interval']
+            )
+
+    def close(self):
+        super().close()
+        self.session_pool.close()
+        if self.splice_pool is not None:
+            self.splice_pool.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(default_engine='thread')
\ No newline at end of file
@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+
+from metrics import error_class
+from scheduler import url_host
+
+# 这些状态码说明URL本身失效，无需等待连续失败，直接熔断
+PERMANENT_STATUSES = (404, 410)
+
+
+class CircuitBreaker:
+    """单个URL或主机的熔断器
+
+    连续失败 threshold 次后打开，在退避时间内不再调度；退避结束后进入半开状态，
+    只放行一次试探下载：成功则恢复，失败则退避时间翻倍后再次打开。
+    """
+
+    __slots__ = ('failures', 'opens', 'open_until', 'trial_until')
+
+    def __init__(self):
+        self.failures = 0
+        # 连续打开的次数，决定下一次退避时长
+        self.opens = 0
+        self.open_until = 0.0
+        # 半开状态下试探下载的占用期限，期间不放行其他下载
+        self.trial_until = 0.0
+
+    def is_open(self, now):
+        return self.open_until > now
+
+
+class HealthTracker:
+    """按URL和主机跟踪下载健康状态，调度器据此跳过熔断中的来源
+
+    只保存出现过失败的URL，健康的URL不占内存；主机级熔断只统计连接错误、超时和 5xx/429，
+    单个URL返回 404 不影响同主机的其他URL。
+    """
+
+    def __init__(self, url_threshold=3, host_threshold=10, base_backoff=30.0, max_backoff=3600.0,
+                 jitter=0.2, trial_timeout=300.0):
+        self.url_threshold = url_threshold
+        self.host_threshold = host_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.trial_timeout = trial_timeout
+        self._lock = threading.Lock()
+        self._urls = {}
+        self._hosts = {}
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.url_threshold > 0 or self.host_threshold > 0
+
+    def _backoff(self, opens):
+        """第 opens 次打开的退避时间：指数增长，带随机抖动避免同时恢复"""
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (opens - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def allow(self, url):
+        """是否可以调度该URL；熔断中返回 False，半开时占用试探名额并返回 True"""
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            breakers = [breaker for breaker in (self._hosts.get(url_host(url)), self._urls.get(url))
+                        if breaker is not None and breaker.open_until]
+            # 熔断中，或半开状态下已有试探下载在进行
+            if any(breaker.is_open(now) or breaker.trial_until > now for breaker in breakers):
+                self.skipped += 1
+                return False
+            for breaker in breakers:
+                breaker.trial_until = now + self.trial_timeout
+            return True
+
+    def release(self, url):
+        """下载未开始就被跳过（内存过高、等待槽位超时）：归还半开状态的试探名额，不计成功或失败"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for breaker in (self._hosts.get(url_host(url)), self._urls.get(url)):
+                if breaker is not None:
+                    breaker.trial_until = 0.0
+
+    def retry_after(self):
+        """距离最早一个熔断器重新放行的秒数，没有熔断时返回 0；
+        半开状态的试探结果随时可能出来，按1秒计"""
+        now = time.monotonic()
+        waits = []
+        with self._lock:
+            for table in (self._urls, self._hosts):
+                for breaker in table.values():
+                    if breaker.is_open(now):
+                        waits.append(breaker.open_until - now)
+                    elif breaker.trial_until > now:
+                        waits.append(min(1.0, breaker.trial_until - now))
+        return min(waits, default=0.0)
+
+    def _fail(self, table, key, threshold, now, immediate=False):
+        breaker = table.get(key)
+        if breaker is None:
+            breaker = table[key] = CircuitBreaker()
+        elif breaker.is_open(now):
+            # 熔断前已在途的下载陆续失败，不再重复计入
+            return None
+        breaker.failures += 1
+        breaker.trial_until = 0.0
+        half_open = breaker.open_until != 0 and not breaker.is_open(now)
+        if immediate or half_open or breaker.failures >= threshold:
+            breaker.opens += 1
+            breaker.open_until = now + self._backoff(breaker.opens)
+            breaker.failures = 0
+            return breaker.open_until - now
+        return None
+
+    def record_failure(self, url, error):
+        """记录一次失败，返回 (URL熔断秒数, 主机熔断秒数)，未熔断的一项为 None"""
+        if not self.enabled:
+            return None, None
+        status = error_class(error)
+        code = int(status[5:]) if status.startswith('http_') else None
+        now = time.monotonic()
+        url_open = host_open = None
+        with self._lock:
+            if self.url_threshold > 0:
+                url_open = self._fail(self._urls, url, self.url_threshold, now,
+                                      immediate=code in PERMANENT_STATUSES)
+            if self.host_threshold > 0 and (code is None or code >= 500 or code == 429):
+                host_open = self._fail(self._hosts, url_host(url), self.host_threshold, now)
+        return url_open, host_open
+
+    def record_success(self, url):
+        """下载成功：清除该URL和所属主机的失败记录"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._urls.pop(url, None)
+            self._hosts.pop(url_host(url), None)
+
+    def open_count(self):
+        """返回 (熔断中的URL数, 熔断中的主机数)"""
+        now = time.monotonic()
+        with self._lock:
+            urls = sum(1 for breaker in self._urls.values() if breaker.is_open(now))
+            hosts = sum(1 for breaker in self._hosts.values() if breaker.is_open(now))
+        return urls, hosts
+
+    def summary(self):
+        """返回便于打印的健康状态，没有熔断时返回 None"""
+        urls, hosts = self.open_count()
+        if not urls and not hosts and not self.skipped:
+            return None
+        return f"熔断中 {urls} 个URL / {hosts} 个主机, 累计跳过 {self.skipped} 次调度"
+
+
+def describe_open(url_open, host_open):
+    """把 record_failure 的返回值转换为附加在失败日志后的提示"""
+    notes = []
+    if url_open is not None:
+        notes.append(f"URL熔断 {url_open:.0f} 秒")
+    if host_open is not None:
+        notes.append(f"主机熔断 {host_open:.0f} 秒")
+    return f" [{', '.join(notes)}]" if notes else ""
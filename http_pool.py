@@ -0,0 +1,211 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, EmptyPoolError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from dns_cache import is_ip_address
+
+
+class _CachedDNSConnectionMixin:
+    """新建连接时从 DNSCache 取地址：按轮询顺序逐个尝试，并把结果反馈给IP健康状态；
+    建立的每条连接（含被服务器关闭后重新建立的）计入 ConnectionStats，
+    DNS、TCP连接和TLS握手的耗时分别计入 Metrics 的阶段直方图"""
+
+    dns_cache = None
+    connection_stats = None
+    metrics = None
+
+    def connect(self):
+        self._tcp_ready = None
+        super().connect()
+        if self.metrics is not None and self._tcp_ready is not None and isinstance(self, HTTPSConnection):
+            # _new_conn 返回后剩下的是 TLS 握手
+            self.metrics.stripe().observe_phase('tls', time.monotonic() - self._tcp_ready)
+        if self.connection_stats is not None:
+            self.connection_stats.record_connect(warm=getattr(self, '_warming', False))
+
+    def _new_conn(self):
+        started = time.monotonic()
+        sock = self._resolve_and_connect()
+        self._tcp_ready = time.monotonic()
+        if self.metrics is not None:
+            # 未使用DNS缓存时系统解析包含在连接耗时中
+            self.metrics.stripe().observe_phase('connect', self._tcp_ready - started - self._dns_seconds)
+        return sock
+
+    def _resolve_and_connect(self):
+        self._dns_seconds = 0.0
+        host = self._dns_host
+        cache = self.dns_cache
+        if cache is None or is_ip_address(host):
+            return super()._new_conn()
+        started = time.monotonic()
+        try:
+            addresses = cache.resolve(host, self.port, allowed_gai_family())
+        except OSError:
+            # 交给 urllib3 重新解析并抛出它自己的 NameResolutionError
+            return super()._new_conn()
+        self._dns_seconds = time.monotonic() - started
+        if self.metrics is not None:
+            self.metrics.stripe().observe_phase('dns', self._dns_seconds)
+
+        last_error = None
+        try:
+            for _, sockaddr in addresses:
+                self._dns_host = sockaddr[0]
+                try:
+                    sock = super()._new_conn()
+                except (ConnectTimeoutError, NewConnectionError) as e:
+                    cache.mark_failure(sockaddr[0])
+                    last_error = e
+                    continue
+                cache.mark_success(sockaddr[0])
+                return sock
+        finally:
+            self._dns_host = host
+        raise last_error
+
+
+class _IdleExpiringPoolMixin:
+    """空闲超过 keepalive 秒的连接在取出时关闭，下次请求重新建立，与 aiohttp 的 keepalive_timeout 一致"""
+
+    keepalive = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        released_at = getattr(conn, '_released_at', None)
+        if self.keepalive and released_at is not None and time.monotonic() - released_at > self.keepalive:
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._released_at = time.monotonic()
+        super()._put_conn(conn)
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """使用 DNSCache 建立连接并统计新建连接的 HTTPAdapter，dns_cache 为 None 时使用系统解析；
+    socket_options 为新连接在 connect() 之前设置的套接字选项，None 时使用 urllib3 的默认值；
+    keepalive 为空闲连接保留的秒数，None 时不过期"""
+
+    def __init__(self, dns_cache, connection_stats=None, socket_options=None, metrics=None, keepalive=None,
+                 **kwargs):
+        self.dns_cache = dns_cache
+        self.connection_stats = connection_stats
+        self.socket_options = socket_options
+        self.metrics = metrics
+        self.keepalive = keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+        cache = {'dns_cache': self.dns_cache, 'connection_stats': self.connection_stats, 'metrics': self.metrics}
+        http_connection = type('CachedHTTPConnection', (_CachedDNSConnectionMixin, HTTPConnection), cache)
+        https_connection = type('CachedHTTPSConnection', (_CachedDNSConnectionMixin, HTTPSConnection), cache)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CachedHTTPConnectionPool', (_IdleExpiringPoolMixin, HTTPConnectionPool),
+                         {'ConnectionCls': http_connection, 'keepalive': self.keepalive}),
+            'https': type('CachedHTTPSConnectionPool', (_IdleExpiringPoolMixin, HTTPSConnectionPool),
+                          {'ConnectionCls': https_connection, 'keepalive': self.keepalive}),
+        }
+
+
+class HostSessionPool:
+    """按主机维护 requests.Session，复用 keep-alive 连接，避免每个文件重新握手
+
+    pool_block 为 True 时每个主机最多同时打开 pool_maxsize 条连接，超出的请求等待空闲连接；
+    keepalive 为空闲连接保留的秒数。
+    """
+
+    def __init__(self, pool_maxsize=10, pool_block=False, keepalive=None, dns_cache=None, connection_stats=None,
+                 socket_options=None, metrics=None):
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keepalive = keepalive
+        self.dns_cache = dns_cache
+        self.connection_stats = connection_stats
+        self.socket_options = socket_options
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _create_session(self):
+        session = requests.Session()
+        options = dict(pool_connections=1, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+                       max_retries=0)
+        if (self.dns_cache is not None or self.connection_stats is not None or self.socket_options is not None
+                or self.metrics is not None or self.keepalive):
+            adapter = CachedDNSAdapter(self.dns_cache, self.connection_stats, self.socket_options, self.metrics,
+                                       self.keepalive, **options)
+        else:
+            adapter = HTTPAdapter(**options)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url):
+        """获取URL所属主机的会话"""
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}".lower()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+            return session
+
+    def warm(self, url, count, connect_timeout=10):
+        """为URL所属主机准备 count 条已建立的空闲连接，不发送请求，返回新建立的连接数
+
+        从 urllib3 连接池取出空闲连接，未连接或已被服务器关闭的重新建立连接后放回，
+        下一轮的请求直接在这些连接上发出，TCP/TLS握手不再出现在下载的关键路径上。
+        """
+        session = self.get(url)
+        adapter = session.get_adapter(url)
+        # 按发送请求时相同的方式取连接池：连接池键包含代理和证书校验参数
+        settings = session.merge_environment_settings(url, {}, None, None, None)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            pool = adapter.get_connection_with_tls_context(
+                session.prepare_request(requests.Request('GET', url)),
+                settings['verify'], settings['proxies'], settings['cert'])
+        else:
+            pool = adapter.get_connection(url, settings['proxies'])
+        connections = []
+        opened = 0
+        try:
+            for _ in range(min(count, self.pool_maxsize)):
+                # 不等待：队列为空时返回新的未连接对象（限制每主机连接数时不再多取），已断开的连接会被关闭
+                try:
+                    connection = pool._get_conn(timeout=0)
+                except EmptyPoolError:
+                    break
+                connections.append(connection)
+                if connection.sock is None:
+                    connection.timeout = connect_timeout
+                    connection._warming = True
+                    try:
+                        connection.connect()
+                    finally:
+                        connection._warming = False
+                    opened += 1
+        finally:
+            for connection in connections:
+                pool._put_conn(connection)
+        return opened
+
+    def close(self):
+        """关闭所有会话及其连接"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,156 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOGGER_NAME = 'trafficflow'
+# LogRecord 自带的属性，JSON 输出时其余属性视为 extra 字段
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName', 'throttle'}
+
+_state = {'listener': None, 'handler': None, 'options': None}
+
+
+def get_logger(name=None):
+    """获取 trafficflow 下的子日志器，name 一般为模块名"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，extra 传入的字段原样附加，便于日志系统检索"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """按令牌桶限制带 throttle 标记的日志（每个文件一条的成功/失败日志）
+
+    超出速率的日志直接丢弃，不做格式化；下一条放行的日志附带期间省略的条数。
+    横幅、统计等不带标记的日志不受限制。
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate * 5)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0 or not getattr(record, 'throttle', False):
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg} (此前省略 {suppressed} 条)"
+            record.suppressed = suppressed
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时直接丢弃日志，下载循环永远不会因为 stdout 阻塞而等待"""
+
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def enqueue(self, record):
+        # 队列本身不设上限，保证停止时的结束标记总能放入
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def _build_formatter(fmt):
+    if fmt == 'json':
+        return JSONFormatter()
+    # 文本格式保持原来的输出样式，时间戳由 Docker 日志驱动记录
+    return logging.Formatter('%(message)s')
+
+
+def _install(level, fmt, rate, queue_size):
+    """创建队列、后台输出线程和处理器，替换之前安装的处理器"""
+    logger = logging.getLogger(LOGGER_NAME)
+    if _state['handler'] is not None:
+        logger.removeHandler(_state['handler'])
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_build_formatter(fmt))
+    handler = _DroppingQueueHandler(queue.Queue(), queue_size)
+    handler.addFilter(RateLimitFilter(rate))
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    # 不再传给根日志器，避免第三方库配置的处理器重复输出
+    logger.propagate = False
+    _state.update(listener=listener, handler=handler, options=(level, fmt, rate, queue_size))
+
+
+def _reinstall_in_child():
+    # fork 出的子进程没有父进程的输出线程，队列里的锁也可能处于持有状态，重新创建一套
+    if _state['options'] is not None:
+        _state['listener'] = None
+        _install(*_state['options'])
+
+
+def setup_logging(level=None, fmt=None, rate=None, queue_size=None):
+    """配置日志：级别、文本/JSON 格式、逐文件日志的速率上限和队列长度，未指定时读取环境变量
+
+    日志先放入有界队列，由后台线程写到 stdout；多进程模式下 fork 出的子进程自动重新配置。
+    """
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'text')).lower()
+    rate = float(os.getenv('LOG_RATE_LIMIT', '10')) if rate is None else rate
+    queue_size = queue_size or int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    if logging.getLevelName(level) == f"Level {level}":
+        print(f"⚠️ 无效的日志级别: {level}，使用 INFO")
+        level = 'INFO'
+    first = _state['options'] is None
+    shutdown_logging()
+    _install(level, fmt, rate, queue_size)
+    if first:
+        os.register_at_fork(after_in_child=_reinstall_in_child)
+        atexit.register(shutdown_logging)
+    return get_logger()
+
+
+def shutdown_logging():
+    """输出队列中剩余的日志并停止后台线程"""
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()
+
+
+def dropped_count():
+    """因队列已满而丢弃的日志条数"""
+    handler = _state['handler']
+    return handler.dropped if handler is not None else 0
@@ -0,0 +1,145 @@
+import asyncio
+import gc
+import os
+import threading
+import time
+
+import psutil
+
+from log_config import get_logger
+
+logger = get_logger('memory')
+
+# 暂停接纳后，内存降到上限的这个比例以下才恢复
+RESUME_RATIO = 0.8
+# 工作进程在基础占用之上至少预留的内存，用于下载缓冲区和连接
+WORKER_HEADROOM_MB = 20
+
+
+def process_rss_mb():
+    """当前进程的 RSS (MB)，检测失败时返回 0"""
+    try:
+        return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+
+def min_worker_budget_mb(baseline_mb):
+    """fork 出的工作进程至少需要的内存预算：基础占用加预留后仍低于恢复阈值，否则接纳永远不会恢复"""
+    return (baseline_mb + WORKER_HEADROOM_MB) / RESUME_RATIO
+
+
+class MemoryGovernor:
+    """后台内存管理器
+
+    定时采样 RSS，只有越过回收阈值时才触发 gc.collect()；
+    内存接近上限时暂停接纳新下载，降回恢复阈值以下后再放行。
+    """
+
+    def __init__(self, max_memory_mb, sample_interval=1.0, gc_ratio=0.7,
+                 pause_ratio=0.9, resume_ratio=RESUME_RATIO, min_gc_interval=5.0):
+        self.max_memory_mb = max_memory_mb
+        self.sample_interval = sample_interval
+        self.gc_ratio = gc_ratio
+        self.pause_ratio = pause_ratio
+        self.resume_ratio = resume_ratio
+        self.min_gc_interval = min_gc_interval
+
+        self.rss_mb = 0.0
+        self.peak_rss_mb = 0.0
+        self.gc_cpu_seconds = 0.0
+        self.gc_collections = 0
+        self.forced_collections = 0
+        self.admission = threading.Event()
+        self.admission.set()
+        # 最近一次暂停接纳的时间，接纳中为 None
+        self.paused_at = None
+
+        self._last_forced_gc = 0.0
+        self._gc_local = threading.local()
+        self._stop_event = threading.Event()
+        self._thread = None
+        try:
+            self._process = psutil.Process(os.getpid())
+        except Exception as e:
+            logger.warning(f"内存检测失败，内存管理器仅统计GC耗时: {e}")
+            self._process = None
+        self.sample()
+
+    def start(self):
+        """启动后台采样线程并开始统计GC耗时"""
+        if self._thread is not None:
+            return
+        gc.callbacks.append(self._gc_callback)
+        self._thread = threading.Thread(target=self._run, name='memory-governor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台采样线程"""
+        self._stop_event.set()
+        if self._gc_callback in gc.callbacks:
+            gc.callbacks.remove(self._gc_callback)
+        # 停止后不再阻塞等待者
+        self.paused_at = None
+        self.admission.set()
+
+    def _gc_callback(self, phase, info):
+        # GC 在触发它的线程中执行，用线程CPU时间计量
+        if phase == 'start':
+            self._gc_local.started = time.thread_time()
+        elif phase == 'stop':
+            started = getattr(self._gc_local, 'started', None)
+            if started is not None:
+                self.gc_cpu_seconds += time.thread_time() - started
+                self.gc_collections += 1
+                self._gc_local.started = None
+
+    def sample(self):
+        """采样一次当前进程的 RSS (MB)"""
+        if self._process is None:
+            return self.rss_mb
+        try:
+            self.rss_mb = self._process.memory_info().rss / (1024 * 1024)
+        except Exception:
+            return self.rss_mb
+        self.peak_rss_mb = max(self.peak_rss_mb, self.rss_mb)
+        return self.rss_mb
+
+    def _run(self):
+        while not self._stop_event.wait(self.sample_interval):
+            rss_mb = self.sample()
+            now = time.monotonic()
+            if (rss_mb > self.max_memory_mb * self.gc_ratio and
+                    now - self._last_forced_gc >= self.min_gc_interval):
+                self._last_forced_gc = now
+                self.forced_collections += 1
+                gc.collect()
+                rss_mb = self.sample()
+
+            if self.admission.is_set() and rss_mb >= self.max_memory_mb * self.pause_ratio:
+                logger.warning(f"⚠️ 内存使用较高: {rss_mb:.1f} MB，暂停接纳新下载")
+                self.paused_at = time.monotonic()
+                self.admission.clear()
+            elif not self.admission.is_set() and rss_mb < self.max_memory_mb * self.resume_ratio:
+                logger.info(f"内存已回落: {rss_mb:.1f} MB，恢复接纳新下载")
+                self.paused_at = None
+                self.admission.set()
+
+    def stalled(self, timeout):
+        """暂停接纳是否已持续超过 timeout 秒；timeout 为 0 表示从不判定为停滞"""
+        paused_at = self.paused_at
+        return (timeout > 0 and paused_at is not None and not self.admission.is_set()
+                and time.monotonic() - paused_at >= timeout)
+
+    def wait_for_admission(self, timeout=None):
+        """阻塞等待允许接纳新下载，返回是否已放行"""
+        return self.admission.wait(timeout)
+
+    async def async_wait_for_admission(self, timeout=None):
+        """异步等待允许接纳新下载，返回是否已放行"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.admission.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.sample_interval)
+        return True
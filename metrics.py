@@ -0,0 +1,307 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from log_config import get_logger
+
+logger = get_logger('metrics')
+
+TTFB_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+THROUGHPUT_BUCKETS = tuple(float(1024 * 2 ** i) for i in range(6, 20, 2))  # 64 KiB/s ~ 512 MiB/s
+# 下载各阶段耗时：DNS/建立连接/TLS握手为毫秒级，响应体可达数分钟
+PHASE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+PHASE_LABELS = {'dns': 'DNS', 'connect': '连接', 'tls': 'TLS', 'ttfb': '首字节', 'body': '响应体'}
+
+
+def error_class(error):
+    """把异常归类为便于统计的错误类别"""
+    status = getattr(error, 'status', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return f"http_{status}"
+    return type(error).__name__
+
+
+def describe_errors(errors, limit=5):
+    """把错误类别计数格式化为附加在统计行后的说明，只列出最多的几类"""
+    if not errors:
+        return ""
+    top = sorted(errors.items(), key=lambda item: -item[1])[:limit]
+    return f" (错误: {', '.join(f'{name}×{count}' for name, count in top)})"
+
+
+class Histogram:
+    """累积直方图，只由所属线程写入"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """按桶上界估算分位数，落在最后一个桶时返回最大的有限上界"""
+        if self.count <= 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+
+def format_seconds(seconds):
+    """耗时的简短表示：1 秒以内用毫秒"""
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def describe_phases(phases):
+    """把各阶段耗时直方图格式化为一行：平均值和 p90"""
+    parts = []
+    for phase, label in PHASE_LABELS.items():
+        histogram = phases.get(phase)
+        if histogram is not None and histogram.count:
+            parts.append(f"{label} {format_seconds(histogram.sum / histogram.count)} "
+                         f"(p90 {format_seconds(histogram.quantile(0.9))})")
+    return ' / '.join(parts)
+
+
+class MetricsStripe:
+    """单个工作线程独占的一组计数器
+
+    只有所属线程写入，热路径只做整数加法，不加锁也不格式化字符串；
+    导出时由 Metrics 把所有分片汇总。
+    """
+
+    def __init__(self, per_url=False):
+        self.per_url = per_url
+        self.downloaded_bytes = 0
+        self.results = {}
+        self.errors = {}
+        self.host_bytes = {}
+        self.url_bytes = {}
+        self.ttfb = Histogram(TTFB_BUCKETS)
+        self.phases = {}
+        self.host_throughput = {}
+
+    def observe_ttfb(self, seconds):
+        self.ttfb.observe(seconds)
+        self.observe_phase('ttfb', seconds)
+
+    def observe_phase(self, phase, seconds):
+        """记录一次下载某个阶段的耗时（dns/connect/tls/ttfb/body），每个连接或文件一次"""
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = Histogram(PHASE_BUCKETS)
+        histogram.observe(seconds)
+
+    def observe_download(self, url, nbytes, seconds, ok):
+        """记录一个文件下载结束（每个文件一次，不在分块循环中调用）"""
+        result = 'success' if ok else 'failure'
+        self.results[result] = self.results.get(result, 0) + 1
+        host = (urlsplit(url).hostname or '').lower()
+        self.host_bytes[host] = self.host_bytes.get(host, 0) + nbytes
+        if self.per_url:
+            self.url_bytes[url] = self.url_bytes.get(url, 0) + nbytes
+        if ok and seconds > 0:
+            histogram = self.host_throughput.get(host)
+            if histogram is None:
+                histogram = self.host_throughput[host] = Histogram(THROUGHPUT_BUCKETS)
+            histogram.observe(nbytes / seconds)
+
+    def observe_error(self, error):
+        name = error_class(error)
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_histogram(lines, name, histogram, labels=''):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+        cumulative += count
+        if bound == float('inf'):
+            le = '+Inf'
+        else:
+            le = f"{bound:.0f}" if float(bound).is_integer() else f"{bound}"
+        sep = ',' if labels else ''
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {histogram.sum}')
+    lines.append(f'{name}_count{suffix} {histogram.count}')
+
+
+class Metrics:
+    """按线程分片的指标注册表，以 Prometheus 文本格式导出"""
+
+    def __init__(self, per_url=False):
+        self.per_url = per_url
+        self._local = threading.local()
+        self._stripes = []
+        self._lock = threading.Lock()  # 仅在新线程首次注册分片时使用
+        self._gauges = []
+        self._histograms = []
+
+    def stripe(self):
+        """获取当前线程的计数器分片"""
+        stripe = getattr(self._local, 'stripe', None)
+        if stripe is None:
+            stripe = MetricsStripe(self.per_url)
+            with self._lock:
+                self._stripes.append(stripe)
+            self._local.stripe = stripe
+        return stripe
+
+    def downloaded_bytes(self):
+        """所有分片的下载字节数之和"""
+        return sum(stripe.downloaded_bytes for stripe in list(self._stripes))
+
+    def totals(self):
+        """汇总所有分片，返回 (成功文件数, 失败文件数, {错误类别: 次数})"""
+        success = failure = 0
+        errors = {}
+        for stripe in list(self._stripes):
+            success += stripe.results.get('success', 0)
+            failure += stripe.results.get('failure', 0)
+            for name, count in list(stripe.errors.items()):
+                errors[name] = errors.get(name, 0) + count
+        return success, failure, errors
+
+    def phase_histograms(self):
+        """汇总所有分片的各阶段耗时直方图"""
+        phases = {}
+        for stripe in list(self._stripes):
+            for phase, histogram in dict(stripe.phases).items():
+                phases.setdefault(phase, Histogram(PHASE_BUCKETS)).merge(histogram)
+        return phases
+
+    def add_gauge(self, name, help_text, getter):
+        """注册一个在导出时读取的瞬时指标"""
+        self._gauges.append((name, help_text, getter))
+
+    def add_histogram(self, name, help_text, histogram):
+        """注册一个由单个线程写入的直方图，导出时原样输出"""
+        self._histograms.append((name, help_text, histogram))
+
+    def render(self):
+        """生成 Prometheus/OpenMetrics 文本"""
+        stripes = list(self._stripes)
+        results, errors, host_bytes, url_bytes = {}, {}, {}, {}
+        ttfb = Histogram(TTFB_BUCKETS)
+        host_throughput = {}
+        for stripe in stripes:
+            # dict() 在 GIL 保护下整体复制，避免与写入线程并发迭代
+            for target, source in ((results, stripe.results), (errors, stripe.errors),
+                                   (host_bytes, stripe.host_bytes), (url_bytes, stripe.url_bytes)):
+                for key, value in dict(source).items():
+                    target[key] = target.get(key, 0) + value
+            ttfb.merge(stripe.ttfb)
+            for host, histogram in dict(stripe.host_throughput).items():
+                merged = host_throughput.setdefault(host, Histogram(THROUGHPUT_BUCKETS))
+                merged.merge(histogram)
+
+        lines = [
+            '# HELP trafficflow_downloaded_bytes_total 已下载并丢弃的字节数',
+            '# TYPE trafficflow_downloaded_bytes_total counter',
+            f'trafficflow_downloaded_bytes_total {sum(s.downloaded_bytes for s in stripes)}',
+            '# HELP trafficflow_downloads_total 完成的下载数',
+            '# TYPE trafficflow_downloads_total counter',
+        ]
+        for result, count in sorted(results.items()):
+            lines.append(f'trafficflow_downloads_total{{result="{result}"}} {count}')
+        lines += [
+            '# HELP trafficflow_errors_total 按错误类别统计的失败次数',
+            '# TYPE trafficflow_errors_total counter',
+        ]
+        for name, count in sorted(errors.items()):
+            lines.append(f'trafficflow_errors_total{{class="{_escape(name)}"}} {count}')
+        lines += [
+            '# HELP trafficflow_host_bytes_total 按主机统计的已完成下载字节数',
+            '# TYPE trafficflow_host_bytes_total counter',
+        ]
+        for host, count in sorted(host_bytes.items()):
+            lines.append(f'trafficflow_host_bytes_total{{host="{_escape(host)}"}} {count}')
+        if self.per_url:
+            lines += [
+                '# HELP trafficflow_url_bytes_total 按URL统计的已完成下载字节数',
+                '# TYPE trafficflow_url_bytes_total counter',
+            ]
+            for url, count in sorted(url_bytes.items()):
+                lines.append(f'trafficflow_url_bytes_total{{url="{_escape(url)}"}} {count}')
+        lines += [
+            '# HELP trafficflow_ttfb_seconds 从发起请求到收到响应头的耗时',
+            '# TYPE trafficflow_ttfb_seconds histogram',
+        ]
+        _render_histogram(lines, 'trafficflow_ttfb_seconds', ttfb)
+        lines += [
+            '# HELP trafficflow_host_throughput_bytes_per_second 单个文件的平均下载速度',
+            '# TYPE trafficflow_host_throughput_bytes_per_second histogram',
+        ]
+        for host, histogram in sorted(host_throughput.items()):
+            _render_histogram(lines, 'trafficflow_host_throughput_bytes_per_second',
+                              histogram, f'host="{_escape(host)}"')
+        lines += [
+            '# HELP trafficflow_phase_seconds 下载各阶段的耗时',
+            '# TYPE trafficflow_phase_seconds histogram',
+        ]
+        for phase, histogram in sorted(self.phase_histograms().items()):
+            _render_histogram(lines, 'trafficflow_phase_seconds', histogram, f'phase="{phase}"')
+        for name, help_text, histogram in self._histograms:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            _render_histogram(lines, name, histogram)
+        for name, help_text, getter in self._gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            try:
+                lines.append(f'{name} {getter()}')
+            except Exception:
+                lines.append(f'{name} NaN')
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(render, port, host='0.0.0.0'):
+    """在后台线程启动指标HTTP服务，render() 返回导出文本"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 抓取请求不写日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"📈 指标服务已启动: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from log_config import get_logger
+from metrics import start_metrics_server
+
+logger = get_logger('multiworker')
+
+
+class SharedStats:
+    """多进程共享统计区：每个工作进程只写自己的槽位，无需加锁"""
+
+    FIELDS = ('downloaded_bytes', 'active_downloads', 'max_active_downloads',
+              'rss_mb', 'gc_cpu_seconds', 'updated_at')
+
+    def __init__(self, workers, context):
+        self.workers = workers
+        self._values = context.RawArray('d', workers * len(self.FIELDS))
+
+    def publish(self, index, manager):
+        """把工作进程管理器的当前统计写入共享内存"""
+        base = index * len(self.FIELDS)
+        values = self._values
+        values[base] = manager.downloaded_bytes
+        values[base + 1] = manager.active_downloads
+        values[base + 2] = manager.max_active_downloads
+        values[base + 3] = manager.memory_governor.rss_mb
+        values[base + 4] = manager.memory_governor.gc_cpu_seconds
+        values[base + 5] = time.time()
+
+    def read(self, index):
+        """读取某个工作进程的统计"""
+        base = index * len(self.FIELDS)
+        return dict(zip(self.FIELDS, self._values[base:base + len(self.FIELDS)]))
+
+    def total(self, field):
+        """汇总所有工作进程的某项统计"""
+        offset = self.FIELDS.index(field)
+        step = len(self.FIELDS)
+        return sum(self._values[offset::step])
+
+
+def print_shared_statistics(stats, start_time):
+    """打印所有工作进程的汇总统计信息"""
+    elapsed_time = time.time() - start_time
+    total_mb = stats.total('downloaded_bytes') / (1024 * 1024)
+    avg_speed = total_mb / elapsed_time if elapsed_time > 0 else 0
+
+    lines = [
+        f"\n📊 汇总统计信息 ({stats.workers} 个工作进程):",
+        f"   运行时间: {elapsed_time:.1f} 秒",
+        f"   总下载量: {total_mb:.2f} MB",
+        f"   平均速度: {avg_speed:.2f} MB/s",
+        f"   内存使用: {stats.total('rss_mb'):.1f} MB",
+        f"   GC耗时: {stats.total('gc_cpu_seconds'):.2f} 秒CPU",
+        f"   活跃下载: {stats.total('active_downloads'):.0f}/{stats.total('max_active_downloads'):.0f}",
+    ]
+    for index in range(stats.workers):
+        worker = stats.read(index)
+        lines.append(f"   进程 #{index}: {worker['downloaded_bytes'] / (1024 * 1024):.2f} MB, "
+                     f"内存 {worker['rss_mb']:.1f} MB, 活跃 {worker['active_downloads']:.0f}")
+    # 整段统计作为一条日志输出，JSON 格式下附带数值字段
+    logger.info('\n'.join(lines), extra={
+        'event': 'statistics',
+        'downloaded_bytes': stats.total('downloaded_bytes'),
+        'avg_speed_mbps': round(avg_speed, 3),
+        'workers': stats.workers,
+    })
+
+
+def render_shared_metrics(stats):
+    """把共享统计区导出为 Prometheus 文本，按工作进程打标签"""
+    metrics = (
+        ('trafficflow_downloaded_bytes_total', 'counter', '已下载并丢弃的字节数', 'downloaded_bytes'),
+        ('trafficflow_active_downloads', 'gauge', '正在进行的下载数', 'active_downloads'),
+        ('trafficflow_max_active_downloads', 'gauge', '最大并发下载数', 'max_active_downloads'),
+        ('trafficflow_rss_bytes', 'gauge', '进程常驻内存', 'rss_mb'),
+        ('trafficflow_gc_cpu_seconds', 'gauge', 'GC累计占用的CPU时间', 'gc_cpu_seconds'),
+    )
+    workers = [stats.read(index) for index in range(stats.workers)]
+    lines = []
+    for name, kind, help_text, field in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for index, worker in enumerate(workers):
+            value = worker[field]
+            if field == 'rss_mb':
+                value = int(value * 1024 * 1024)
+            lines.append(f'{name}{{worker="{index}"}} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def run_sharded(target, shards, options, stats_interval=30, metrics_port=0):
+    """以 fork 方式启动多个工作进程，父进程通过共享内存汇总统计
+
+    target(index, stats, shard, options) 在子进程中运行，shard 为该进程负责的URL分片。
+    """
+    context = multiprocessing.get_context('fork')
+    workers = len(shards)
+    stats = SharedStats(workers, context)
+    start_time = time.time()
+
+    processes = []
+    parent_pid = os.getpid()
+
+    def forward(signum, frame):
+        # 运行状态和采样分析由各工作进程分别输出
+        if os.getpid() != parent_pid:
+            return
+        for process in processes:
+            if process.pid is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    # 在 fork 之前安装：工作进程继承这个处理函数但不转发，管理器创建前收到信号不会按默认动作退出
+    introspection_handlers = {}
+    if hasattr(signal, 'SIGUSR1'):
+        for signum in (signal.SIGUSR1, signal.SIGUSR2):
+            introspection_handlers[signum] = signal.signal(signum, forward)
+
+    for index, shard in enumerate(shards):
+        process = context.Process(
+            target=target,
+            args=(index, stats, shard, options),
+            name=f'traffic-flow-worker-{index}',
+            daemon=False
+        )
+        process.start()
+        processes.append(process)
+
+    if metrics_port > 0:
+        # 只有父进程提供指标服务，数据来自共享统计区；在 fork 之后启动，子进程不会继承监听套接字
+        start_metrics_server(lambda: render_shared_metrics(stats), metrics_port)
+
+    stopping = False
+
+    def stop_workers(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            logger.info(f"\n接收到信号 {signum}，正在停止所有工作进程...")
+        stopping = True
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    previous_handlers = {
+        signum: signal.signal(signum, stop_workers)
+        for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    previous_handlers.update(introspection_handlers)
+
+    try:
+        last_report = time.time()
+        while any(process.is_alive() for process in processes):
+            time.sleep(1)
+            if time.time() - last_report >= stats_interval:
+                last_report = time.time()
+                print_shared_statistics(stats, start_time)
+    finally:
+        for process in processes:
+            process.join()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    failed = [p.name for p in processes if p.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        logger.warning(f"⚠️ 以下工作进程异常退出: {', '.join(failed)}")
+    return stats, start_time
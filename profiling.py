@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from log_config import get_logger
+from metrics import Histogram
+
+logger = get_logger('profiling')
+
+# 事件循环延迟：正常应在 1 ms 以内，超过 100 ms 说明有回调长时间占用事件循环
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# asyncio 引擎中当前任务所属下载的进度，分段下载的各个子任务共享同一个对象
+current_download = contextvars.ContextVar('current_download', default=None)
+
+
+class Progress:
+    """一个在途下载的进度，只由下载所在的线程/事件循环写入 bytes"""
+
+    __slots__ = ('url', 'started', 'bytes', '_last_bytes', '_last_time')
+
+    def __init__(self, url):
+        self.url = url
+        self.started = time.monotonic()
+        self.bytes = 0
+        self._last_bytes = 0
+        self._last_time = self.started
+
+
+class InFlightTracker:
+    """记录在途下载，供运行状态输出；开始和结束各加一次锁，分块循环中只做整数加法"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._downloads = set()
+
+    def start(self, url):
+        progress = Progress(url)
+        with self._lock:
+            self._downloads.add(progress)
+        return progress
+
+    def finish(self, progress):
+        with self._lock:
+            self._downloads.discard(progress)
+
+    def __len__(self):
+        return len(self._downloads)
+
+    def snapshot(self):
+        """返回 [(URL, 已下载字节, 已用秒数, 当前速率)]，按开始时间排序
+
+        当前速率为距上次输出运行状态以来的平均速率，第一次输出时为整个下载的平均速率。
+        """
+        now = time.monotonic()
+        with self._lock:
+            downloads = sorted(self._downloads, key=lambda progress: progress.started)
+        rows = []
+        for progress in downloads:
+            nbytes = progress.bytes
+            elapsed = now - progress._last_time
+            rate = (nbytes - progress._last_bytes) / elapsed if elapsed > 0 else 0.0
+            progress._last_bytes, progress._last_time = nbytes, now
+            rows.append((progress.url, nbytes, now - progress.started, rate))
+        return rows
+
+
+class LoopLagMonitor:
+    """按固定间隔在事件循环中睡眠，实际唤醒时间与预期的差值即事件循环延迟"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.histogram = Histogram(LOOP_LAG_BUCKETS)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.histogram.observe(lag)
+
+    def summary(self):
+        """返回便于打印的延迟统计"""
+        histogram = self.histogram
+        if not histogram.count:
+            return "无采样"
+        return (f"平均 {histogram.sum / histogram.count * 1000:.1f} ms, "
+                f"p99 {histogram.quantile(0.99) * 1000:.0f} ms, 最大 {self.max_lag * 1000:.1f} ms")
+
+
+def phase_trace_config(metrics):
+    """创建记录 DNS 与建立连接耗时的 aiohttp TraceConfig
+
+    aiohttp 的建立连接事件包含 DNS 解析和 TLS 握手，这里减去 DNS 耗时；TLS 握手无法单独计时，计入 connect。
+    """
+    import aiohttp
+
+    async def on_dns_start(session, context, params):
+        context.dns_started = time.monotonic()
+
+    async def on_dns_end(session, context, params):
+        context.dns_seconds = time.monotonic() - context.dns_started
+        metrics.stripe().observe_phase('dns', context.dns_seconds)
+
+    async def on_connect_start(session, context, params):
+        context.connect_started = time.monotonic()
+        context.dns_seconds = 0.0
+
+    async def on_connect_end(session, context, params):
+        seconds = time.monotonic() - context.connect_started - context.dns_seconds
+        metrics.stripe().observe_phase('connect', seconds)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connect_start)
+    trace_config.on_connection_create_end.append(on_connect_end)
+    return trace_config
+
+
+def start_tracemalloc(frames):
+    """开启内存分配跟踪，frames 为每个分配记录的调用栈层数；开启后分配变慢，只在排查时使用"""
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def allocation_lines(limit=10):
+    """按分配位置汇总当前仍存活的内存，返回占用最多的几处；未开启 tracemalloc 时给出提示"""
+    if not tracemalloc.is_tracing():
+        return ["   内存分配热点: 未开启 (设置 TRACEMALLOC=1 启动跟踪)"]
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"   内存分配热点 (跟踪中 {current / (1024 * 1024):.1f} MB, 峰值 {peak / (1024 * 1024):.1f} MB):"]
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"     {frame.filename}:{frame.lineno}  {stat.size / 1024:.1f} KB / {stat.count} 个对象")
+    return lines
+
+
+class SamplingProfiler:
+    """采样分析器：按固定间隔抓取所有线程的调用栈，输出火焰图工具可读的折叠栈文件
+
+    每行为 "线程;外层函数 (文件:行);...;内层函数 (文件:行) 次数"，
+    可直接交给 flamegraph.pl 或 speedscope 生成火焰图。采样在独立线程中进行，不需要重启进程。
+    """
+
+    def __init__(self, seconds=30, interval=0.01, directory='/tmp'):
+        self.seconds = seconds
+        self.interval = interval
+        self.directory = directory
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """开始一个采样窗口，窗口结束后写入文件；已在采样时忽略"""
+        if self.running:
+            logger.warning("⚠️ 采样分析已在进行中，忽略本次请求")
+            return False
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f"trafficflow-{os.getpid()}-{stamp}.folded")
+        self._thread = threading.Thread(target=self._run, args=(path,), name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info(f"🔬 开始采样分析 {self.seconds:g} 秒 (间隔 {self.interval * 1000:g} ms)，结果写入 {path}")
+        return True
+
+    def _run(self, path):
+        own = threading.get_ident()
+        stacks = {}
+        samples = 0
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(self.interval)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for key, count in sorted(stacks.items()):
+                    f.write(f"{key} {count}\n")
+        except OSError as e:
+            logger.error(f"❌ 写入采样结果失败 {path}: {e}")
+            return
+        logger.info(f"🔬 采样分析完成: {samples} 次采样, {len(stacks)} 个不同调用栈, 已写入 {path}")
@@ -0,0 +1,69 @@
+import re
+import threading
+
+MB = 1024 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+def parse_content_range_total(value):
+    """从 Content-Range 头解析文件总大小，无法解析时返回 None"""
+    match = _CONTENT_RANGE_RE.match(value or '')
+    if not match or match.group(3) == '*':
+        return None
+    return int(match.group(3))
+
+
+class SegmentPlanner:
+    """为单个大文件分配字节区间，按实测吞吐自适应调整区间大小
+
+    每个区间的目标耗时为 target_seconds：吞吐高的连接领取更大的区间以减少请求数，
+    吞吐低的连接领取较小的区间，避免文件末尾被一个慢连接拖住。
+    """
+
+    def __init__(self, total_length, streams, initial_size=4 * MB,
+                 min_size=1 * MB, max_size=64 * MB, target_seconds=2.0, start=0):
+        self.total_length = total_length
+        self.streams = max(1, streams)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.segment_size = max(min_size, min(max_size, initial_size))
+        # 从 start 开始分配，之前的字节已经下载过（例如 Range 探测请求取回的首字节）
+        self.next_offset = start
+        # 因停滞被中断的区间，优先重新分配
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def next_segment(self):
+        """领取下一个区间 (start, end)，end 为闭区间；分配完毕返回 None"""
+        with self._lock:
+            if self.pending:
+                return self.pending.pop()
+            if self.next_offset >= self.total_length:
+                return None
+            remaining = self.total_length - self.next_offset
+            size = self.segment_size
+            # 接近末尾时把剩余部分均分给各连接，避免最后只剩一个连接在下载
+            size = min(size, max(self.min_size, remaining // self.streams))
+            start = self.next_offset
+            end = min(self.total_length, start + size) - 1
+            self.next_offset = end + 1
+            return start, end
+
+    def requeue(self, start, end):
+        """归还一个未下载完的区间，交给其他连接重新下载"""
+        if start <= end:
+            with self._lock:
+                self.pending.append((start, end))
+
+    def report(self, nbytes, seconds):
+        """反馈一个区间的实际下载量和耗时，调整后续区间大小"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        throughput = nbytes / seconds
+        wanted = int(throughput * self.target_seconds)
+        with self._lock:
+            # 平滑调整，避免单个区间的抖动导致大小剧烈变化
+            size = (self.segment_size + wanted) // 2
+            self.segment_size = max(self.min_size, min(self.max_size, size))
@@ -0,0 +1,116 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """按字节计量的令牌桶限速器，可在线程和协程之间共享"""
+
+    def __init__(self, rate_kbps=0, burst_bytes=None, burst_seconds=0.25):
+        self._lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self._burst_bytes = burst_bytes
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.set_rate(rate_kbps)
+        self.tokens = self.capacity
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def set_rate(self, rate_kbps):
+        """设置速率 (KB/s)，0 表示不限速"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(0, rate_kbps) * 1024
+            if self._burst_bytes:
+                self.capacity = self._burst_bytes
+            else:
+                # 默认允许 burst_seconds 的突发量，至少 16 KiB；低速时突发量过大会使短时间内的速率明显偏高
+                self.capacity = max(16 * 1024, self.rate * self.burst_seconds)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def reserve(self, nbytes):
+        """预留 nbytes 个令牌，返回调用方需要等待的秒数
+
+        令牌允许透支：每次预留立即扣除，欠下的部分按到达顺序排队偿还，
+        因此并发下载按请求顺序公平分享带宽，总速率不会因分块大小变化而漂移。
+        """
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= nbytes
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def backlog(self):
+        """已透支、排队等待偿还的令牌折合的秒数，即新到的数据块需要等待的时间"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, -self.tokens) / self.rate
+
+
+def per_download_limiter(max_speed_kbps, granularity=0.01):
+    """单文件限速器：只允许 granularity 的突发量，小文件也能按设定速度下载；不限速时返回 None"""
+    if max_speed_kbps <= 0:
+        return None
+    burst_bytes = max(1, int(max_speed_kbps * 1024 * granularity))
+    return TokenBucket(max_speed_kbps, burst_bytes=burst_bytes)
+
+
+def reserve_all(limiters, nbytes):
+    """在多个限速器上同时预留令牌，返回最长等待时间（层级限速取最严格者）"""
+    delay = 0
+    for limiter in limiters:
+        if limiter is not None:
+            delay = max(delay, limiter.reserve(nbytes))
+    return delay
+
+
+class Pacer:
+    """单个下载流的限速节拍器（同步版本）
+
+    每读到一块数据就在全局和单文件限速器上同时预留令牌，层级限速取最严格者；
+    欠下的时间累积到 granularity 以上才真正 sleep，避免每个小块都产生一次
+    系统调用和线程切换。令牌桶按透支记账，没有睡掉的时间会并入下一次等待，
+    长期速率不受影响。每个下载流各自持有一个 Pacer，线程之间不共享节拍状态。
+    """
+
+    def __init__(self, limiters, granularity=0.01):
+        self.limiters = [limiter for limiter in limiters if limiter is not None]
+        self.granularity = granularity
+
+    @classmethod
+    def for_download(cls, global_limiter, max_speed_kbps=0, granularity=0.01):
+        """为一个下载创建节拍器：全局限速器 + 可选的单文件限速器"""
+        return cls((global_limiter, per_download_limiter(max_speed_kbps, granularity)), granularity)
+
+    @property
+    def enabled(self):
+        return any(limiter.enabled for limiter in self.limiters)
+
+    def read_size(self, default):
+        """限速时单次读取的上限：最严格速率下约 100ms 的数据量，避免一次读入后长时间停顿"""
+        rates = [limiter.rate for limiter in self.limiters if limiter.enabled]
+        if not rates:
+            return default
+        return max(4096, min(default, int(min(rates) * 0.1)))
+
+    def pace(self, nbytes):
+        """记录读到的字节数，必要时阻塞等待，返回本次等待的秒数"""
+        delay = reserve_all(self.limiters, nbytes)
+        if delay < self.granularity:
+            return 0.0
+        time.sleep(delay)
+        return delay
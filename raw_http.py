@@ -0,0 +1,553 @@
+import asyncio
+import socket
+import ssl
+import time
+from urllib.parse import urljoin, urlsplit
+
+from connection_pool import ConnectionStats
+from dns_cache import is_ip_address
+from log_config import get_logger
+from rate_limiter import reserve_all
+from timeouts import DeadlineExceededError, StalledStreamError
+
+logger = get_logger('raw_http')
+
+# 响应头上限，超过视为异常响应
+MAX_HEADER_BYTES = 64 * 1024
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+USER_AGENT = 'TrafficFlow'
+
+_HEADERS, _BODY, _IDLE = range(3)
+_CHUNK_SIZE, _CHUNK_DATA, _CHUNK_CRLF, _CHUNK_TRAILER = range(4)
+
+
+class HTTPStatusError(Exception):
+    """服务器返回了非 2xx 状态码，status 属性供错误分类和熔断使用"""
+
+    def __init__(self, status, reason=''):
+        super().__init__(f"HTTP {status} {reason}".rstrip())
+        self.status = status
+
+
+class RawResult:
+    """一次原始HTTP下载的结果"""
+
+    __slots__ = ('status', 'size', 'reads', 'ttfb', 'body', 'peer_ip')
+
+    def __init__(self, status, size, reads, ttfb, body, peer_ip):
+        self.status = status
+        self.size = size
+        self.reads = reads
+        self.ttfb = ttfb
+        self.body = body
+        self.peer_ip = peer_ip
+
+
+class _SinkProtocol(asyncio.BufferedProtocol):
+    """只计数不保存的 HTTP/1.1 响应接收协议
+
+    事件循环直接把数据读进客户端共享的缓冲区，buffer_updated 只解析响应头和分块长度行，
+    响应体字节只做计数、限速和看门狗检查，不产生 bytes 对象。
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.transport = None
+        self.closed = False
+        self.peer_ip = None
+        self.headers = {}
+        self.reusable = False
+        self._raw_bytes = 0
+        self._phase = _IDLE
+        self._future = None
+
+    # ---- asyncio 回调 ----
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername')
+        self.peer_ip = peer[0] if peer else None
+
+    def get_buffer(self, sizehint):
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        self._raw_bytes += nbytes
+        if self._phase == _BODY and not self._chunked:
+            # 热路径：按 Content-Length 或直到连接关闭计数
+            remaining = self._remaining
+            if remaining is None:
+                self._count(nbytes)
+            elif nbytes < remaining:
+                self._remaining = remaining - nbytes
+                self._count(nbytes)
+            else:
+                self._remaining = 0
+                self._count(remaining)
+                self._finish(reusable=nbytes == remaining and self._keep_alive)
+        elif self._phase == _HEADERS:
+            self._feed_headers(nbytes)
+        elif self._phase == _BODY:
+            self._feed_chunked(self.view[:nbytes])
+        else:
+            # 空闲连接上收到意外数据，不能再复用
+            self.transport.close()
+
+    def eof_received(self):
+        if self._phase == _BODY and not self._chunked and self._remaining is None:
+            # 没有长度信息的响应以关闭连接结束
+            self._finish(reusable=False)
+        elif self._phase != _IDLE:
+            self._fail(ConnectionResetError("连接在响应结束前被关闭"))
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self._phase != _IDLE:
+            self._fail(exc or ConnectionResetError("连接在响应结束前被关闭"))
+
+    # ---- 请求状态 ----
+
+    def start(self, request, stripe, limiters, watchdog, policy, running, progress=None):
+        """在这条连接上发出一个请求，返回完成时给出 (状态码, 字节数, 读取次数, 首字节耗时) 的 future；
+        progress 为运行状态中显示的下载进度"""
+        loop = asyncio.get_running_loop()
+        self._future = loop.create_future()
+        self._stripe = stripe
+        self._progress = progress
+        self._limiters = limiters
+        self._limited = any(limiter is not None and limiter.enabled for limiter in limiters)
+        self._watchdog = watchdog
+        self._policy = policy
+        self._running = running
+        self._header = bytearray()
+        self._status = None
+        self._reason = ''
+        self._keep_alive = True
+        self._chunked = False
+        self._remaining = None
+        self._chunk_state = _CHUNK_SIZE
+        self._chunk_left = 0
+        self._line = bytearray()
+        self._received = 0
+        self._reads = 0
+        self._raw_bytes = 0
+        self._seen_bytes = 0
+        self._paused_until = 0.0
+        self._sent_at = time.monotonic()
+        self._last_progress = self._sent_at
+        self._ttfb = None
+        self._phase = _HEADERS
+        self.transport.write(request)
+        self._timer = loop.call_later(1.0, self._check)
+        return self._future
+
+    def _check(self):
+        """每秒检查一次：程序停止、首字节/空闲超时；不在每次读取时重设定时器"""
+        if self._phase == _IDLE:
+            return
+        now = time.monotonic()
+        if self._raw_bytes != self._seen_bytes or now < self._paused_until:
+            self._seen_bytes = self._raw_bytes
+            self._last_progress = now
+        if not self._running():
+            # 程序停止：返回已收到的部分，连接不再复用
+            self._finish(reusable=False)
+            return
+        limit = self._policy.first_byte if self._phase == _HEADERS else self._policy.idle_read
+        if now - self._last_progress > limit:
+            self._fail(asyncio.TimeoutError())
+            return
+        self._timer = asyncio.get_running_loop().call_later(1.0, self._check)
+
+    def _finish(self, reusable):
+        if self._phase == _IDLE:
+            # 已经因错误结束
+            return
+        self._phase = _IDLE
+        self._timer.cancel()
+        if not reusable:
+            self.transport.close()
+        elif self.transport.is_reading() is False:
+            self.transport.resume_reading()
+        self.reusable = reusable
+        if not self._future.done():
+            self._future.set_result((self._status, self._received, self._reads, self._ttfb))
+
+    def _fail(self, error):
+        if self._phase == _IDLE:
+            return
+        self._phase = _IDLE
+        self._timer.cancel()
+        self.transport.close()
+        if not self._future.done():
+            self._future.set_exception(error)
+
+    # ---- 解析 ----
+
+    def _count(self, nbytes):
+        """计入一段响应体数据"""
+        self._received += nbytes
+        self._reads += 1
+        self._stripe.downloaded_bytes += nbytes
+        if self._progress is not None:
+            self._progress.bytes += nbytes
+        watchdog = self._watchdog
+        if watchdog is not None:
+            try:
+                watchdog.update(nbytes)
+            except (StalledStreamError, DeadlineExceededError) as e:
+                self._fail(e)
+                return
+        if self._limited:
+            delay = reserve_all(self._limiters, nbytes)
+            if delay >= 0.01:
+                # 暂停读取让内核接收窗口收紧，到时再恢复，不占用协程
+                if watchdog is not None:
+                    watchdog.pause(delay)
+                self._paused_until = time.monotonic() + delay
+                self.transport.pause_reading()
+                asyncio.get_running_loop().call_later(delay, self._resume)
+
+    def _resume(self):
+        if not self.closed and self._phase == _BODY:
+            self.transport.resume_reading()
+
+    def _feed_headers(self, nbytes):
+        self._header += self.view[:nbytes]
+        end = self._header.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self._header) > MAX_HEADER_BYTES:
+                self._fail(ConnectionError("响应头过长"))
+            return
+        head = bytes(self._header[:end])
+        rest = bytes(self._header[end + 4:])
+        self._header = bytearray()
+        try:
+            self._parse_head(head)
+        except ValueError as e:
+            self._fail(ConnectionError(f"无效的响应头: {e}"))
+            return
+        if 100 <= self._status < 200:
+            # 1xx 临时响应，继续等待最终响应头
+            self._header += rest
+            if rest:
+                self._feed_headers(0)
+            return
+        self._ttfb = time.monotonic() - self._sent_at
+        if not 200 <= self._status < 300:
+            # 非成功响应：交给调用方处理（重定向或报错），连接不复用
+            self._finish(reusable=False)
+            return
+        self._phase = _BODY
+        if self._remaining == 0:
+            self._finish(reusable=not rest and self._keep_alive)
+            return
+        if not rest:
+            return
+        if self._chunked:
+            self._feed_chunked(memoryview(rest))
+        else:
+            nbytes = len(rest)
+            if self._remaining is None:
+                self._count(nbytes)
+            elif nbytes < self._remaining:
+                self._remaining -= nbytes
+                self._count(nbytes)
+            else:
+                count = self._remaining
+                self._remaining = 0
+                self._count(count)
+                self._finish(reusable=nbytes == count and self._keep_alive)
+
+    def _parse_head(self, head):
+        lines = head.split(b'\r\n')
+        version, _, status = lines[0].decode('latin-1').partition(' ')
+        code, _, reason = status.partition(' ')
+        self._status = int(code)
+        self._reason = reason
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        self.headers = headers
+        connection = headers.get(b'connection', b'').lower()
+        self._keep_alive = (b'close' not in connection and
+                            (version != 'HTTP/1.0' or b'keep-alive' in connection))
+        if self._status in (204, 304):
+            self._remaining = 0
+        elif b'chunked' in headers.get(b'transfer-encoding', b'').lower():
+            self._chunked = True
+        elif b'content-length' in headers:
+            self._remaining = int(headers[b'content-length'])
+        else:
+            self._remaining = None
+            self._keep_alive = False
+
+    def _feed_chunked(self, data):
+        """解析分块传输编码：数据部分只计数，只有长度行会被复制"""
+        i = 0
+        n = len(data)
+        while i < n and self._phase == _BODY:
+            state = self._chunk_state
+            if state == _CHUNK_DATA:
+                take = min(n - i, self._chunk_left)
+                self._chunk_left -= take
+                i += take
+                self._count(take)
+                if self._chunk_left == 0:
+                    self._chunk_state = _CHUNK_CRLF
+                    self._chunk_left = 2
+            elif state == _CHUNK_CRLF:
+                take = min(n - i, self._chunk_left)
+                self._chunk_left -= take
+                i += take
+                if self._chunk_left == 0:
+                    self._chunk_state = _CHUNK_SIZE
+            else:
+                piece = bytes(data[i:i + 256])
+                end = piece.find(b'\n')
+                if end < 0:
+                    self._line += piece
+                    i += len(piece)
+                    if len(self._line) > 4096:
+                        self._fail(ConnectionError("无效的分块长度行"))
+                    continue
+                line = bytes(self._line) + piece[:end]
+                self._line = bytearray()
+                i += end + 1
+                if state == _CHUNK_TRAILER:
+                    if not line.strip():
+                        self._finish(reusable=i == n and self._keep_alive)
+                    continue
+                try:
+                    size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    self._fail(ConnectionError("无效的分块长度行"))
+                    return
+                if size == 0:
+                    self._chunk_state = _CHUNK_TRAILER
+                else:
+                    self._chunk_state = _CHUNK_DATA
+                    self._chunk_left = size
+
+
+class RawHTTPClient:
+    """基于 asyncio.BufferedProtocol 的最小 HTTP/1.1 下载客户端
+
+    只支持 GET、keep-alive 复用、Content-Length/分块/关闭连接三种响应体边界和重定向，
+    所有连接共用一块接收缓冲区（同一事件循环中 get_buffer 与 buffer_updated 总是成对同步调用）。
+    相比 aiohttp 的 StreamReader，响应体不经过解析器和队列，每GB的CPU时间显著降低。
+    """
+
+    def __init__(self, dns_cache=None, buffer_size=256 * 1024, max_idle_per_host=32, keepalive=60,
+                 connection_stats=None, socket_profile=None, metrics=None):
+        self.dns_cache = dns_cache
+        self._view = memoryview(bytearray(buffer_size))
+        self.max_idle_per_host = max_idle_per_host
+        # 空闲连接保留的秒数，超过后不再复用，避免发到服务器已准备关闭的连接上
+        self.keepalive = keepalive
+        # (scheme, host, port) -> [(连接, 放回时间)]，后放回的先取出
+        self._idle = {}
+        self._ssl_context = None
+        self.connection_stats = connection_stats or ConnectionStats()
+        # 套接字调优，新连接在 connect() 之前设置选项，每次下载结束采样 TCP_INFO
+        self.socket_profile = socket_profile if socket_profile is not None and socket_profile.enabled else None
+        # DNS 和建立连接（HTTPS 含TLS握手）的耗时计入 metrics 的阶段直方图
+        self.metrics = metrics
+
+    def _ssl(self):
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    async def _open_tuned(self, loop, address, port, ssl_context, server_hostname):
+        """用调优过的套接字建立连接：选项须在 connect() 之前设置，SO_RCVBUF 才能影响窗口扩大因子"""
+        last_error = None
+        for family, sock_type, proto, _, sockaddr in await loop.getaddrinfo(address, port, type=socket.SOCK_STREAM):
+            sock = self.socket_profile.create_socket(family, sock_type, proto)
+            try:
+                sock.setblocking(False)
+                await loop.sock_connect(sock, sockaddr)
+                return await loop.create_connection(lambda: _SinkProtocol(self._view), sock=sock,
+                                                    ssl=ssl_context, server_hostname=server_hostname)
+            except OSError as e:
+                sock.close()
+                last_error = e
+            except BaseException:
+                sock.close()
+                raise
+        raise last_error if last_error is not None else OSError(f"无法解析主机: {address}")
+
+    async def _connect(self, scheme, host, port, policy, warm=False):
+        """建立新连接；启用DNS缓存时按缓存给出的顺序逐个尝试主机的IP"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        if self.dns_cache is not None and not is_ip_address(host):
+            addresses = [sockaddr[0] for _, sockaddr in await self.dns_cache.async_resolve(host, port)]
+            if self.metrics is not None:
+                self.metrics.stripe().observe_phase('dns', time.monotonic() - started)
+        else:
+            addresses = [host]
+        last_error = None
+        for address in addresses:
+            started = time.monotonic()
+            ssl_context = self._ssl() if scheme == 'https' else None
+            server_hostname = host if scheme == 'https' else None
+            if self.socket_profile is not None:
+                opening = self._open_tuned(loop, address, port, ssl_context, server_hostname)
+            else:
+                opening = loop.create_connection(lambda: _SinkProtocol(self._view), address, port,
+                                                 ssl=ssl_context, server_hostname=server_hostname)
+            try:
+                _, protocol = await asyncio.wait_for(opening, policy.connect)
+            except (OSError, asyncio.TimeoutError) as e:
+                last_error = e
+                if self.dns_cache is not None and address != host:
+                    self.dns_cache.mark_failure(address)
+                continue
+            if self.dns_cache is not None and address != host:
+                self.dns_cache.mark_success(address)
+            self.connection_stats.record_connect(warm=warm)
+            if self.metrics is not None:
+                self.metrics.stripe().observe_phase('connect', time.monotonic() - started)
+            return protocol
+        raise last_error if last_error is not None else OSError(f"无法解析主机: {host}")
+
+    def _prune(self, key):
+        """关闭已断开或空闲超过 keepalive 的连接，返回剩余的空闲列表"""
+        idle = self._idle.setdefault(key, [])
+        expire_before = time.monotonic() - self.keepalive
+        alive = []
+        for protocol, released in idle:
+            if protocol.closed or protocol.transport.is_closing():
+                continue
+            if released < expire_before:
+                protocol.transport.close()
+                continue
+            alive.append((protocol, released))
+        idle[:] = alive
+        return idle
+
+    def _acquire_idle(self, key):
+        idle = self._prune(key)
+        return idle.pop()[0] if idle else None
+
+    def _release(self, key, protocol):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_idle_per_host and not protocol.closed:
+            idle.append((protocol, time.monotonic()))
+        else:
+            protocol.transport.close()
+
+    @staticmethod
+    def _origin(parts):
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的协议: {scheme}")
+        return scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80)
+
+    async def warm(self, url, count, policy):
+        """为URL所属主机准备 count 条已建立的空闲连接，不发送请求，返回新建立的连接数"""
+        key = self._origin(urlsplit(url))
+        missing = min(count, self.max_idle_per_host) - len(self._prune(key))
+        if missing <= 0:
+            return 0
+        results = await asyncio.gather(*[self._connect(*key, policy, warm=True) for _ in range(missing)],
+                                       return_exceptions=True)
+        opened = 0
+        for protocol in results:
+            if isinstance(protocol, BaseException):
+                continue
+            self._release(key, protocol)
+            opened += 1
+        return opened
+
+    async def download(self, url, stripe, limiters=(), policy=None, watchdog=None,
+                       running=lambda: True, headers=None, max_redirects=5, wire_bytes=False, progress=None):
+        """下载URL并丢弃响应体，返回 RawResult；非 2xx 状态抛出 HTTPStatusError
+
+        wire_bytes 为 True 时，响应头和分块长度行等协议开销也计入 stripe 的下载字节数；
+        progress 为 profiling.Progress，响应体字节同时累加到它上面。
+        """
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            scheme, host, port = self._origin(parts)
+            target = parts.path or '/'
+            if parts.query:
+                target += '?' + parts.query
+            host_header = host if ':' not in host else f'[{host}]'
+            if parts.port:
+                host_header += f':{parts.port}'
+            lines = [f'GET {target} HTTP/1.1', f'Host: {host_header}', f'User-Agent: {USER_AGENT}',
+                     'Accept: */*', 'Accept-Encoding: identity', 'Connection: keep-alive']
+            for name, value in (headers or {}).items():
+                lines.append(f'{name}: {value}')
+            request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+            key = (scheme, host, port)
+            self.connection_stats.record_request()
+            protocol = self._acquire_idle(key)
+            reused = protocol is not None
+            if protocol is None:
+                protocol = await self._connect(scheme, host, port, policy)
+            try:
+                status, size, reads, ttfb = await protocol.start(
+                    request, stripe, limiters, watchdog, policy, running, progress)
+            except ConnectionError:
+                if not reused or protocol._raw_bytes:
+                    raise
+                # 复用的空闲连接已被服务器关闭，换一条新连接重试一次
+                protocol = await self._connect(scheme, host, port, policy)
+                status, size, reads, ttfb = await protocol.start(
+                    request, stripe, limiters, watchdog, policy, running, progress)
+            except asyncio.CancelledError:
+                # 总截止时间到或任务被取消：连接状态未知，直接关闭
+                protocol.transport.close()
+                raise
+            # 最后一段数据欠下的限速时间在返回前补足，与逐块 sleep 的其他传输一致
+            paced = protocol._paused_until - time.monotonic()
+            if paced > 0:
+                await asyncio.sleep(paced)
+            if wire_bytes:
+                # 套接字上收到的全部字节减去已计入的响应体
+                stripe.downloaded_bytes += protocol._raw_bytes - size
+            if self.socket_profile is not None:
+                self.socket_profile.observe(protocol.transport.get_extra_info('socket'))
+
+            if status in REDIRECT_STATUSES and b'location' in protocol.headers:
+                url = urljoin(url, protocol.headers[b'location'].decode('latin-1'))
+                continue
+            if not 200 <= status < 300:
+                raise HTTPStatusError(status, protocol._reason)
+            if protocol.reusable:
+                self._release(key, protocol)
+            body = time.monotonic() - protocol._sent_at - ttfb
+            return RawResult(status, size, reads, ttfb, body, protocol.peer_ip)
+        raise HTTPStatusError(status, "重定向次数过多")
+
+    def close(self):
+        """关闭所有空闲连接"""
+        for idle in self._idle.values():
+            for protocol, _ in idle:
+                protocol.transport.close()
+        self._idle.clear()
+
+    def summary(self):
+        """返回便于打印的连接统计"""
+        return self.connection_stats.summary()
+
+
+def setup_event_loop(preference='auto'):
+    """按配置选择事件循环：auto 时安装了 uvloop 就使用它，返回实际使用的事件循环名称"""
+    if preference in ('auto', 'uvloop'):
+        try:
+            import uvloop
+        except ImportError:
+            if preference == 'uvloop':
+                logger.warning("⚠️ 未安装 uvloop，使用默认事件循环")
+            return 'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return 'uvloop'
+    return 'asyncio'
@@ -0,0 +1,118 @@
+import threading
+from urllib.parse import urlsplit
+
+from log_config import get_logger
+
+logger = get_logger('scheduler')
+
+
+DEFAULT_URLS = (
+    "https://httpbin.org/bytes/102400",
+    "https://httpbin.org/bytes/1048576",
+    "https://httpbin.org/bytes/5242880",
+)
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+class URLEntry:
+    """urls.txt 中的一条URL及其元数据"""
+
+    __slots__ = ('url', 'weight', 'speed_kbps', 'size')
+
+    def __init__(self, url, weight=1.0, speed_kbps=0, size=None):
+        self.url = url
+        self.weight = weight
+        # 该URL的单文件限速 (KB/s)，0 表示使用全局的单文件限速
+        self.speed_kbps = speed_kbps
+        # 预期文件大小 (字节)，None 表示未知
+        self.size = size
+
+
+def parse_size(value):
+    """解析大小，支持 K/M/G/T 后缀，例如 '100M'"""
+    value = value.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in _SIZE_UNITS else ''
+    number = value[:-1] if unit else value
+    return int(float(number) * _SIZE_UNITS[unit])
+
+
+def parse_url_line(line):
+    """解析 urls.txt 中的一行: URL [weight=N] [speed=KB/s] [size=N[K|M|G]]，返回 URLEntry"""
+    parts = line.split()
+    entry = URLEntry(parts[0])
+    for part in parts[1:]:
+        key, _, value = part.partition('=')
+        if not value:
+            continue
+        try:
+            if key == 'weight':
+                entry.weight = float(value)
+            elif key in ('speed', 'speed_kbps'):
+                entry.speed_kbps = int(float(value))
+            elif key == 'size':
+                entry.size = parse_size(value)
+        except ValueError:
+            logger.warning(f"⚠️ 无效的参数 '{part}'，已忽略: {entry.url}")
+    return entry
+
+
+def parse_host_weights(spec):
+    """解析主机权重配置，例如 'mirrors.nju.edu.cn=2,dldir1.qq.com=0.5'"""
+    weights = {}
+    if not spec:
+        return weights
+    for item in spec.split(','):
+        host, _, value = item.strip().partition('=')
+        if not host or not value:
+            continue
+        try:
+            weights[host.lower()] = float(value)
+        except ValueError:
+            logger.warning(f"⚠️ 无效的主机权重配置: {item}")
+    return weights
+
+
+def url_host(url):
+    """提取URL的主机名"""
+    return (urlsplit(url).hostname or '').lower()
+
+
+class WeightedURLScheduler:
+    """平滑加权轮询调度器，空闲槽位随时从这里领取下一个URL
+
+    有效权重 = URL权重 × 主机权重，同一主机的请求在时间上被打散，
+    不会连续占满所有槽位。
+    """
+
+    def __init__(self, urls, url_weights=None, host_weights=None, max_picks=None):
+        url_weights = url_weights or {}
+        host_weights = host_weights or {}
+        self._lock = threading.Lock()
+        self.urls = []
+        self.weights = []
+        for url in urls:
+            weight = url_weights.get(url, 1.0) * host_weights.get(url_host(url), 1.0)
+            if weight > 0:
+                self.urls.append(url)
+                self.weights.append(weight)
+        self.total_weight = sum(self.weights)
+        self.current = [0.0] * len(self.urls)
+        self.max_picks = max_picks
+        self.picks = 0
+
+    def next(self):
+        """返回下一个要下载的URL，配额用完或无可用URL时返回 None"""
+        with self._lock:
+            if not self.urls:
+                return None
+            if self.max_picks is not None and self.picks >= self.max_picks:
+                return None
+            self.picks += 1
+            best = 0
+            for i, weight in enumerate(self.weights):
+                self.current[i] += weight
+                if self.current[i] > self.current[best]:
+                    best = i
+            self.current[best] -= self.total_weight
+            return self.urls[best]
@@ -0,0 +1,328 @@
+import ctypes
+import errno
+import inspect
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+
+from log_config import get_logger
+from scheduler import parse_size
+
+logger = get_logger('socket')
+
+IS_LINUX = sys.platform.startswith('linux')
+# Linux 特有的常量，其他平台上为 None，对应选项不可用；SO_RCVBUFFORCE 未被标准库导出
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33 if IS_LINUX else None)
+TCP_CONGESTION = getattr(socket, 'TCP_CONGESTION', None)
+TCP_INFO = getattr(socket, 'TCP_INFO', None)
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+F_SETPIPE_SZ = 1031
+# struct tcp_info 中 tcpi_rtt (微秒) 与 tcpi_rcv_space (字节) 的偏移
+_TCP_INFO_SIZE = 104
+_U32 = struct.Struct('=I')
+_TCPI_RTT_OFFSET = 68
+_TCPI_RCV_SPACE_OFFSET = 96
+
+_libc_splice = None
+
+
+def _splice(src, dst, count, flags):
+    """splice(2)：Python 3.10+ 使用 os.splice，更早的版本通过 ctypes 调用 libc"""
+    if hasattr(os, 'splice'):
+        return os.splice(src, dst, count, flags=flags)
+    global _libc_splice
+    if _libc_splice is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        _libc_splice = libc.splice
+        _libc_splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_size_t, ctypes.c_uint]
+        _libc_splice.restype = ctypes.c_ssize_t
+    result = _libc_splice(src, None, dst, None, count, flags)
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+class SocketProfile:
+    """套接字调优配置，两个引擎的所有连接都按它设置
+
+    rcvbuf: SO_RCVBUF 字节数，0 保持系统默认（内核自动调节接收窗口）；
+            超过 net.core.rmem_max 时尝试 SO_RCVBUFFORCE（需要 CAP_NET_ADMIN）
+    nodelay: TCP_NODELAY
+    congestion: 拥塞控制算法，例如 bbr，空字符串使用系统默认
+    splice: Linux 上线程引擎的明文HTTP响应体用 splice 直接从套接字转到 /dev/null，不进入Python
+
+    启动时在临时套接字上逐项试设置，内核不支持或没有权限的选项记录警告后跳过，不会导致连接失败。
+    选项在 connect() 之前设置：SO_RCVBUF 决定SYN中通告的窗口扩大因子，连接建立后再调大只能部分生效。
+    不提供 TCP_QUICKACK：内核在每次确认后会清除它，只设置一次没有效果。
+    """
+
+    def __init__(self, rcvbuf=0, nodelay=True, congestion='', splice=False):
+        self.rcvbuf = rcvbuf
+        self.nodelay = nodelay
+        self.congestion = congestion
+        self.splice = splice and IS_LINUX
+        self.effective_rcvbuf = None
+        self.options = []
+        self._lock = threading.Lock()
+        self.tuned_sockets = 0
+        self.spliced_bytes = 0
+        self.samples = 0
+        self.rtt_us_sum = 0
+        self.rcv_space_sum = 0
+        if splice and not self.splice:
+            logger.warning("⚠️ splice 丢弃仅支持 Linux，已关闭")
+        if self.enabled:
+            self.options = self._probe()
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取套接字调优配置"""
+        return cls(
+            rcvbuf=parse_size(os.getenv('SOCKET_RCVBUF') or '0'),
+            nodelay=os.getenv('TCP_NODELAY', '1') == '1',
+            congestion=os.getenv('TCP_CONGESTION', '').strip(),
+            splice=os.getenv('SPLICE_DISCARD', '0') == '1'
+        )
+
+    @property
+    def enabled(self):
+        """是否有需要设置的选项；未启用时引擎不做任何额外的系统调用"""
+        return bool(self.rcvbuf or not self.nodelay or self.congestion or self.splice)
+
+    def _probe(self):
+        """在临时套接字上试设置每个选项，返回可用的 (level, option, value) 列表"""
+        candidates = []
+        if self.rcvbuf:
+            candidates.append(('SO_RCVBUF', socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf))
+        candidates.append(('TCP_NODELAY', socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay)))
+        if self.congestion:
+            candidates.append(('TCP_CONGESTION', socket.IPPROTO_TCP, TCP_CONGESTION,
+                               self.congestion.encode()))
+        # 当前平台没有的选项
+        for name, _, option, _ in candidates:
+            if option is None:
+                logger.warning(f"⚠️ 当前平台不支持 {name}，已跳过")
+        candidates = [candidate for candidate in candidates if candidate[2] is not None]
+        options = []
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            for name, level, option, value in candidates:
+                try:
+                    probe.setsockopt(level, option, value)
+                except OSError as e:
+                    logger.warning(f"⚠️ 套接字选项 {name}={value!r} 设置失败，已跳过: {e}")
+                    if name == 'TCP_CONGESTION':
+                        self.congestion = ''
+                    continue
+                if name == 'SO_RCVBUF':
+                    option = self._check_rcvbuf(probe)
+                options.append((level, option, value))
+        return options
+
+    def _check_rcvbuf(self, probe):
+        """检查内核实际分配的接收缓冲区，被 net.core.rmem_max 截断时尝试 SO_RCVBUFFORCE，返回应使用的选项"""
+        # Linux 返回的是加倍后的值（含内核簿记开销）
+        self.effective_rcvbuf = probe.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2
+        if self.effective_rcvbuf >= self.rcvbuf or SO_RCVBUFFORCE is None:
+            return socket.SO_RCVBUF
+        try:
+            probe.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, self.rcvbuf)
+        except OSError:
+            logger.warning(f"⚠️ SO_RCVBUF 被 net.core.rmem_max 限制为 {self.effective_rcvbuf // 1024} KB "
+                           f"(请求 {self.rcvbuf // 1024} KB)，可在宿主机调大 net.core.rmem_max")
+            return socket.SO_RCVBUF
+        self.effective_rcvbuf = probe.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2
+        return SO_RCVBUFFORCE
+
+    def socket_options(self):
+        """urllib3 的 socket_options：建立连接前设置"""
+        return list(self.options)
+
+    def create_socket(self, family=socket.AF_INET, sock_type=socket.SOCK_STREAM, proto=0):
+        """创建已设置好选项、尚未连接的套接字，供 asyncio 的连接在 connect() 之前调优"""
+        sock = socket.socket(family, sock_type, proto)
+        self.apply(sock)
+        return sock
+
+    def socket_factory(self, addr_info):
+        """aiohttp TCPConnector 的 socket_factory，参数为 getaddrinfo 返回的一项"""
+        family, sock_type, proto, _, _ = addr_info
+        return self.create_socket(family, sock_type, proto)
+
+    def apply(self, sock):
+        """在套接字上设置选项；已建立的连接上 SO_RCVBUF 只能部分生效"""
+        if sock is None:
+            return
+        for level, option, value in self.options:
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError:
+                pass
+        with self._lock:
+            self.tuned_sockets += 1
+
+    def observe(self, sock):
+        """从 TCP_INFO 采样连接的RTT和接收窗口，每个文件下载结束时调用一次"""
+        if sock is None or TCP_INFO is None:
+            return
+        try:
+            info = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, _TCP_INFO_SIZE)
+        except OSError:
+            return
+        if len(info) < _TCPI_RCV_SPACE_OFFSET + 4:
+            return
+        rtt_us = _U32.unpack_from(info, _TCPI_RTT_OFFSET)[0]
+        rcv_space = _U32.unpack_from(info, _TCPI_RCV_SPACE_OFFSET)[0]
+        with self._lock:
+            self.samples += 1
+            self.rtt_us_sum += rtt_us
+            self.rcv_space_sum += rcv_space
+
+    def record_splice(self, nbytes):
+        with self._lock:
+            self.spliced_bytes += nbytes
+
+    def describe(self):
+        """返回便于打印的配置描述"""
+        parts = []
+        if self.rcvbuf:
+            parts.append(f"SO_RCVBUF {self.rcvbuf // 1024} KB")
+        parts.append(f"TCP_NODELAY {'开' if self.nodelay else '关'}")
+        if self.congestion:
+            parts.append(f"拥塞控制 {self.congestion}")
+        if self.splice:
+            parts.append("splice 丢弃")
+        return ', '.join(parts)
+
+    def summary(self):
+        """返回生效的设置和实测的RTT、接收窗口"""
+        parts = [f"已调优 {self.tuned_sockets} 个连接" if self.tuned_sockets else self.describe()]
+        if self.effective_rcvbuf is not None:
+            parts.append(f"接收缓冲区实际 {self.effective_rcvbuf // 1024} KB")
+        with self._lock:
+            samples, rtt_us_sum, rcv_space_sum = self.samples, self.rtt_us_sum, self.rcv_space_sum
+        if samples:
+            rtt_ms = rtt_us_sum / samples / 1000
+            rcv_space = rcv_space_sum / samples
+            text = f"平均RTT {rtt_ms:.1f} ms, 平均接收窗口 {rcv_space / 1024:.0f} KB"
+            if rtt_ms > 0:
+                # 单连接吞吐上限约为 接收窗口 / RTT
+                text += f" (单连接上限约 {rcv_space / rtt_ms * 1000 / (1024 * 1024):.1f} MB/s)"
+            parts.append(text)
+        if self.spliced_bytes:
+            parts.append(f"splice 丢弃 {self.spliced_bytes / (1024 * 1024):.1f} MB")
+        return ', '.join(parts)
+
+
+class SpliceSink:
+    """用 splice 把套接字数据经管道直接转到 /dev/null，响应体不复制到用户态
+
+    同一时刻只能由一个下载使用（管道中的数据不能交错），由 SplicePool 分配。
+    """
+
+    def __init__(self, pipe_size=256 * 1024):
+        self.read_fd, self.write_fd = os.pipe()
+        self.devnull = os.open(os.devnull, os.O_WRONLY)
+        self.pipe_size = pipe_size
+        try:
+            import fcntl
+            # 默认 64 KB 的管道每次只能搬运 64 KB，放大以减少系统调用；超过 pipe-max-size 时保持默认
+            self.pipe_size = fcntl.fcntl(self.write_fd, F_SETPIPE_SZ, pipe_size)
+        except OSError:
+            self.pipe_size = 64 * 1024
+
+    def discard(self, sock, length, chunk_size, idle_timeout):
+        """丢弃套接字上接下来的 length 字节，逐段生成每次搬运的字节数；
+        idle_timeout 秒内没有数据时抛出 socket.timeout，None 表示一直等待"""
+        fd = sock.fileno()
+        chunk_size = min(chunk_size, self.pipe_size)
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        remaining = length
+        while remaining > 0:
+            try:
+                moved = _splice(fd, self.write_fd, min(remaining, chunk_size), SPLICE_F_MOVE | SPLICE_F_NONBLOCK)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                if not poller.poll(None if idle_timeout is None else idle_timeout * 1000):
+                    raise socket.timeout("读取超时")
+                continue
+            if moved == 0:
+                raise ConnectionResetError("连接在响应结束前被关闭")
+            left = moved
+            while left:
+                left -= _splice(self.read_fd, self.devnull, left, SPLICE_F_MOVE)
+            remaining -= moved
+            yield moved
+
+    def close(self):
+        for fd in (self.read_fd, self.write_fd, self.devnull):
+            os.close(fd)
+
+
+class SplicePool:
+    """SpliceSink 的空闲列表：线程池每轮重建，按下载借还而不是按线程持有，管道数不超过并发数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return SpliceSink()
+
+    def release(self, sink):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(sink)
+                return
+        sink.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for sink in idle:
+            sink.close()
+
+
+_connector_class = None
+
+
+def create_tuned_connector(profile, **options):
+    """创建按 SocketProfile 设置套接字选项的 aiohttp TCPConnector
+
+    aiohttp 支持 socket_factory 时在 connect() 之前设置；更早的版本只能在连接建立后设置，
+    此时 SO_RCVBUF 无法影响握手时协商的窗口扩大因子，记录一次警告。
+    """
+    global _connector_class
+    import aiohttp
+    if 'socket_factory' in inspect.signature(aiohttp.TCPConnector.__init__).parameters:
+        return aiohttp.TCPConnector(socket_factory=profile.socket_factory, **options)
+    if _connector_class is None:
+        if profile.rcvbuf:
+            logger.warning("⚠️ 当前 aiohttp 不支持 socket_factory，SO_RCVBUF 在连接建立后设置，"
+                           "窗口扩大因子已在握手时确定，接收窗口只能部分增大；可升级 aiohttp 或设置 ASYNC_TRANSPORT=raw")
+
+        class TunedTCPConnector(aiohttp.TCPConnector):
+            def __init__(self, profile, **kwargs):
+                super().__init__(**kwargs)
+                self._socket_profile = profile
+
+            async def _wrap_create_connection(self, *args, **kwargs):
+                # aiohttp 没有公开的建立连接回调，在它创建连接的统一入口之后设置选项
+                transport, protocol = await super()._wrap_create_connection(*args, **kwargs)
+                self._socket_profile.apply(transport.get_extra_info('socket'))
+                return transport, protocol
+
+        _connector_class = TunedTCPConnector
+    return _connector_class(profile, **options)
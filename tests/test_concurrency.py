@@ -0,0 +1,97 @@
+import pytest
+
+import concurrency
+from concurrency import ConcurrencyController, _read_int, _read_stat, memory_budget_mb, read_cgroup_memory
+
+MB = 1024 * 1024
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def cgroup_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrency, 'CGROUP_ROOT', str(tmp_path))
+    return tmp_path
+
+
+def use_cgroup(monkeypatch, v2=None, v1=None):
+    monkeypatch.setattr(concurrency, '_cgroup_paths', lambda: (v2, v1))
+
+
+def test_read_int_handles_max_missing_and_unlimited(tmp_path):
+    assert _read_int(write(tmp_path / 'a', '536870912\n')) == 512 * MB
+    assert _read_int(write(tmp_path / 'b', 'max\n')) is None
+    # cgroup v1 未设置限制时的页对齐大数
+    assert _read_int(write(tmp_path / 'c', '9223372036854771712\n')) is None
+    assert _read_int(str(tmp_path / 'missing')) is None
+
+
+def test_read_stat_finds_key_or_returns_zero(tmp_path):
+    path = write(tmp_path / 'memory.stat', 'anon 100\ninactive_file 4096\nactive_file 8192\n')
+    assert _read_stat(path, 'inactive_file') == 4096
+    assert _read_stat(path, 'total_inactive_file') == 0
+    assert _read_stat(str(tmp_path / 'missing'), 'inactive_file') == 0
+
+
+def test_cgroup_v2_limit_and_working_set(cgroup_root, monkeypatch):
+    use_cgroup(monkeypatch, v2='/docker/abc')
+    base = cgroup_root / 'docker' / 'abc'
+    write(base / 'memory.max', f'{256 * MB}\n')
+    write(base / 'memory.current', f'{100 * MB}\n')
+    write(base / 'memory.stat', f'anon {60 * MB}\ninactive_file {30 * MB}\n')
+    # 工作集扣除可回收的 inactive_file
+    assert read_cgroup_memory() == (256 * MB, 70 * MB)
+
+
+def test_cgroup_v2_falls_back_to_mount_root(cgroup_root, monkeypatch):
+    # 容器内只挂载了自己的 cgroup，/proc/self/cgroup 中的路径在挂载点下不存在
+    use_cgroup(monkeypatch, v2='/docker/abc')
+    write(cgroup_root / 'memory.max', 'max\n')
+    write(cgroup_root / 'memory.current', f'{10 * MB}\n')
+    assert read_cgroup_memory() == (None, 10 * MB)
+
+
+def test_cgroup_v1_limit(cgroup_root, monkeypatch):
+    use_cgroup(monkeypatch, v1='/docker/abc')
+    base = cgroup_root / 'memory' / 'docker' / 'abc'
+    write(base / 'memory.limit_in_bytes', f'{512 * MB}\n')
+    write(base / 'memory.usage_in_bytes', f'{50 * MB}\n')
+    write(base / 'memory.stat', f'total_inactive_file {80 * MB}\n')
+    # 用量不会因扣除页缓存变成负数
+    assert read_cgroup_memory() == (512 * MB, 0)
+
+
+def test_no_cgroup_files(cgroup_root, monkeypatch):
+    use_cgroup(monkeypatch)
+    assert read_cgroup_memory() == (None, None)
+
+
+def test_memory_budget_is_clamped_to_cgroup_limit(monkeypatch):
+    monkeypatch.setattr(concurrency, 'read_cgroup_memory', lambda: (None, None))
+    assert memory_budget_mb(500) == (500, None)
+    monkeypatch.setattr(concurrency, 'read_cgroup_memory', lambda: (200 * MB, 50 * MB))
+    assert memory_budget_mb(500) == (pytest.approx(180), 200)
+    assert memory_budget_mb(100) == (100, 200)
+
+
+def test_controller_keeps_a_probe_that_raises_throughput():
+    controller = ConcurrencyController(initial=8, max_limit=32, cooldown=2)
+    assert controller.update(80.0, active=8) == 10
+    # 调整后跳过一个周期
+    assert controller.update(80.0, active=10) == 10
+    # 新增 2 个下载带来的吞吐超过平均份额的一半，保留并在同一周期继续向上试探
+    assert controller.update(100.0, active=10) == 12
+    assert controller.increases == 2
+
+
+def test_controller_reverts_a_useless_probe_and_halves_on_memory_pressure():
+    controller = ConcurrencyController(initial=8, max_limit=32, cooldown=2)
+    controller.update(80.0, active=8)
+    controller.update(80.0, active=10)
+    assert controller.update(81.0, active=10) == 8
+    assert controller.update(0.0, active=0) == 8
+    assert controller.update(80.0, active=8, memory_paused=True) == 4
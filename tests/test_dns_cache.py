@@ -0,0 +1,138 @@
+import asyncio
+import socket
+
+import pytest
+
+import dns_cache
+from conftest import FakeClock
+from dns_cache import DNSCache, is_ip_address
+
+IPS = ('10.0.0.1', '10.0.0.2', '10.0.0.3')
+
+
+class Resolver:
+    """替代 getaddrinfo：返回预设的地址，可设置为失败，记录调用次数"""
+
+    def __init__(self, ips=IPS):
+        self.ips = ips
+        self.calls = 0
+        self.error = None
+
+    def infos(self, port):
+        # 重复的IP（不同 socktype/proto）应被去重
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (ip, port)) for ip in self.ips + self.ips[:1]]
+
+    def __call__(self, host, port, *args, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.infos(port)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dns_cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    resolver = Resolver()
+    monkeypatch.setattr(dns_cache.socket, 'getaddrinfo', resolver)
+    return resolver
+
+
+def first_ips(cache, count):
+    return [cache.resolve('mirror.example', 443)[0][1][0] for _ in range(count)]
+
+
+def test_is_ip_address():
+    assert is_ip_address('10.0.0.1')
+    assert is_ip_address('[::1]')
+    assert not is_ip_address('mirror.example')
+
+
+def test_new_connections_rotate_across_ips(clock, resolver):
+    cache = DNSCache(ttl=120)
+    assert first_ips(cache, 4) == ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1']
+    # 每次都返回完整列表，供连接失败时依次尝试
+    assert [a[1][0] for a in cache.resolve('MIRROR.example', 443)] == ['10.0.0.2', '10.0.0.3', '10.0.0.1']
+    assert resolver.calls == 1
+    assert cache.hits == 4 and cache.lookups == 1
+
+
+def test_expired_entry_is_refreshed_keeping_rotation(clock, resolver):
+    cache = DNSCache(ttl=120)
+    first_ips(cache, 2)
+    clock.advance(121)
+    assert first_ips(cache, 1) == ['10.0.0.3']
+    assert resolver.calls == 2
+
+
+def test_failed_ip_moves_to_the_end_until_cooldown(clock, resolver):
+    cache = DNSCache(failure_cooldown=30)
+    cache.mark_failure('10.0.0.1')
+    assert [a[1][0] for a in cache.resolve('mirror.example', 443)] == ['10.0.0.2', '10.0.0.3', '10.0.0.1']
+    clock.advance(31)
+    assert first_ips(cache, 2) == ['10.0.0.2', '10.0.0.3']
+    assert first_ips(cache, 1) == ['10.0.0.1']
+
+
+def test_mark_success_restores_ip(clock, resolver):
+    cache = DNSCache(failure_cooldown=30)
+    cache.mark_failure('10.0.0.1')
+    cache.mark_success('10.0.0.1')
+    assert first_ips(cache, 1) == ['10.0.0.1']
+
+
+def test_lookup_failure_falls_back_to_stale_entry(clock, resolver):
+    cache = DNSCache(ttl=120, stale_retry=10)
+    first_ips(cache, 1)
+    clock.advance(121)
+    resolver.error = socket.gaierror('temporary failure')
+    assert first_ips(cache, 1) == ['10.0.0.2']
+    assert cache.lookup_errors == 1
+    # 在 stale_retry 秒内沿用旧记录，不重复查询
+    first_ips(cache, 3)
+    assert resolver.calls == 2
+    clock.advance(11)
+    first_ips(cache, 1)
+    assert resolver.calls == 3
+
+
+def test_lookup_failure_without_cache_raises(clock, resolver):
+    resolver.error = socket.gaierror('no such host')
+    with pytest.raises(socket.gaierror):
+        DNSCache().resolve('mirror.example', 443)
+
+
+def test_finish_attempt_blames_the_preferred_ip(clock, resolver):
+    cache = DNSCache(failure_cooldown=30)
+    cache.finish_attempt([], failed=True)
+    assert not cache._unhealthy
+    # 首选IP连接失败后回退到了第二个地址
+    cache.finish_attempt(['10.0.0.1'], peer_ip='10.0.0.2')
+    assert list(cache._unhealthy) == ['10.0.0.1']
+    cache.finish_attempt(['10.0.0.3'], failed=True)
+    assert sorted(cache._unhealthy) == ['10.0.0.1', '10.0.0.3']
+    cache.finish_attempt(['10.0.0.1'], peer_ip='10.0.0.1')
+    assert list(cache._unhealthy) == ['10.0.0.3']
+
+
+def test_concurrent_async_lookups_share_one_query(resolver):
+    cache = DNSCache()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+
+        async def getaddrinfo(host, port, **kwargs):
+            await asyncio.sleep(0.01)
+            return resolver(host, port)
+
+        loop.getaddrinfo = getaddrinfo
+        return await asyncio.gather(*[cache.async_resolve('mirror.example', 80) for _ in range(3)])
+
+    results = asyncio.run(run())
+    assert resolver.calls == 1
+    assert [addresses[0][1][0] for addresses in results] == list(IPS)
@@ -0,0 +1,174 @@
+import pytest
+
+import health
+from conftest import FakeClock
+from health import HealthTracker, describe_open
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+URL = 'http://mirror.example/a.iso'
+OTHER = 'http://mirror.example/b.iso'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(health, 'time', clock)
+    return clock
+
+
+def tracker(**kwargs):
+    kwargs.setdefault('jitter', 0.0)
+    return HealthTracker(**kwargs)
+
+
+def test_url_opens_after_consecutive_failures(clock):
+    health_tracker = tracker(url_threshold=3, host_threshold=0, base_backoff=30.0)
+    assert health_tracker.record_failure(URL, StatusError(500)) == (None, None)
+    assert health_tracker.record_failure(URL, StatusError(500)) == (None, None)
+    assert health_tracker.record_failure(URL, StatusError(500)) == (30.0, None)
+    assert not health_tracker.allow(URL)
+    assert health_tracker.allow(OTHER)
+    assert health_tracker.skipped == 1
+    assert health_tracker.open_count() == (1, 0)
+
+
+def test_success_resets_failure_count(clock):
+    health_tracker = tracker(url_threshold=2, host_threshold=0)
+    health_tracker.record_failure(URL, StatusError(500))
+    health_tracker.record_success(URL)
+    assert health_tracker.record_failure(URL, StatusError(500)) == (None, None)
+
+
+def test_permanent_status_opens_immediately_without_touching_host(clock):
+    health_tracker = tracker(url_threshold=3, host_threshold=1)
+    assert health_tracker.record_failure(URL, StatusError(404)) == (30.0, None)
+    assert health_tracker.allow(OTHER)
+
+
+def test_half_open_allows_a_single_trial(clock):
+    health_tracker = tracker(url_threshold=1, host_threshold=0, trial_timeout=60.0)
+    health_tracker.record_failure(URL, StatusError(503))
+    clock.advance(30.0)
+    # 退避结束进入半开：只放行一个试探下载
+    assert health_tracker.allow(URL)
+    assert not health_tracker.allow(URL)
+    # 试探超时未回报，再放行一次
+    clock.advance(60.0)
+    assert health_tracker.allow(URL)
+    health_tracker.record_success(URL)
+    assert health_tracker.allow(URL) and health_tracker.allow(URL)
+
+
+def test_failed_trial_doubles_backoff_up_to_max(clock):
+    health_tracker = tracker(url_threshold=3, host_threshold=0, base_backoff=30.0, max_backoff=100.0)
+    for _ in range(3):
+        health_tracker.record_failure(URL, StatusError(500))
+    expected = (60.0, 100.0, 100.0)
+    for backoff in expected:
+        clock.advance(200.0)
+        assert health_tracker.allow(URL)
+        # 半开状态下一次失败就重新打开，不需要再累计 threshold 次
+        assert health_tracker.record_failure(URL, StatusError(500)) == (backoff, None)
+
+
+def test_failures_while_open_are_not_counted(clock):
+    health_tracker = tracker(url_threshold=1, host_threshold=0, base_backoff=30.0)
+    health_tracker.record_failure(URL, StatusError(500))
+    # 熔断前已在途的下载陆续失败
+    assert health_tracker.record_failure(URL, StatusError(500)) == (None, None)
+    clock.advance(30.0)
+    assert health_tracker.allow(URL)
+    assert health_tracker.record_failure(URL, StatusError(500)) == (60.0, None)
+
+
+def test_host_breaker_counts_only_transport_and_server_errors(clock):
+    health_tracker = tracker(url_threshold=0, host_threshold=2, base_backoff=10.0)
+    assert health_tracker.record_failure(URL, StatusError(403)) == (None, None)
+    assert health_tracker.record_failure(URL, ConnectionError()) == (None, None)
+    assert health_tracker.record_failure(OTHER, StatusError(429)) == (None, 10.0)
+    # 主机熔断影响同主机的所有URL
+    assert not health_tracker.allow(URL)
+    assert not health_tracker.allow(OTHER)
+    assert health_tracker.allow('http://other.example/a.iso')
+    assert health_tracker.open_count() == (0, 1)
+
+
+def test_jitter_stays_within_bounds(clock):
+    health_tracker = HealthTracker(url_threshold=1, host_threshold=0, base_backoff=100.0, jitter=0.2)
+    for _ in range(50):
+        assert 80.0 <= health_tracker._backoff(1) <= 120.0
+
+
+def test_disabled_tracker_allows_everything(clock):
+    health_tracker = tracker(url_threshold=0, host_threshold=0)
+    assert not health_tracker.enabled
+    assert health_tracker.record_failure(URL, StatusError(404)) == (None, None)
+    assert health_tracker.allow(URL)
+    assert health_tracker.summary() is None
+
+
+def test_describe_open():
+    assert describe_open(None, None) == ""
+    assert describe_open(30.4, None) == " [URL熔断 30 秒]"
+    assert describe_open(30.0, 600.0) == " [URL熔断 30 秒, 主机熔断 600 秒]"
+
+
+def test_skipped_download_releases_the_trial(clock):
+    health_tracker = tracker(url_threshold=1, host_threshold=1, trial_timeout=60.0)
+    health_tracker.record_failure(URL, StatusError(503))
+    clock.advance(30.0)
+    assert health_tracker.allow(URL)
+    # 试探下载因内存过高未开始，名额立即归还，不必等 trial_timeout
+    health_tracker.release(URL)
+    assert health_tracker.allow(URL)
+
+
+def test_retry_after_points_at_the_earliest_breaker(clock):
+    health_tracker = tracker(url_threshold=1, host_threshold=0, base_backoff=30.0)
+    assert health_tracker.retry_after() == 0.0
+    health_tracker.record_failure(URL, StatusError(503))
+    clock.advance(10.0)
+    health_tracker.record_failure(OTHER, StatusError(503))
+    assert health_tracker.retry_after() == pytest.approx(20.0)
+    clock.advance(20.0)
+    assert health_tracker.allow(URL)
+    # 半开试探进行中按1秒计，结果出来后即可再次判断
+    assert health_tracker.retry_after() == pytest.approx(1.0)
+
+
+def test_sync_engine_releases_the_trial_when_memory_stays_high(clock, monkeypatch):
+    from download_sync import TrafficFlowManager
+    health_tracker = tracker(url_threshold=1, host_threshold=0)
+    manager = TrafficFlowManager(max_memory_mb=4096, health=health_tracker)
+    try:
+        health_tracker.record_failure(URL, StatusError(503))
+        clock.advance(30.0)
+        assert health_tracker.allow(URL)
+        monkeypatch.setattr(manager, 'wait_for_memory_safe', lambda: False)
+        assert not manager.download_and_discard(URL)
+        assert health_tracker.allow(URL)
+    finally:
+        manager.memory_governor.stop()
+
+
+def test_continuous_worker_backs_off_on_the_first_skip():
+    import time
+    from download_sync import TrafficFlowManager
+    health_tracker = tracker(url_threshold=1, host_threshold=0, base_backoff=0.5)
+    manager = TrafficFlowManager(max_memory_mb=4096, health=health_tracker)
+    try:
+        health_tracker.record_failure(URL, StatusError(503))
+        started = time.monotonic()
+        manager.continuous_download([URL], max_workers=1, repeat_count=1, stats_interval=3600)
+        elapsed = time.monotonic() - started
+    finally:
+        manager.memory_governor.stop()
+    # 熔断中的URL只被询问一次，随后等到熔断器重新放行
+    assert health_tracker.skipped == 1
+    assert elapsed >= 0.4
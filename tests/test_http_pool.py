@@ -0,0 +1,71 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_pool
+from conftest import FakeClock
+from connection_pool import ConnectionStats, WarmTargets
+from http_pool import HostSessionPool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '100')
+        self.end_headers()
+        self.wfile.write(b'x' * 100)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/file"
+    server.shutdown()
+    server.server_close()
+
+
+def test_idle_connections_expire_after_keepalive(url, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(http_pool, 'time', clock)
+    stats = ConnectionStats()
+    pool = HostSessionPool(keepalive=60, connection_stats=stats)
+    try:
+        for _ in range(2):
+            pool.get(url).get(url).content
+        assert stats.connects == 1
+        clock.advance(61)
+        pool.get(url).get(url).content
+        assert stats.connects == 2
+    finally:
+        pool.close()
+
+
+def test_limit_per_host_caps_warm_connections(url):
+    stats = ConnectionStats()
+    pool = HostSessionPool(pool_maxsize=2, pool_block=True, connection_stats=stats)
+    try:
+        assert pool.warm(url, 4) == 2
+        # 预热的连接被下载复用，不再新建
+        pool.get(url).get(url).content
+        assert stats.connects == 2
+    finally:
+        pool.close()
+
+
+def test_warm_targets_keep_one_url_per_host_until_cleared():
+    targets = WarmTargets(max_hosts=2)
+    for url in ['http://a/1', 'http://a/2', 'https://b/1', 'http://c/1']:
+        targets.note(url)
+    assert targets.urls() == ['http://a/1', 'https://b/1']
+    targets.clear()
+    targets.note('http://c/1')
+    assert targets.urls() == ['http://c/1']
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import memory_governor
+from conftest import FakeClock
+from memory_governor import MemoryGovernor
+
+
+class ScriptedStop:
+    """按给定的 RSS 序列驱动 _run：每次 wait 推进时钟并返回 False，序列用完后停止"""
+
+    def __init__(self, governor, clock, samples):
+        self.governor = governor
+        self.clock = clock
+        self.samples = list(samples)
+        # 每一步结束后是否接纳新下载
+        self.admitted = []
+        governor.sample = self.sample
+
+    def sample(self):
+        return self.samples.pop(0)
+
+    def wait(self, timeout):
+        if self.clock.now > 1000.0:
+            self.admitted.append(self.governor.admission.is_set())
+        self.clock.advance(timeout)
+        return not self.samples
+
+    def set(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(memory_governor, 'time', clock)
+    return clock
+
+
+def run(governor, clock, samples, monkeypatch):
+    collections = []
+    monkeypatch.setattr(memory_governor.gc, 'collect', lambda: collections.append(clock.now))
+    governor._stop_event = ScriptedStop(governor, clock, samples)
+    governor._run()
+    return collections, governor._stop_event.admitted
+
+
+def test_admission_pauses_and_resumes_with_hysteresis(clock, monkeypatch):
+    governor = MemoryGovernor(100, gc_ratio=1.0)
+    # 90% 暂停；85% 仍在恢复阈值之上保持暂停；79% 恢复，再升到 85% 不会重新暂停
+    _, admitted = run(governor, clock, [50, 90, 85, 79, 85], monkeypatch)
+    assert admitted == [True, False, False, True, True]
+    assert governor.admission.is_set()
+
+
+def test_forced_gc_is_rate_limited(clock, monkeypatch):
+    governor = MemoryGovernor(100, sample_interval=1.0, min_gc_interval=5.0)
+    # 超过回收阈值 (70%) 时强制回收，之后 5 秒内不再重复
+    collections, _ = run(governor, clock, [71] * 12, monkeypatch)
+    assert len(collections) == 2
+    assert collections[1] - collections[0] >= 5.0
+    assert governor.forced_collections == 2
+
+
+def test_low_memory_never_collects(clock, monkeypatch):
+    governor = MemoryGovernor(100)
+    collections, admitted = run(governor, clock, [10, 20, 69], monkeypatch)
+    assert collections == [] and all(admitted)
+    assert governor.admission.is_set()
+
+
+def test_wait_for_admission_times_out_and_stop_releases_waiters():
+    governor = MemoryGovernor(100, sample_interval=0.01)
+    governor.admission.clear()
+    assert not governor.wait_for_admission(timeout=0.01)
+    assert not asyncio.run(governor.async_wait_for_admission(timeout=0.03))
+    governor.stop()
+    assert governor.wait_for_admission(timeout=0)
+    assert asyncio.run(governor.async_wait_for_admission(timeout=0))
+
+
+
+def test_stalled_after_a_long_pause(clock, monkeypatch):
+    governor = MemoryGovernor(100, gc_ratio=1.0)
+    run(governor, clock, [95], monkeypatch)
+    assert governor.paused_at == clock.now - 1.0
+    clock.advance(58.0)
+    assert not governor.stalled(60)
+    clock.advance(1.0)
+    assert governor.stalled(60)
+    # timeout 为 0 表示一直等待
+    assert not governor.stalled(0)
+    governor.stop()
+    assert governor.paused_at is None and not governor.stalled(60)
+
+
+def test_resume_clears_the_stall(clock, monkeypatch):
+    governor = MemoryGovernor(100, gc_ratio=1.0)
+    run(governor, clock, [95, 95, 95, 50], monkeypatch)
+    assert governor.paused_at is None
+    assert not governor.stalled(1)
+
+
+def test_min_worker_budget_leaves_room_below_the_resume_threshold():
+    budget = memory_governor.min_worker_budget_mb(30)
+    # 基础占用加预留仍低于恢复阈值，暂停后总能恢复
+    assert (30 + memory_governor.WORKER_HEADROOM_MB) < budget * memory_governor.RESUME_RATIO + 1e-9
+    assert budget == pytest.approx(62.5)
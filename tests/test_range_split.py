@@ -0,0 +1,136 @@
+import asyncio
+import re
+
+import aiohttp
+
+from download_async import AsyncTrafficFlowManager
+from range_split import MB, SegmentPlanner, parse_content_range_total
+
+
+def drain(planner):
+    return list(iter(planner.next_segment, None))
+
+
+def test_parse_content_range_total():
+    assert parse_content_range_total('bytes 0-0/12345') == 12345
+    assert parse_content_range_total('bytes 0-99/*') is None
+    assert parse_content_range_total('') is None
+    assert parse_content_range_total(None) is None
+
+
+def test_segments_cover_the_file_exactly_once():
+    planner = SegmentPlanner(100 * MB + 123, streams=4)
+    segments = drain(planner)
+    assert segments[0] == (0, 4 * MB - 1)
+    offset = 0
+    for start, end in segments:
+        assert start == offset and end >= start
+        offset = end + 1
+    assert offset == 100 * MB + 123
+
+
+def test_tail_is_split_across_streams():
+    planner = SegmentPlanner(8 * MB, streams=4, initial_size=16 * MB, min_size=1 * MB)
+    segments = drain(planner)
+    # 每次按剩余部分均分给各连接，而不是一个连接领走整个文件；区间逐渐缩小但不小于 min_size
+    assert segments[0] == (0, 2 * MB - 1)
+    assert segments[1] == (2 * MB, 2 * MB + 6 * MB // 4 - 1)
+    sizes = [end - start + 1 for start, end in segments]
+    assert sizes == sorted(sizes, reverse=True)
+    assert min(sizes[:-1]) >= 1 * MB
+    assert sum(sizes) == 8 * MB
+
+
+def test_small_file_is_a_single_segment():
+    assert drain(SegmentPlanner(1000, streams=4)) == [(0, 999)]
+
+
+def test_planner_starts_after_already_downloaded_bytes():
+    segments = drain(SegmentPlanner(3 * MB, streams=4, start=1))
+    assert segments[0][0] == 1
+    assert sum(end - start + 1 for start, end in segments) == 3 * MB - 1
+
+
+class RangeServer:
+    """本地 HTTP/1.1 服务器：按 Range 头返回 206，记录每个请求实际发送的字节数"""
+
+    def __init__(self, size):
+        self.size = size
+        self.sent = []
+
+    async def handle(self, reader, writer):
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            start, end = map(int, re.search(rb'Range: bytes=(\d+)-(\d+)', head).groups())
+            end = min(end, self.size - 1)
+            self.sent.append(end - start + 1)
+            writer.write(b'HTTP/1.1 206 Partial Content\r\n'
+                         b'Content-Range: bytes %d-%d/%d\r\n'
+                         b'Content-Length: %d\r\n\r\n' % (start, end, self.size, end - start + 1))
+            writer.write(b'x' * (end - start + 1))
+            await writer.drain()
+        writer.close()
+
+
+def test_ranged_download_counts_each_byte_once():
+
+    async def run():
+        server = RangeServer(3 * MB + 123)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        url = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}/file"
+        manager = AsyncTrafficFlowManager(max_memory_mb=4096, range_streams=4, range_min_size_mb=1)
+        try:
+            async with aiohttp.ClientSession() as session:
+                assert await manager.async_download_and_discard(session, url)
+        finally:
+            manager.memory_governor.stop()
+            listener.close()
+            await listener.wait_closed()
+        return server, manager
+
+    server, manager = asyncio.run(run())
+    # 探测请求取回的首字节不会被分段再下载一次
+    assert len(server.sent) > 2
+    assert sum(server.sent) == server.size
+    assert manager.downloaded_bytes == server.size
+
+
+def test_report_adapts_segment_size_within_bounds():
+    planner = SegmentPlanner(1 << 40, streams=1, initial_size=4 * MB, min_size=1 * MB,
+                             max_size=16 * MB, target_seconds=2.0)
+    # 8 MB/s × 2 秒 = 16 MB，与当前 4 MB 取平均
+    planner.report(8 * MB, 1.0)
+    assert planner.segment_size == 10 * MB
+    for _ in range(10):
+        planner.report(100 * MB, 1.0)
+    assert planner.segment_size == 16 * MB
+    for _ in range(10):
+        planner.report(1, 1.0)
+    assert planner.segment_size == 1 * MB
+    # 无效反馈被忽略
+    planner.report(0, 1.0)
+    planner.report(MB, 0)
+    assert planner.segment_size == 1 * MB
+
+
+def test_requeued_segment_is_handed_out_first():
+    planner = SegmentPlanner(10 * MB, streams=2, initial_size=2 * MB)
+    first = planner.next_segment()
+    second = planner.next_segment()
+    planner.requeue(first[0] + 100, first[1])
+    # 空区间不入队
+    planner.requeue(second[1] + 1, second[1])
+    assert planner.next_segment() == (first[0] + 100, first[1])
+    assert planner.next_segment() == (second[1] + 1, second[1] + 2 * MB)
+    rest = drain(planner)
+    assert rest[-1][1] == 10 * MB - 1
+
+
+def test_requeue_after_exhaustion_reopens_planner():
+    planner = SegmentPlanner(3 * MB, streams=1)
+    drain(planner)
+    planner.requeue(MB, 2 * MB - 1)
+    assert drain(planner) == [(MB, 2 * MB - 1)]
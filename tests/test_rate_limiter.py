@@ -0,0 +1,116 @@
+import pytest
+
+import rate_limiter
+from conftest import FakeClock
+from rate_limiter import Pacer, TokenBucket, per_download_limiter, reserve_all
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(0)
+    assert not bucket.enabled
+    assert bucket.reserve(10 * 1024 * 1024) == 0
+
+
+def test_default_burst(clock):
+    assert TokenBucket(1).capacity == 16 * 1024
+    assert TokenBucket(1000).capacity == 1000 * 1024 * 0.25
+
+
+def test_reserve_within_burst_is_free(clock):
+    bucket = TokenBucket(100, burst_bytes=50 * 1024)
+    assert bucket.reserve(50 * 1024) == 0
+    assert bucket.tokens == 0
+
+
+def test_reserve_overdraws_and_queues_debt(clock):
+    bucket = TokenBucket(100, burst_bytes=10 * 1024)
+    # 透支 10 KiB，需等 0.1 秒
+    assert bucket.reserve(20 * 1024) == pytest.approx(0.1)
+    # 后到的预留排在已有欠款之后
+    assert bucket.reserve(10 * 1024) == pytest.approx(0.2)
+
+
+def test_debt_is_repaid_over_time(clock):
+    bucket = TokenBucket(100, burst_bytes=10 * 1024)
+    bucket.reserve(30 * 1024)
+    clock.advance(0.15)
+    assert bucket.reserve(0) == pytest.approx(0.05)
+    clock.advance(1.0)
+    assert bucket.reserve(0) == 0
+    # 回补不超过桶容量
+    assert bucket.tokens == 10 * 1024
+
+
+def test_long_run_rate_matches_setting(clock):
+    bucket = TokenBucket(64, burst_bytes=1024)
+    start = clock.now
+    total = 0
+    for size in (1000, 7000, 300, 16384, 5000) * 20:
+        clock.advance(bucket.reserve(size))
+        total += size
+    elapsed = clock.now - start
+    # 扣除初始突发量后，实际速率等于设定速率
+    assert (total - 1024) / elapsed == pytest.approx(64 * 1024)
+
+
+def test_set_rate_clamps_tokens_to_new_capacity(clock):
+    bucket = TokenBucket(1000)
+    assert bucket.tokens == bucket.capacity
+    bucket.set_rate(300)
+    assert bucket.capacity == 300 * 1024 * 0.25
+    assert bucket.tokens == bucket.capacity
+    bucket.set_rate(0)
+    assert bucket.reserve(1 << 30) == 0
+
+
+def test_reserve_all_takes_the_strictest_limiter(clock):
+    fast = TokenBucket(1000, burst_bytes=1024)
+    slow = TokenBucket(10, burst_bytes=1024)
+    delay = reserve_all((fast, None, slow), 11 * 1024)
+    assert delay == pytest.approx(1.0)
+    assert reserve_all((), 1024) == 0
+
+
+def test_per_download_limiter_uses_granularity_burst(clock):
+    assert per_download_limiter(0) is None
+    limiter = per_download_limiter(256, granularity=0.01)
+    assert limiter.capacity == int(256 * 1024 * 0.01)
+    assert per_download_limiter(1, granularity=0.0001).capacity == 1
+
+
+def test_pacer_sleeps_only_above_granularity(clock):
+    pacer = Pacer.for_download(None, max_speed_kbps=100, granularity=0.05)
+    assert pacer.enabled
+    burst = int(100 * 1024 * 0.05)
+    # 欠款不足 granularity 时不 sleep，欠款留到下一次
+    assert pacer.pace(burst + 1024) == 0.0
+    assert clock.now == 1000.0
+    assert pacer.pace(5 * 1024) == pytest.approx(0.06)
+    assert clock.now == pytest.approx(1000.06)
+
+
+def test_pacer_read_size_follows_strictest_rate(clock):
+    assert Pacer.for_download(None).read_size(65536) == 65536
+    assert Pacer.for_download(TokenBucket(0), 100).read_size(65536) == 100 * 1024 // 10
+    assert Pacer.for_download(None, 10).read_size(65536) == 4096
+
+
+def test_backlog_reports_queued_debt(clock):
+    assert TokenBucket(0).backlog() == 0.0
+    bucket = TokenBucket(100, burst_bytes=10 * 1024)
+    assert bucket.backlog() == 0.0
+    bucket.reserve(30 * 1024)
+    assert bucket.backlog() == pytest.approx(0.2)
+    # 查询不改变欠款
+    assert bucket.backlog() == pytest.approx(0.2)
+    clock.advance(0.15)
+    assert bucket.backlog() == pytest.approx(0.05)
+    clock.advance(1.0)
+    assert bucket.backlog() == 0.0
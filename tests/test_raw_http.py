@@ -0,0 +1,185 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from raw_http import HTTPStatusError, RawHTTPClient, _SinkProtocol
+from timeouts import TimeoutPolicy
+
+REQUEST = b'GET / HTTP/1.1\r\nHost: test\r\n\r\n'
+
+
+class FakeTransport:
+    def __init__(self):
+        self.closed = False
+        self.reading = True
+        self.written = b''
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+    def is_reading(self):
+        return self.reading
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 80) if name == 'peername' else default
+
+
+def feed(response, step, eof=False):
+    """把响应按 step 字节一段喂给协议，返回 ((状态码, 响应体字节数), 协议, 传输)"""
+
+    async def run():
+        protocol = _SinkProtocol(memoryview(bytearray(64 * 1024)))
+        transport = FakeTransport()
+        protocol.connection_made(transport)
+        stripe = SimpleNamespace(downloaded_bytes=0)
+        future = protocol.start(REQUEST, stripe, (), None, TimeoutPolicy(), lambda: True)
+        for i in range(0, len(response), step):
+            piece = response[i:i + step]
+            protocol.view[:len(piece)] = piece
+            protocol.buffer_updated(len(piece))
+        if eof:
+            protocol.eof_received()
+        status, size, reads, _ = await future
+        assert stripe.downloaded_bytes == size
+        return (status, size), protocol, transport
+
+    return asyncio.run(run())
+
+
+STEPS = (1, 7, 64 * 1024)
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_content_length_keeps_connection(step):
+    result, protocol, transport = feed(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n0123456789', step)
+    assert result == (200, 10)
+    assert protocol.reusable and not transport.closed
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_connection_close_is_not_reused(step):
+    result, protocol, transport = feed(
+        b'HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 3\r\n\r\nabc', step)
+    assert result == (200, 3)
+    assert not protocol.reusable and transport.closed
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_chunked_body_counts_only_data(step):
+    body = (b'5;ext=1\r\nhello\r\n1A\r\n' + b'x' * 26 + b'\r\n'
+            b'0\r\nX-Trailer: 1\r\n\r\n')
+    result, protocol, transport = feed(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + body, step)
+    assert result == (200, 31)
+    assert protocol.reusable and not transport.closed
+
+
+@pytest.mark.parametrize('step', STEPS)
+def test_body_without_length_ends_at_eof(step):
+    result, protocol, transport = feed(b'HTTP/1.1 200 OK\r\n\r\n' + b'y' * 50, step, eof=True)
+    assert result == (200, 50)
+    assert not protocol.reusable and transport.closed
+
+
+def test_http10_needs_explicit_keep_alive():
+    _, protocol, _ = feed(b'HTTP/1.0 200 OK\r\nContent-Length: 1\r\n\r\nz', 64)
+    assert not protocol.reusable
+    _, protocol, _ = feed(b'HTTP/1.0 200 OK\r\nConnection: Keep-Alive\r\nContent-Length: 1\r\n\r\nz', 64)
+    assert protocol.reusable
+
+
+def test_interim_response_and_empty_bodies():
+    result, protocol, _ = feed(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok', 5)
+    assert result == (200, 2) and protocol.reusable
+    result, protocol, _ = feed(b'HTTP/1.1 204 No Content\r\n\r\n', 64)
+    assert result == (204, 0) and protocol.reusable
+
+
+def test_trailing_bytes_after_body_disable_reuse():
+    result, protocol, transport = feed(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nokEXTRA', 64)
+    assert result == (200, 2)
+    assert not protocol.reusable and transport.closed
+
+
+def test_error_status_finishes_without_reading_body():
+    result, protocol, transport = feed(b'HTTP/1.1 404 Not Found\r\nContent-Length: 9\r\n\r\nnot found', 64)
+    assert result == (404, 0)
+    assert transport.closed
+
+
+def test_truncated_body_fails():
+    with pytest.raises(ConnectionResetError):
+        feed(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n01234', 64, eof=True)
+
+
+def test_invalid_chunk_size_fails():
+    with pytest.raises(ConnectionError):
+        feed(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n', 64)
+
+
+class Server:
+    """本地 HTTP/1.1 服务器：/close 返回后关闭连接，/missing 返回 404，其他路径按 keep-alive 返回 1000 字节"""
+
+    def __init__(self):
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                break
+            path = head.split(b' ', 2)[1]
+            if path == b'/missing':
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+            elif path == b'/close':
+                writer.write(b'HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 1000\r\n\r\n' + b'c' * 1000)
+            else:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n' + b'k' * 1000)
+            await writer.drain()
+            if path == b'/close':
+                break
+        writer.close()
+
+
+def test_client_reuses_keep_alive_connections():
+
+    async def run():
+        server = Server()
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        base = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+        client = RawHTTPClient()
+        stripe = SimpleNamespace(downloaded_bytes=0)
+        policy = TimeoutPolicy()
+        try:
+            sizes = [(await client.download(f"{base}/{i}", stripe, policy=policy)).size for i in range(3)]
+            keep_alive_connections = server.connections
+            await client.download(f"{base}/close", stripe, policy=policy)
+            await client.download(f"{base}/after", stripe, policy=policy)
+            with pytest.raises(HTTPStatusError) as excinfo:
+                await client.download(f"{base}/missing", stripe, policy=policy)
+        finally:
+            client.close()
+            listener.close()
+        return sizes, keep_alive_connections, server.connections, stripe.downloaded_bytes, excinfo.value.status
+
+    sizes, keep_alive_connections, connections, downloaded, status = asyncio.run(run())
+    assert sizes == [1000, 1000, 1000]
+    assert keep_alive_connections == 1
+    # /close 之后需要新连接，/missing 复用它
+    assert connections == 2
+    assert downloaded == 5000
+    assert status == 404
@@ -0,0 +1,47 @@
+from scheduler import WeightedURLScheduler, parse_host_weights, parse_size, parse_url_line
+
+
+def test_smooth_weighted_round_robin_interleaves():
+    scheduler = WeightedURLScheduler(['a', 'b', 'c'], {'a': 5})
+    assert [scheduler.next() for _ in range(7)] == ['a', 'a', 'b', 'a', 'c', 'a', 'a']
+    # 每个周期结束后状态归零，下一周期完全重复
+    assert [scheduler.next() for _ in range(7)] == ['a', 'a', 'b', 'a', 'c', 'a', 'a']
+
+
+def test_picks_are_proportional_to_effective_weight():
+    urls = ['http://x.example/1', 'http://x.example/2', 'http://y.example/1']
+    scheduler = WeightedURLScheduler(urls, {urls[0]: 2}, {'x.example': 3})
+    picks = [scheduler.next() for _ in range(int(scheduler.total_weight) * 10)]
+    assert picks.count(urls[0]) == 60
+    assert picks.count(urls[1]) == 30
+    assert picks.count(urls[2]) == 10
+
+
+def test_zero_weight_urls_are_dropped():
+    scheduler = WeightedURLScheduler(['a', 'b'], {'a': 0})
+    assert scheduler.urls == ['b']
+    assert WeightedURLScheduler(['a'], {'a': 0}).next() is None
+
+
+def test_max_picks_limits_the_scheduler():
+    scheduler = WeightedURLScheduler(['a', 'b'], max_picks=3)
+    assert [scheduler.next() for _ in range(4)] == ['a', 'b', 'a', None]
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('100M') == 100 * 1024 ** 2
+    assert parse_size('1.5kb') == 1536
+
+
+def test_parse_url_line():
+    entry = parse_url_line('http://x/1')
+    assert (entry.url, entry.weight, entry.speed_kbps, entry.size) == ('http://x/1', 1.0, 0, None)
+    entry = parse_url_line('http://x/1 weight=2 speed=300 size=1G bogus weight=oops')
+    assert (entry.url, entry.weight, entry.speed_kbps, entry.size) == ('http://x/1', 2.0, 300, 1024 ** 3)
+
+
+def test_parse_host_weights_skips_invalid_items():
+    assert parse_host_weights('') == {}
+    assert parse_host_weights('A.example=2, b.example=0.5,bad,c.example=x') == {
+        'a.example': 2.0, 'b.example': 0.5}
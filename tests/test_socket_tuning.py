@@ -0,0 +1,78 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import aiohttp
+
+from raw_http import RawHTTPClient
+from socket_tuning import SocketProfile, create_tuned_connector
+from timeouts import TimeoutPolicy
+
+
+class RecordingProfile(SocketProfile):
+    """记录 create_socket 返回时套接字是否已连接"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.created = []
+
+    def create_socket(self, *args, **kwargs):
+        sock = super().create_socket(*args, **kwargs)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2 == self.effective_rcvbuf
+        try:
+            sock.getpeername()
+            connected = True
+        except OSError:
+            connected = False
+        self.created.append((sock, connected))
+        return sock
+
+
+async def handle(reader, writer):
+    await reader.readuntil(b'\r\n\r\n')
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n' + b'x' * 1000)
+    await writer.drain()
+    writer.close()
+
+
+def fetch_with(fetch):
+    async def run():
+        listener = await asyncio.start_server(handle, '127.0.0.1', 0)
+        try:
+            return await fetch(f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}/file")
+        finally:
+            listener.close()
+
+    return asyncio.run(run())
+
+
+def assert_tuned_before_connect(profile):
+    assert profile.created
+    assert not any(connected for _, connected in profile.created)
+    assert profile.tuned_sockets == len(profile.created)
+
+
+def test_raw_client_tunes_sockets_before_connect():
+    profile = RecordingProfile(rcvbuf=256 * 1024)
+    client = RawHTTPClient(socket_profile=profile)
+
+    async def fetch(url):
+        try:
+            return (await client.download(url, SimpleNamespace(downloaded_bytes=0), policy=TimeoutPolicy())).size
+        finally:
+            client.close()
+
+    assert fetch_with(fetch) == 1000
+    assert_tuned_before_connect(profile)
+
+
+def test_aiohttp_connector_tunes_sockets_before_connect():
+    profile = RecordingProfile(rcvbuf=256 * 1024)
+
+    async def fetch(url):
+        async with aiohttp.ClientSession(connector=create_tuned_connector(profile)) as session:
+            async with session.get(url) as response:
+                return len(await response.read())
+
+    assert fetch_with(fetch) == 1000
+    assert_tuned_before_connect(profile)
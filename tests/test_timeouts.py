@@ -0,0 +1,99 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import timeouts
+from conftest import FakeClock
+from download_sync import TrafficFlowManager
+from timeouts import DeadlineExceededError, StalledStreamError, StreamWatchdog, TimeoutPolicy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(timeouts, 'time', clock)
+    return clock
+
+
+def test_no_limits_means_no_watchdog():
+    assert TimeoutPolicy().watchdog(with_deadline=True) is None
+    assert TimeoutPolicy(total_deadline=5).watchdog() is None
+
+
+def test_time_left_counts_down_to_the_deadline(clock):
+    watchdog = StreamWatchdog(0, 20, deadline=1.5)
+    clock.advance(1.0)
+    assert watchdog.time_left() == pytest.approx(0.5)
+    clock.advance(1.0)
+    assert watchdog.time_left() == 0.0
+    with pytest.raises(DeadlineExceededError):
+        watchdog.expire()
+
+
+def test_time_left_stretches_with_bytes_already_received(clock):
+    watchdog = StreamWatchdog(1000, 2)
+    assert watchdog.time_left() == pytest.approx(2.0)
+    # 3000 字节按 1000 B/s 的下限可以撑到 3 秒
+    watchdog.update(3000)
+    assert watchdog.time_left() == pytest.approx(3.0)
+    # 限速器让出的时间不计入
+    watchdog.pause(0.5)
+    assert watchdog.time_left() == pytest.approx(3.5)
+    clock.advance(3.5)
+    with pytest.raises(StalledStreamError):
+        watchdog.expire()
+
+
+def test_deadline_wins_when_it_comes_first(clock):
+    watchdog = StreamWatchdog(1000, 20, deadline=1.0)
+    assert watchdog.time_left() == pytest.approx(1.0)
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """按约 10 KB/s 的速度发送一个 1 MB 的响应体"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(1024 * 1024))
+        self.end_headers()
+        try:
+            for _ in range(1024):
+                self.wfile.write(b'x' * 1024)
+                self.wfile.flush()
+                time.sleep(0.1)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def trickle_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/file"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('policy, limit', [
+    (TimeoutPolicy(total_deadline=1.5), 1.5),
+    (TimeoutPolicy(min_throughput_kbps=64, throughput_window=2), 2.0),
+])
+def test_sync_engine_enforces_limits_on_a_slow_trickle(trickle_url, policy, limit):
+    manager = TrafficFlowManager(max_memory_mb=4096, chunk_size=64 * 1024, timeout_policy=policy)
+    try:
+        started = time.monotonic()
+        assert not manager.download_and_discard(trickle_url)
+        elapsed = time.monotonic() - started
+    finally:
+        manager.memory_governor.stop()
+    # 64 KiB 的整块读取要 6 秒才返回一次，限制必须在读取中途生效
+    assert limit <= elapsed < limit + 1.0
@@ -0,0 +1,112 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import traffic_plan
+from traffic_plan import GB, TrafficPlan, parse_rate_schedule
+
+# 每天 86400 秒，按 100 KB/s 匀速恰好用完
+DAY_QUOTA = 86400 * 100 * 1024
+
+
+def test_parse_rate_schedule_ranges_and_wraparound():
+    schedule = parse_rate_schedule('0-2=5000, 3=0,22-1=off,bad,25=1,x-y=3')
+    # 22-1 跨零点，覆盖了之前为 0、1 点设置的值
+    assert schedule == {0: None, 1: None, 2: 5000.0, 3: 0.0, 22: None, 23: None}
+    assert parse_rate_schedule('') == {}
+
+
+def test_quota_is_spread_evenly_over_the_day():
+    plan = TrafficPlan(daily_quota=DAY_QUOTA)
+    assert plan.enabled
+    assert plan.compute(datetime(2024, 5, 1, 0, 0)) == (pytest.approx(100), None)
+    plan.record(DAY_QUOTA // 2, datetime(2024, 5, 1, 11, 0))
+    assert plan.compute(datetime(2024, 5, 1, 12, 0)) == (pytest.approx(100), None)
+    # 前半天多用了，后半天自动放慢
+    plan.record(DAY_QUOTA // 4, datetime(2024, 5, 1, 12, 0))
+    assert plan.compute(datetime(2024, 5, 1, 12, 0)) == (pytest.approx(50), None)
+
+
+def test_quota_follows_schedule_weights_and_pauses():
+    plan = TrafficPlan(schedule=parse_rate_schedule('0-11=1000,12-23=off'), daily_quota=DAY_QUOTA)
+    # 下午暂停，整天的配额摊到上午 12 小时
+    assert plan.compute(datetime(2024, 5, 1, 0, 0)) == (pytest.approx(200), None)
+    assert plan.compute(datetime(2024, 5, 1, 13, 0)) == (0, "计划暂停时段 (13 点)")
+
+
+def test_exhausted_quota_pauses_until_rollover():
+    plan = TrafficPlan(daily_quota=GB, monthly_quota=10 * GB)
+    plan.record(GB, datetime(2024, 1, 31, 23, 0))
+    assert plan.compute(datetime(2024, 1, 31, 23, 30)) == (0, "今日配额已用完")
+    # 跨天只清零日计数，跨月再清零月计数
+    rate, reason = plan.compute(datetime(2024, 2, 1, 0, 0))
+    assert reason is None and rate > 0
+    assert (plan.day, plan.day_bytes, plan.month, plan.month_bytes) == ('2024-02-01', 0, '2024-02', 0)
+    plan.record(GB // 2, datetime(2024, 2, 1, 0, 0))
+    plan.record(GB // 2, datetime(2024, 2, 2, 0, 0))
+    assert (plan.day_bytes, plan.month_bytes) == (GB // 2, GB)
+
+
+def test_monthly_quota_limits_below_daily_pace():
+    plan = TrafficPlan(daily_quota=DAY_QUOTA, monthly_quota=DAY_QUOTA * 3)
+    # 4 月有 30 天，月配额只够每天 1/10
+    assert plan.compute(datetime(2024, 4, 1, 0, 0)) == (pytest.approx(10), None)
+
+    # 剩余配额很少时保持最低 1 KB/s
+    plan = TrafficPlan(monthly_quota=DAY_QUOTA)
+    plan.record(DAY_QUOTA - 1, datetime(2024, 4, 1, 0, 0))
+    assert plan.compute(datetime(2024, 4, 1, 0, 0)) == (1.0, None)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    state_file = str(tmp_path / 'state' / 'plan.json')
+    plan = TrafficPlan(daily_quota=GB, state_file=state_file)
+    plan.record(123456)
+    plan.save()
+    assert plan._saved
+    restored = TrafficPlan(daily_quota=GB, state_file=state_file)
+    restored.load()
+    assert (restored.day_bytes, restored.month_bytes) == (123456, 123456)
+
+
+def test_load_ignores_stale_or_corrupt_state(tmp_path):
+    state_file = tmp_path / 'plan.json'
+    state_file.write_text(json.dumps({'day': '2000-01-01', 'day_bytes': 5, 'month': '2000-01', 'month_bytes': 7}))
+    plan = TrafficPlan(state_file=str(state_file))
+    plan.load()
+    assert (plan.day_bytes, plan.month_bytes) == (0, 0)
+    state_file.write_text('{not json')
+    plan.load()
+    assert plan.day_bytes == 0
+
+
+def test_failed_replace_keeps_previous_state(tmp_path, monkeypatch):
+    state_file = tmp_path / 'plan.json'
+    plan = TrafficPlan(state_file=str(state_file))
+    plan.record(100)
+    plan.save()
+    before = state_file.read_text()
+
+    def broken_replace(src, dst):
+        raise OSError('disk full')
+
+    plan.record(100)
+    monkeypatch.setattr(traffic_plan.os, 'replace', broken_replace)
+    plan.save()
+    # 旧文件完好，临时文件已清理，之前成功保存过所以不关闭持久化
+    assert state_file.read_text() == before
+    assert os.listdir(tmp_path) == ['plan.json']
+    assert plan.state_file == str(state_file)
+
+
+def test_unwritable_state_file_disables_persistence(tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    plan = TrafficPlan(state_file=str(blocker / 'plan.json'))
+    plan.save()
+    assert plan.state_file is None
+    # 之后的保存直接跳过
+    plan.save()
+    assert plan.state_file is None
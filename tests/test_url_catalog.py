@@ -0,0 +1,63 @@
+import itertools
+import os
+
+from url_catalog import CatalogScheduler, URLCatalog
+
+
+def write_urls(tmp_path, text):
+    path = tmp_path / 'urls.txt'
+    path.write_text(text)
+    return path
+
+
+def test_catalog_skips_comments_and_blank_lines(tmp_path):
+    path = write_urls(tmp_path, '# 注释\n\nhttp://a/1 weight=2\n  http://b/1  \n')
+    catalog = URLCatalog(str(path), reload_interval=0)
+    assert [(entry.url, entry.weight) for entry in catalog.entries()] == [('http://a/1', 2.0), ('http://b/1', 1.0)]
+    assert catalog.last_count == 2
+
+
+def test_catalog_shards_split_lines_by_index(tmp_path):
+    path = write_urls(tmp_path, ''.join(f'http://h/{i}\n' for i in range(5)))
+    shards = [[entry.url for entry in URLCatalog(str(path), shard_index=i, shard_count=2).entries()]
+              for i in range(2)]
+    assert shards == [['http://h/0', 'http://h/2', 'http://h/4'], ['http://h/1', 'http://h/3']]
+
+
+def test_shard_without_urls_takes_the_whole_list(tmp_path):
+    path = write_urls(tmp_path, 'http://h/0\n')
+    assert [entry.url for entry in URLCatalog(str(path), shard_index=1, shard_count=2).entries()] == ['http://h/0']
+
+
+def test_catalog_detects_file_changes(tmp_path):
+    path = write_urls(tmp_path, 'http://a/1\n')
+    catalog = URLCatalog(str(path), reload_interval=0.001)
+    list(catalog.entries())
+    catalog._last_check = 0.0
+    assert not catalog.changed()
+    path.write_text('http://a/1\nhttp://b/1\n')
+    os.utime(path, ns=(0, 10 ** 9))
+    catalog._last_check = 0.0
+    assert catalog.changed()
+
+
+def test_catalog_scheduler_covers_every_url_each_pass(tmp_path):
+    path = write_urls(tmp_path, 'http://a/1 weight=3\nhttp://b/1\nhttp://c/1 weight=0\nhttp://d/1\n')
+    scheduler = CatalogScheduler(URLCatalog(str(path), reload_interval=0), passes=2, window=2)
+    picks = [entry.url for entry in iter(scheduler.next, None)]
+    # 每轮: 窗口1 (a×3, b×1)；窗口2 中 c 权重为0不调度，领取次数不少于窗口URL数，d 领取2次
+    assert sorted(picks) == sorted(['http://a/1'] * 6 + ['http://b/1'] * 2 + ['http://d/1'] * 4)
+    assert scheduler.completed_passes == 2
+    assert scheduler.next() is None
+
+
+def test_catalog_scheduler_stops_when_nothing_is_schedulable(tmp_path):
+    path = write_urls(tmp_path, 'http://a/1 weight=0\n')
+    scheduler = CatalogScheduler(URLCatalog(str(path), reload_interval=0))
+    assert list(itertools.islice(iter(scheduler.next, None), 5)) == []
+
+
+def test_from_list_uses_given_weights():
+    scheduler = CatalogScheduler(URLCatalog.from_list(['http://a/1', 'http://b/1'], {'http://b/1': 2}), passes=1)
+    # 一个完整的加权轮询周期：总权重 3 / 最小权重 1
+    assert [entry.url for entry in iter(scheduler.next, None)] == ['http://b/1', 'http://a/1', 'http://b/1']
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from raw_http import RawHTTPClient
+from timeouts import TimeoutPolicy
+from wire_bytes import response_head_size
+
+
+def raw_head(version, status, reason, headers):
+    lines = [f"HTTP/{version} {status} {reason}"] + [f"{name}: {value}" for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+@pytest.mark.parametrize('version, status, reason, headers', [
+    ('1.1', 200, 'OK', [('Content-Length', '1024'), ('Content-Type', 'application/octet-stream')]),
+    ('1.0', 206, 'Partial Content', [('Content-Range', 'bytes 0-0/12345'), ('Content-Length', '1')]),
+    ('1.1', 204, 'No Content', []),
+    # 同名的响应头各算一行
+    ('1.1', 200, 'OK', [('Set-Cookie', 'a=1'), ('Set-Cookie', 'b=2'), ('Transfer-Encoding', 'chunked')]),
+])
+def test_response_head_size_matches_wire_format(version, status, reason, headers):
+    assert response_head_size(version, status, reason, headers) == len(raw_head(version, status, reason, headers))
+
+
+def test_raw_client_counts_every_byte_on_the_wire():
+    head = raw_head('1.1', 200, 'OK', [('Transfer-Encoding', 'chunked')])
+    body = b'a\r\n' + b'x' * 10 + b'\r\n' + b'5\r\n' + b'y' * 5 + b'\r\n0\r\n\r\n'
+
+    async def handle(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        writer.write(head + body)
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        listener = await asyncio.start_server(handle, '127.0.0.1', 0)
+        url = f"http://127.0.0.1:{listener.sockets[0].getsockname()[1]}/"
+        client = RawHTTPClient()
+        counted = SimpleNamespace(downloaded_bytes=0)
+        wire = SimpleNamespace(downloaded_bytes=0)
+        try:
+            result = await client.download(url, counted, policy=TimeoutPolicy())
+            await client.download(url, wire, policy=TimeoutPolicy(), wire_bytes=True)
+        finally:
+            client.close()
+            listener.close()
+        return result.size, counted.downloaded_bytes, wire.downloaded_bytes
+
+    size, counted, wire = asyncio.run(run())
+    assert size == counted == 15
+    assert wire == len(head) + len(body)
@@ -0,0 +1,130 @@
+import os
+import time
+
+
+class StalledStreamError(Exception):
+    """下载流吞吐持续低于下限，判定为停滞"""
+
+
+class DeadlineExceededError(Exception):
+    """下载超过了总截止时间"""
+
+
+class TimeoutPolicy:
+    """单个URL的分阶段超时配置
+
+    connect: 建立连接 (含TLS握手) 的超时
+    first_byte: 从发起请求到收到响应头的超时
+    idle_read: 响应体两次读取之间的最长空闲时间
+    total_deadline: 整个文件的总截止时间，0 表示不限制
+    min_throughput_kbps: 最低吞吐，在 throughput_window 秒内低于该值则断开重新调度，0 表示关闭
+    """
+
+    def __init__(self, connect=10, first_byte=30, idle_read=30, total_deadline=0,
+                 min_throughput_kbps=0, throughput_window=20):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle_read = idle_read
+        self.total_deadline = total_deadline
+        self.min_throughput_kbps = min_throughput_kbps
+        self.throughput_window = throughput_window
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取超时配置"""
+        return cls(
+            connect=float(os.getenv('CONNECT_TIMEOUT', '10')),
+            first_byte=float(os.getenv('FIRST_BYTE_TIMEOUT', '30')),
+            idle_read=float(os.getenv('IDLE_TIMEOUT', '30')),
+            total_deadline=float(os.getenv('TOTAL_DEADLINE', '0')),
+            min_throughput_kbps=float(os.getenv('MIN_THROUGHPUT_KBPS', '0')),
+            throughput_window=float(os.getenv('THROUGHPUT_WINDOW', '20'))
+        )
+
+    def describe(self):
+        """返回便于打印的超时配置描述"""
+        deadline = f"{self.total_deadline:g}s" if self.total_deadline > 0 else "不限"
+        text = (f"连接 {self.connect:g}s / 首字节 {self.first_byte:g}s / "
+                f"空闲 {self.idle_read:g}s / 总时长 {deadline}")
+        if self.min_throughput_kbps > 0:
+            text += f" / 最低吞吐 {self.min_throughput_kbps:g} KB/s ({self.throughput_window:g}s 窗口)"
+        return text
+
+    def aiohttp_timeout(self):
+        """转换为 aiohttp 的超时配置（总时长由调用方按整个文件控制）"""
+        import aiohttp
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.connect, sock_read=self.idle_read)
+
+    def requests_timeout(self):
+        """转换为 requests 的 (连接超时, 读超时)，读超时在收到响应头前按首字节超时计算"""
+        return (self.connect, self.first_byte)
+
+    def watchdog(self, with_deadline=False):
+        """为一个下载流创建看门狗，不需要时返回 None"""
+        deadline = self.total_deadline if with_deadline and self.total_deadline > 0 else None
+        if self.min_throughput_kbps <= 0 and deadline is None:
+            return None
+        return StreamWatchdog(self.min_throughput_kbps * 1024, self.throughput_window, deadline)
+
+
+class StreamWatchdog:
+    """最低吞吐看门狗：按窗口统计吞吐，窗口内低于下限时抛出 StalledStreamError
+
+    限速器主动让出的时间通过 pause() 扣除，不会把被限速的流误判为停滞。
+    """
+
+    def __init__(self, min_bytes_per_sec, window, deadline=None):
+        now = time.monotonic()
+        self.min_bytes_per_sec = min_bytes_per_sec
+        self.window = window
+        self.deadline_at = now + deadline if deadline else None
+        self.window_start = now
+        self.window_bytes = 0
+        self.paused = 0.0
+
+    def pause(self, seconds):
+        """记录限速器造成的等待时间"""
+        self.paused += seconds
+
+    def update(self, nbytes):
+        """记录读取到的字节数，必要时检查吞吐和截止时间"""
+        self.window_bytes += nbytes
+        now = time.monotonic()
+        if self.deadline_at is not None and now >= self.deadline_at:
+            raise DeadlineExceededError("超过总截止时间")
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+        active = elapsed - self.paused
+        if self.min_bytes_per_sec > 0 and active > 0:
+            throughput = self.window_bytes / active
+            if throughput < self.min_bytes_per_sec:
+                raise StalledStreamError(
+                    f"下载停滞: {throughput / 1024:.1f} KB/s 低于下限 {self.min_bytes_per_sec / 1024:.1f} KB/s"
+                )
+        self.window_start = now
+        self.window_bytes = 0
+        self.paused = 0.0
+
+    def time_left(self):
+        """之后不再收到数据时，距离判定超时或停滞还有多少秒；没有截止时间和吞吐下限时返回 None"""
+        now = time.monotonic()
+        left = None
+        if self.deadline_at is not None:
+            left = self.deadline_at - now
+        if self.min_bytes_per_sec > 0:
+            # 窗口内已收到的字节按下限吞吐能撑多久，至少撑到窗口结束
+            stalled_at = self.window_start + max(self.window,
+                                                 self.paused + self.window_bytes / self.min_bytes_per_sec)
+            left = stalled_at - now if left is None else min(left, stalled_at - now)
+        return None if left is None else max(0.0, left)
+
+    def expire(self):
+        """读取等待超过 time_left() 仍未收到数据：按截止时间或停滞抛出异常"""
+        now = time.monotonic()
+        if self.deadline_at is not None and now >= self.deadline_at:
+            raise DeadlineExceededError("超过总截止时间")
+        active = max(now - self.window_start - self.paused, 1e-9)
+        raise StalledStreamError(
+            f"下载停滞: {self.window_bytes / active / 1024:.1f} KB/s 低于下限 {self.min_bytes_per_sec / 1024:.1f} KB/s"
+        )
@@ -0,0 +1,632 @@
+"""TrafficFlow 统一入口
+
+两个下载引擎共用这里的管理器基类、配置、启动信息和多进程分片，只在下载和调度循环上各自实现：
+
+    python traffic_flow.py --engine thread               # 线程池 (requests)
+    python traffic_flow.py --engine asyncio              # 异步IO (aiohttp / raw)
+    python traffic_flow.py --engine asyncio --workers 4  # 多进程，每个进程运行一个引擎
+
+运行中可用信号查看内部状态，不需要重启容器：
+
+    kill -USR1 <pid>   # 输出在途下载及其速率、限速器积压、各阶段耗时和内存分配热点
+    kill -USR2 <pid>   # 采样分析 PROFILE_SECONDS 秒，在 PROFILE_DIR 写入火焰图折叠栈文件
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import threading
+import time
+
+from concurrency import ConcurrencyController, initial_concurrency, memory_budget_mb
+from connection_pool import ConnectionStats, PoolPolicy, WarmTargets
+from dns_cache import DNSCache
+from health import HealthTracker, describe_open
+from log_config import dropped_count, get_logger, setup_logging, shutdown_logging
+from memory_governor import MemoryGovernor, min_worker_budget_mb, process_rss_mb
+from metrics import Metrics, describe_errors, describe_phases, start_metrics_server
+from multiworker import print_shared_statistics, run_sharded
+from profiling import InFlightTracker, SamplingProfiler, allocation_lines, start_tracemalloc
+from rate_limiter import TokenBucket
+from scheduler import parse_host_weights, parse_size
+from socket_tuning import SocketProfile
+from timeouts import TimeoutPolicy
+from traffic_plan import DEFAULT_STATE_FILE, TrafficPlan, parse_rate_schedule
+from url_catalog import URLCatalog
+from wire_bytes import IDENTITY_HEADERS
+
+logger = get_logger('core')
+
+URLS_FILE = '/app/urls.txt'
+# 引擎名 -> (模块, 管理器类)，按需导入，只用线程引擎时不需要安装 aiohttp
+ENGINES = {
+    'thread': ('download_sync', 'TrafficFlowManager'),
+    'asyncio': ('download_async', 'AsyncTrafficFlowManager'),
+}
+ENGINE_ALIASES = {'sync': 'thread', 'async': 'asyncio'}
+
+
+def engine_class(name):
+    """按引擎名返回管理器类，支持 sync/async 别名"""
+    name = ENGINE_ALIASES.get(name, name)
+    if name not in ENGINES:
+        raise ValueError(f"未知的下载引擎: {name} (可选: {', '.join(ENGINES)})")
+    module, cls = ENGINES[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+class BaseTrafficFlowManager:
+    """下载管理器的公共部分：统计、内存、并发控制、流量计划、限速、熔断和日志
+
+    子类实现具体的下载与调度循环，并提供 run(catalog, config) 按配置运行。
+    """
+
+    engine = None
+    # 各引擎的默认值：线程比协程开销大，默认并发更低
+    DEFAULT_INITIAL_CONCURRENCY = 3
+    DEFAULT_MAX_CONCURRENCY = 16
+    DEFAULT_INTERVAL = 2
+
+    def __init__(self, max_memory_mb=100, chunk_size=8192, sink_mode=False, sink_buffer_kb=256,
+                 memory_sample_interval=1.0, memory_wait_timeout=60, timeout_policy=None, metrics_per_url=False,
+                 dns_cache_ttl=120, health=None, concurrency=None, traffic_plan=None, pool_policy=None,
+                 wire_bytes=False, socket_profile=None, profiler=None, tracemalloc_frames=0):
+        self.running = True
+        # 按线程分片的指标计数器，downloaded_bytes 由它汇总，热路径无需加锁
+        self.metrics = Metrics(per_url=metrics_per_url)
+        self._downloaded_bytes_offset = 0
+        self.downloaded_bytes = 0
+        self.start_time = time.time()
+        # 容器中以 cgroup 内存限制为准，配置值超过它时收紧
+        self.max_memory_mb, cgroup_limit_mb = memory_budget_mb(max_memory_mb)
+        if self.max_memory_mb < max_memory_mb:
+            logger.warning(f"⚠️ 容器内存限制为 {cgroup_limit_mb:.0f} MB，内存预算调整为 {self.max_memory_mb:.0f} MB")
+        self.chunk_size = chunk_size
+        self.active_downloads = 0
+        # 并发控制器：按实测吞吐在 [min, max] 之间调整在途下载数，默认初始值按可用内存计算
+        self.concurrency = concurrency or ConcurrencyController(
+            initial=initial_concurrency(self.DEFAULT_INITIAL_CONCURRENCY),
+            max_limit=self.DEFAULT_MAX_CONCURRENCY
+        )
+        self.max_active_downloads = self.concurrency.limit
+        # 流量计划：按时段限速和每日/每月配额接管全局限速，配额用完或暂停时段内不再开始新的下载
+        self.traffic_plan = traffic_plan or TrafficPlan()
+        self.paused = False
+        # 全局限速器，所有并发下载共享
+        self.rate_limiter = TokenBucket(0)
+        # 限速时累积到该时长才 sleep 一次，减少系统调用和线程切换；也是单文件限速器的突发时长
+        self.pacing_granularity = 0.01
+        # urls.txt 中为单个URL指定的调度权重
+        self.url_weights = {}
+        self.sink_mode = sink_mode
+        self.sink_buffer_size = max(64, min(1024, sink_buffer_kb)) * 1024
+        # 线路字节模式：请求不压缩的响应，响应体按原始字节计数不解压，响应头计入下载量
+        self.wire_bytes = wire_bytes
+        self.request_headers = IDENTITY_HEADERS if wire_bytes else None
+        # 连接/首字节/空闲/总时长分阶段超时及最低吞吐看门狗
+        self.timeout_policy = timeout_policy or TimeoutPolicy()
+        # DNS缓存：按 TTL 缓存解析结果，新连接轮询分散到主机的各个IP；TTL 为 0 时使用默认解析
+        self.dns_cache = DNSCache(ttl=dns_cache_ttl) if dns_cache_ttl > 0 else None
+        # URL/主机熔断：连续失败的来源在退避期内不再占用下载槽位
+        self.health = health or HealthTracker()
+        # 连接池：每主机连接数、空闲保留时间和轮次间隔中的连接预热，复用情况计入 connection_stats
+        self.pool_policy = pool_policy or PoolPolicy()
+        self.connection_stats = ConnectionStats()
+        self.warm_targets = WarmTargets()
+        # 套接字调优：接收缓冲区、TCP选项、拥塞控制和 splice 丢弃，未启用时不做额外的系统调用
+        self.socket_profile = socket_profile or SocketProfile()
+        # 运行时诊断：在途下载进度供 SIGUSR1 输出，SIGUSR2 开始一个采样分析窗口
+        self.inflight = InFlightTracker()
+        self.profiler = profiler or SamplingProfiler()
+        start_tracemalloc(tracemalloc_frames)
+
+        # 后台内存管理器：定时采样RSS，按需回收并控制新下载的接纳
+        self.memory_governor = MemoryGovernor(self.max_memory_mb, sample_interval=memory_sample_interval)
+        self.memory_governor.start()
+        # 暂停接纳超过该秒数后不再等待，新下载直接跳过，0 表示一直等待
+        self.memory_wait_timeout = memory_wait_timeout
+        self.concurrency.start(self)
+
+        self.metrics.add_gauge('trafficflow_active_downloads', '正在进行的下载数',
+                               lambda: self.active_downloads)
+        self.metrics.add_gauge('trafficflow_max_active_downloads', '最大并发下载数',
+                               lambda: self.max_active_downloads)
+        self.metrics.add_gauge('trafficflow_rss_bytes', '进程常驻内存',
+                               lambda: int(self.memory_governor.rss_mb * 1024 * 1024))
+        self.metrics.add_gauge('trafficflow_gc_cpu_seconds', 'GC累计占用的CPU时间',
+                               lambda: self.memory_governor.gc_cpu_seconds)
+        self.metrics.add_gauge('trafficflow_open_url_breakers', '处于熔断状态的URL数',
+                               lambda: self.health.open_count()[0])
+        self.metrics.add_gauge('trafficflow_open_host_breakers', '处于熔断状态的主机数',
+                               lambda: self.health.open_count()[1])
+        self.metrics.add_gauge('trafficflow_connection_reuse_ratio', '请求复用已有连接的比例',
+                               self.connection_stats.reuse_ratio)
+
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.introspection_handler)
+            signal.signal(signal.SIGUSR2, self.introspection_handler)
+
+    @classmethod
+    def from_config(cls, config):
+        """按 load_config() 的配置创建管理器"""
+        return cls(
+            max_memory_mb=config['max_memory_mb'],
+            chunk_size=config['chunk_size'],
+            sink_mode=config['sink_mode'],
+            sink_buffer_kb=config['sink_buffer_kb'],
+            memory_sample_interval=config['memory_sample_interval'],
+            memory_wait_timeout=config['memory_wait_timeout'],
+            timeout_policy=config['timeout_policy'],
+            metrics_per_url=config['metrics_per_url'],
+            dns_cache_ttl=config['dns_cache_ttl'],
+            health=HealthTracker(
+                url_threshold=config['breaker_failures'],
+                host_threshold=config['host_breaker_failures'],
+                base_backoff=config['breaker_backoff'],
+                max_backoff=config['breaker_max_backoff']
+            ),
+            concurrency=ConcurrencyController(
+                initial=initial_concurrency(cls.DEFAULT_INITIAL_CONCURRENCY),
+                min_limit=config['min_concurrency'],
+                max_limit=cls.concurrency_limit(config),
+                adaptive=config['adaptive_concurrency']
+            ),
+            traffic_plan=TrafficPlan(
+                schedule=config['rate_schedule'],
+                base_kbps=config['max_speed_kbps'],
+                daily_quota=config['daily_quota'],
+                monthly_quota=config['monthly_quota'],
+                state_file=config['traffic_state_file'] or None
+            ),
+            pool_policy=config['pool_policy'],
+            wire_bytes=config['wire_bytes'],
+            socket_profile=config['socket_profile'],
+            profiler=SamplingProfiler(
+                seconds=config['profile_seconds'],
+                interval=config['profile_interval'],
+                directory=config['profile_dir']
+            ),
+            tracemalloc_frames=config['tracemalloc_frames'],
+            **cls.engine_options(config)
+        )
+
+    @classmethod
+    def concurrency_limit(cls, config):
+        """并发上限，子类按需覆盖"""
+        return config['max_concurrency']
+
+    @classmethod
+    def engine_options(cls, config):
+        """引擎特有的构造参数，子类按需覆盖"""
+        return {}
+
+    @property
+    def downloaded_bytes(self):
+        """本轮统计开始以来的下载字节数"""
+        return self.metrics.downloaded_bytes() - self._downloaded_bytes_offset
+
+    @downloaded_bytes.setter
+    def downloaded_bytes(self, value):
+        # 重置统计只移动基线，导出的计数器保持单调递增
+        self._downloaded_bytes_offset = self.metrics.downloaded_bytes() - value
+
+    def signal_handler(self, signum, frame):
+        logger.info(f"\n接收到信号 {signum}，正在停止程序...")
+        self.running = False
+
+    def introspection_handler(self, signum, frame):
+        """SIGUSR1 输出运行状态，SIGUSR2 开始采样分析；在单独的线程中执行，不打断正在进行的下载"""
+        target = self.dump_state if signum == signal.SIGUSR1 else self.profiler.start
+        threading.Thread(target=target, name='introspection', daemon=True).start()
+
+    def get_memory_usage(self):
+        """获取当前内存使用量（内存管理器最近一次采样值）"""
+        return self.memory_governor.rss_mb
+
+    def _catalog(self, urls):
+        """把URL列表包装为目录，URLCatalog 原样返回"""
+        return urls if isinstance(urls, URLCatalog) else URLCatalog.from_list(urls, self.url_weights)
+
+    def _start_run(self, max_speed_kbps):
+        """开始一次运行：重置统计，设置全局限速，启用流量计划时由它按时段和配额接管全局限速"""
+        self.downloaded_bytes = 0
+        self.start_time = time.time()
+        # 全局限速：所有并发下载共享同一个令牌桶，与并发数无关
+        self.rate_limiter.set_rate(max_speed_kbps)
+        self.traffic_plan.start(self)
+
+    def _finish_round(self, count, success, finished, skipped, last_stats, stats_interval):
+        """记录一轮的结果；统计信息按 stats_interval 汇总输出，其余轮次只在 DEBUG 级别输出。返回上次输出统计的时间"""
+        skipped_info = f" (跳过熔断中的URL {skipped} 个)" if skipped else ""
+        logger.info(f"第 {count} 轮完成: {success}/{finished} 个文件{skipped_info}",
+                    extra={'event': 'round', 'round': count, 'files_ok': success,
+                           'files': finished, 'skipped': skipped})
+        if time.monotonic() - last_stats >= stats_interval:
+            self.print_statistics()
+            return time.monotonic()
+        self.print_statistics(logging.DEBUG)
+        return last_stats
+
+    def _record_success(self, url, total_size, chunk_count, started, max_speed_kbps=0,
+                        expected_size=None, streams=1):
+        """记录成功的下载；逐文件日志只在 DEBUG 级别输出，正常运行时由周期统计汇总"""
+        self.metrics.stripe().observe_download(url, total_size, time.monotonic() - started, True)
+        self.health.record_success(url)
+        if self.pool_policy.warm > 0:
+            self.warm_targets.note(url)
+        if expected_size is not None and total_size != expected_size:
+            logger.warning(f"⚠️ 下载大小与预期不符: {url} ({total_size} / {expected_size} 字节)",
+                           extra={'throttle': True, 'url': url})
+        if logger.isEnabledFor(logging.DEBUG):
+            speed_info = ""
+            if max_speed_kbps > 0:
+                speed_info = f" (限速: {max_speed_kbps} KB/s)"
+            if streams > 1:
+                speed_info += f" (分段: {streams} 连接)"
+            memory_info = f" [内存: {self.get_memory_usage():.1f} MB]"
+            logger.debug(f"✓ 成功下载并丢弃: {url} (大小: {total_size} 字节, 分块: {chunk_count}){speed_info}{memory_info}",
+                         extra={'event': 'download', 'url': url, 'bytes': total_size, 'ok': True,
+                                'seconds': round(time.monotonic() - started, 3)})
+
+    def _warm_count(self):
+        """每个主机预热的连接数：不超过当前的并发下载数"""
+        return min(self.pool_policy.warm, self.max_active_downloads)
+
+    def _record_failure(self, url, error, started, reason=None):
+        """记录失败的下载及其错误类别，输出附带熔断提示的失败日志"""
+        stripe = self.metrics.stripe()
+        stripe.observe_error(error)
+        stripe.observe_download(url, 0, time.monotonic() - started, False)
+        note = describe_open(*self.health.record_failure(url, error))
+        logger.warning(f"✗ 下载失败 {url}: {reason or error}{note}",
+                       extra={'throttle': True, 'event': 'download', 'url': url, 'ok': False,
+                              'error': type(error).__name__})
+
+    def statistics_lines(self):
+        """引擎特有的统计行，子类按需覆盖"""
+        return []
+
+    def state_lines(self):
+        """引擎特有的运行状态行，子类按需覆盖"""
+        return []
+
+    def dump_state(self, limit=20):
+        """输出运行状态：在途下载及其当前速率、限速器积压、各阶段耗时和内存分配热点"""
+        flags = []
+        if not self.memory_governor.admission.is_set():
+            flags.append("内存过高，暂停接纳新下载")
+        if self.paused:
+            flags.append("流量计划暂停中")
+        lines = [
+            "\n🔍 运行状态:",
+            f"   活跃下载: {self.active_downloads}/{self.max_active_downloads}, "
+            f"内存 {self.get_memory_usage():.1f}/{self.max_memory_mb} MB{''.join(f', {flag}' for flag in flags)}",
+        ]
+        if self.rate_limiter.enabled:
+            lines.append(f"   全局限速器: {self.rate_limiter.rate / 1024:.0f} KB/s, "
+                         f"积压 {self.rate_limiter.backlog() * 1000:.0f} ms")
+        lines.extend(self.state_lines())
+        phases = describe_phases(self.metrics.phase_histograms())
+        if phases:
+            lines.append(f"   阶段耗时: {phases}")
+        inflight = self.inflight.snapshot()
+        lines.append(f"   在途下载 ({len(inflight)}):")
+        for url, nbytes, elapsed, rate in inflight[:limit]:
+            lines.append(f"     {url}  {nbytes / (1024 * 1024):.1f} MB / {elapsed:.1f}s, "
+                         f"当前 {rate / (1024 * 1024):.2f} MB/s")
+        if len(inflight) > limit:
+            lines.append(f"     ... 另有 {len(inflight) - limit} 个")
+        lines.extend(allocation_lines())
+        # 按需输出的诊断信息不应被 LOG_LEVEL=WARNING 过滤
+        logger.warning('\n'.join(lines), extra={
+            'event': 'state',
+            'engine': self.engine,
+            'active_downloads': self.active_downloads,
+            'inflight': [{'url': url, 'bytes': nbytes, 'seconds': round(elapsed, 1), 'rate': round(rate)}
+                         for url, nbytes, elapsed, rate in inflight[:limit]],
+        })
+
+    def print_statistics(self, level=logging.INFO):
+        """输出统计信息（整段作为一条日志，JSON 格式下附带数值字段）"""
+        if not logger.isEnabledFor(level):
+            return
+        elapsed_time = time.time() - self.start_time
+        total_mb = self.downloaded_bytes / (1024 * 1024)
+        avg_speed = total_mb / elapsed_time if elapsed_time > 0 else 0
+        memory_usage = self.get_memory_usage()
+        success, failure, errors = self.metrics.totals()
+
+        lines = [
+            "\n📊 统计信息:",
+            f"   运行时间: {elapsed_time:.1f} 秒",
+            f"   总下载量: {total_mb:.2f} MB",
+            f"   平均速度: {avg_speed:.2f} MB/s",
+            f"   文件数: 成功 {success} / 失败 {failure}{describe_errors(errors)}",
+            f"   内存使用: {memory_usage:.1f} MB / {self.max_memory_mb} MB (峰值 {self.memory_governor.peak_rss_mb:.1f} MB)",
+        ]
+        governor = self.memory_governor
+        lines.append(f"   GC耗时: {governor.gc_cpu_seconds:.2f} 秒CPU (共 {governor.gc_collections} 次, 其中主动回收 {governor.forced_collections} 次)")
+        lines.append(f"   活跃下载: {self.active_downloads}/{self.max_active_downloads}")
+        lines.append(f"   并发控制: {self.concurrency.summary()}")
+        if self.traffic_plan.enabled:
+            lines.append(f"   流量计划: {self.traffic_plan.summary()}")
+        if self.dns_cache is not None:
+            lines.append(f"   DNS缓存: {self.dns_cache.summary()}")
+        lines.append(f"   连接复用: {self.connection_stats.summary()}")
+        phases = describe_phases(self.metrics.phase_histograms())
+        if phases:
+            lines.append(f"   阶段耗时: {phases}")
+        if self.socket_profile.enabled:
+            lines.append(f"   套接字: {self.socket_profile.summary()}")
+        lines.extend(self.statistics_lines())
+        health = self.health.summary()
+        if health:
+            lines.append(f"   健康状态: {health}")
+        dropped = dropped_count()
+        if dropped:
+            lines.append(f"   日志: 输出过慢，已丢弃 {dropped} 条")
+        logger.log(level, '\n'.join(lines), extra={
+            'event': 'statistics',
+            'engine': self.engine,
+            'elapsed_seconds': round(elapsed_time, 1),
+            'downloaded_bytes': self.downloaded_bytes,
+            'avg_speed_mbps': round(avg_speed, 3),
+            'files_ok': success,
+            'files_failed': failure,
+            'errors': errors,
+            'rss_mb': round(memory_usage, 1),
+            'peak_rss_mb': round(self.memory_governor.peak_rss_mb, 1),
+            'active_downloads': self.active_downloads,
+            'max_active_downloads': self.max_active_downloads,
+            'connection_reuse_ratio': round(self.connection_stats.reuse_ratio(), 3),
+        })
+
+    def run(self, catalog, config):
+        """按配置的调度模式运行下载，子类实现"""
+        raise NotImplementedError
+
+    def close(self):
+        """停止后台线程并保存流量计划进度"""
+        self.memory_governor.stop()
+        self.concurrency.stop()
+        self.traffic_plan.stop(self)
+
+
+def load_config(engine='thread'):
+    """从环境变量读取配置，未设置的项使用该引擎的默认值"""
+    cls = engine_class(engine)
+    repeat_count = os.getenv('REPEAT_COUNT')
+    max_concurrency = int(os.getenv('MAX_CONCURRENCY', str(cls.DEFAULT_MAX_CONCURRENCY)))
+    return {
+        'engine': cls.engine,
+        'max_memory_mb': int(os.getenv('MAX_MEMORY_MB', '100')),
+        'chunk_size': int(os.getenv('CHUNK_SIZE', '8192')),
+        'sink_mode': os.getenv('SINK_MODE', '0') == '1',
+        'sink_buffer_kb': int(os.getenv('SINK_BUFFER_KB', '256')),
+        'wire_bytes': os.getenv('WIRE_BYTES', '0') == '1',
+        'memory_sample_interval': float(os.getenv('MEMORY_SAMPLE_INTERVAL', '1')),
+        'memory_wait_timeout': float(os.getenv('MEMORY_WAIT_TIMEOUT', '60')),
+        'interval': int(os.getenv('DOWNLOAD_INTERVAL', str(cls.DEFAULT_INTERVAL))),
+        'repeat_count': int(repeat_count) if repeat_count else None,
+        'max_speed_kbps': int(os.getenv('MAX_SPEED_KBPS', '0')),
+        'per_download_speed_kbps': int(os.getenv('PER_DOWNLOAD_SPEED_KBPS', '0')),
+        'schedule_mode': os.getenv('SCHEDULE_MODE', 'rounds').lower(),
+        'host_weights': parse_host_weights(os.getenv('HOST_WEIGHTS', '')),
+        'stats_interval': int(os.getenv('STATS_INTERVAL', '30')),
+        'range_streams': int(os.getenv('RANGE_STREAMS', '1')),
+        'range_min_size_mb': int(os.getenv('RANGE_MIN_SIZE_MB', '16')),
+        'timeout_policy': TimeoutPolicy.from_env(),
+        'pool_policy': PoolPolicy.from_env(),
+        'socket_profile': SocketProfile.from_env(),
+        'tracemalloc_frames': int(os.getenv('TRACEMALLOC', '0')),
+        'profile_seconds': float(os.getenv('PROFILE_SECONDS', '30')),
+        'profile_interval': float(os.getenv('PROFILE_INTERVAL', '0.01')),
+        'profile_dir': os.getenv('PROFILE_DIR', '/tmp'),
+        'metrics_port': int(os.getenv('METRICS_PORT', '0')),
+        'metrics_per_url': os.getenv('METRICS_PER_URL', '0') == '1',
+        'dns_cache_ttl': int(os.getenv('DNS_CACHE_TTL', '120')),
+        'url_reload_interval': float(os.getenv('URL_RELOAD_INTERVAL', '5')),
+        'breaker_failures': int(os.getenv('BREAKER_FAILURES', '3')),
+        'host_breaker_failures': int(os.getenv('HOST_BREAKER_FAILURES', '10')),
+        'breaker_backoff': float(os.getenv('BREAKER_BACKOFF', '30')),
+        'breaker_max_backoff': float(os.getenv('BREAKER_MAX_BACKOFF', '3600')),
+        'adaptive_concurrency': os.getenv('ADAPTIVE_CONCURRENCY', '1') == '1',
+        'min_concurrency': int(os.getenv('MIN_CONCURRENCY', '1')),
+        'max_concurrency': max_concurrency,
+        # 线程引擎的工作线程数即并发上限，默认与 MAX_CONCURRENCY 一致
+        'max_workers': int(os.getenv('MAX_WORKERS', str(max_concurrency))),
+        'rate_schedule': parse_rate_schedule(os.getenv('RATE_SCHEDULE', '')),
+        'daily_quota': parse_size(os.getenv('DAILY_QUOTA') or '0'),
+        'monthly_quota': parse_size(os.getenv('MONTHLY_QUOTA') or '0'),
+        'traffic_state_file': os.getenv('TRAFFIC_STATE_FILE', DEFAULT_STATE_FILE),
+        'async_transport': os.getenv('ASYNC_TRANSPORT', 'aiohttp').lower(),
+        'event_loop': os.getenv('EVENT_LOOP', 'auto').lower(),
+    }
+
+
+def create_manager(config):
+    """按配置创建所选引擎的管理器"""
+    return engine_class(config['engine']).from_config(config)
+
+
+def print_banner(config, url_source, max_active_downloads, workers=1):
+    """输出启动配置"""
+    repeat_count = config['repeat_count']
+    engine = config['engine']
+    lines = [
+        "=" * 60,
+        "🚀 TrafficFlow - 网络流量测试工具",
+        "=" * 60,
+        f"下载引擎: {'线程池' if engine == 'thread' else '异步IO'} ({engine})",
+        f"监控 URL: {url_source}",
+    ]
+    if workers > 1:
+        lines.append(f"工作进程: {workers} (全局限速与内存限制按进程平分)")
+    lines.append(f"下载间隔: {config['interval']} 秒")
+    if engine == 'thread':
+        lines.append(f"工作线程: {min(config['max_workers'], config['max_concurrency'])}")
+    lines.append(f"最大并发下载: {max_active_downloads}")
+    if config['adaptive_concurrency']:
+        lines.append(f"自适应并发: 按实测吞吐在 {config['min_concurrency']}-{config['max_concurrency']} 之间调整")
+    lines.append(f"内存限制: {config['max_memory_mb']} MB")
+    lines.append(f"块大小: {config['chunk_size']} 字节")
+    if config['wire_bytes']:
+        lines.append("流量计数: 线路字节 (Accept-Encoding: identity, 不解压, 含响应头)")
+    if config['sink_mode']:
+        lines.append(f"丢弃模式: 开启 (缓冲区 {max(64, min(1024, config['sink_buffer_kb']))} KB)")
+    if engine == 'asyncio' and config['range_streams'] > 1:
+        lines.append(f"分段下载: 每个文件最多 {config['range_streams']} 个Range连接 (文件大于 {config['range_min_size_mb']} MB 时启用)")
+    lines.append(f"超时设置: {config['timeout_policy'].describe()}")
+    lines.append(f"连接池: {config['pool_policy'].describe()}")
+    if config['socket_profile'].enabled:
+        lines.append(f"套接字调优: {config['socket_profile'].describe()}")
+    if engine == 'asyncio' and config['async_transport'] == 'raw':
+        lines.append("传输实现: raw (BufferedProtocol 直接丢弃响应体，分段下载仍使用 aiohttp)")
+    if config['dns_cache_ttl'] > 0:
+        lines.append(f"DNS缓存: {config['dns_cache_ttl']} 秒 (新连接轮询主机的所有IP)")
+    lines.append(f"重复次数: {'无限' if repeat_count is None else repeat_count}")
+    lines.append(f"调度模式: {'连续' if config['schedule_mode'] == 'continuous' else '按轮'}")
+    if config['max_speed_kbps'] > 0:
+        lines.append(f"全局限速: {config['max_speed_kbps']} KB/s")
+    if config['per_download_speed_kbps'] > 0:
+        lines.append(f"单文件限速: {config['per_download_speed_kbps']} KB/s")
+    if config['rate_schedule'] or config['daily_quota'] or config['monthly_quota']:
+        plan = TrafficPlan(config['rate_schedule'], daily_quota=config['daily_quota'],
+                           monthly_quota=config['monthly_quota'], state_file=config['traffic_state_file'])
+        lines.append(f"流量计划: {plan.describe()}")
+    if config['tracemalloc_frames'] > 0:
+        lines.append(f"内存分配跟踪: 开启 (tracemalloc, {config['tracemalloc_frames']} 层调用栈)")
+    lines.append("=" * 60)
+    lines.append("按 Ctrl+C 停止程序")
+    if hasattr(signal, 'SIGUSR1'):
+        lines.append(f"kill -USR1 {os.getpid()} 输出运行状态, kill -USR2 {os.getpid()} "
+                     f"采样分析 {config['profile_seconds']:g} 秒 (写入 {config['profile_dir']})")
+    logger.info('\n'.join(lines))
+
+
+def run_shard(index, stats, catalog, config):
+    """工作进程入口：在自己的URL分片上运行一个独立的管理器"""
+    # 每个进程单独记录自己那份配额的进度
+    state_file = config['traffic_state_file']
+    manager = create_manager(dict(config, traffic_state_file=f"{state_file}.{index}" if state_file else ''))
+    stopped = threading.Event()
+
+    def publish():
+        # 定期把统计写入共享内存，热路径中不触碰共享区
+        while not stopped.wait(1):
+            stats.publish(index, manager)
+
+    publisher = threading.Thread(target=publish, name='stats-publisher', daemon=True)
+    publisher.start()
+    try:
+        manager.run(catalog, config)
+    except Exception as e:
+        logger.exception(f"工作进程 #{index} 异常: {e}")
+    finally:
+        stopped.set()
+        manager.close()
+        stats.publish(index, manager)
+        # 工作进程经 os._exit 退出，不会执行 atexit，在这里输出队列中剩余的日志
+        shutdown_logging()
+
+
+class TrafficFlow:
+    """统一入口：按配置选择引擎，单进程直接运行，workers 大于1时按URL分片启动多个进程"""
+
+    def __init__(self, config=None, engine='thread', workers=1, urls_file=URLS_FILE):
+        self.config = config or load_config(engine)
+        self.workers = max(1, workers)
+        self.urls_file = urls_file
+
+    def catalog(self, shard_index=0, shard_count=1):
+        """URL目录：每轮流式读取 urls.txt，修改后自动生效"""
+        return URLCatalog(self.urls_file, reload_interval=self.config['url_reload_interval'],
+                          shard_index=shard_index, shard_count=shard_count)
+
+    def run(self):
+        if self.workers > 1:
+            self._run_sharded()
+        else:
+            self._run_single()
+
+    def _run_single(self):
+        config = self.config
+        manager = create_manager(config)
+        if config['metrics_port'] > 0:
+            start_metrics_server(manager.metrics.render, config['metrics_port'])
+        catalog = self.catalog()
+        print_banner(config, catalog.describe(), manager.max_active_downloads)
+        try:
+            manager.run(catalog, config)
+        except Exception as e:
+            logger.exception(f"程序异常: {e}")
+        finally:
+            manager.close()
+            logger.info("\n" + "=" * 60 + "\n最终统计信息:")
+            manager.print_statistics()
+            logger.info("TrafficFlow 已停止")
+
+    def _run_sharded(self):
+        """多进程分片模式：每个进程运行一个管理器，处理 urls.txt 的一个分片"""
+        config = self.config
+        workers = self.workers
+        # 每个进程流式读取同一个文件，按行号取模选出自己的分片
+        shards = [self.catalog(index, workers) for index in range(workers)]
+
+        # 全局速度预算、内存预算、并发上限和流量计划按进程平分
+        shard_config = dict(
+            config,
+            max_memory_mb=config['max_memory_mb'] / workers,
+            max_speed_kbps=config['max_speed_kbps'] / workers,
+            rate_schedule={hour: None if rate is None else rate / workers
+                           for hour, rate in config['rate_schedule'].items()},
+            daily_quota=config['daily_quota'] // workers,
+            monthly_quota=config['monthly_quota'] // workers
+        )
+        # fork 出的工作进程起步就有与当前进程相近的 RSS，预算低于它时内存管理器会一直暂停接纳
+        baseline_mb = process_rss_mb()
+        floor_mb = min_worker_budget_mb(baseline_mb)
+        if shard_config['max_memory_mb'] < floor_mb:
+            logger.error(f"❌ MAX_MEMORY_MB={config['max_memory_mb']} 不足以运行 {workers} 个工作进程: "
+                         f"每个进程至少需要 {floor_mb:.0f} MB (基础占用约 {baseline_mb:.0f} MB)，"
+                         f"请把 MAX_MEMORY_MB 调到 {floor_mb * workers:.0f} 以上或减少 --workers")
+            raise SystemExit(1)
+
+        print_banner(config, self.catalog().describe(), '每进程独立计算', workers)
+
+        stats, start_time = run_sharded(
+            run_shard, shards, shard_config,
+            stats_interval=config['stats_interval'],
+            metrics_port=config['metrics_port']
+        )
+
+        logger.info("\n" + "=" * 60 + "\n最终统计信息:")
+        print_shared_statistics(stats, start_time)
+        logger.info("TrafficFlow 已停止")
+
+
+def parse_args(argv=None, default_engine=None):
+    parser = argparse.ArgumentParser(description='TrafficFlow - 网络流量测试工具')
+    parser.add_argument(
+        '--engine', choices=sorted(set(ENGINES) | set(ENGINE_ALIASES)),
+        default=default_engine or os.getenv('ENGINE', 'thread'),
+        help='下载引擎: thread=线程池, asyncio=异步IO (默认: 环境变量 ENGINE 或 thread)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=int(os.getenv('WORKERS', '1')),
+        help='工作进程数，大于1时按分片启动多个进程以利用多核 (默认: 环境变量 WORKERS 或 1)'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None, default_engine=None):
+    args = parse_args(argv, default_engine)
+    setup_logging()
+    TrafficFlow(engine=args.engine, workers=args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from log_config import get_logger
+
+logger = get_logger('traffic_plan')
+
+MB = 1024 * 1024
+GB = 1024 * MB
+DEFAULT_STATE_FILE = '/app/state/traffic_plan.json'
+
+
+def parse_rate_schedule(spec):
+    """解析按小时的限速曲线，例如 '0-7=5000,8-18=1000,19-23=off'
+
+    值为该时段的全局限速 (KB/s)，0 表示不限速，off 表示暂停下载；未列出的小时使用 MAX_SPEED_KBPS。
+    返回 {小时: KB/s 或 None(暂停)}。
+    """
+    schedule = {}
+    if not spec:
+        return schedule
+    for item in spec.split(','):
+        hours, _, value = item.strip().partition('=')
+        if not hours or not value:
+            continue
+        try:
+            start, _, end = hours.partition('-')
+            start = int(start)
+            end = int(end) if end else start
+            rate = None if value.strip().lower() == 'off' else float(value)
+        except ValueError:
+            logger.warning(f"⚠️ 无效的限速曲线配置: {item}")
+            continue
+        if not (0 <= start <= 23 and 0 <= end <= 23):
+            logger.warning(f"⚠️ 限速曲线的小时应在 0-23 之间: {item}")
+            continue
+        # 支持跨零点的时段，例如 22-6
+        hour = start
+        while True:
+            schedule[hour] = rate
+            if hour == end:
+                break
+            hour = (hour + 1) % 24
+    return schedule
+
+
+def _format_bytes(nbytes):
+    if nbytes >= GB:
+        return f"{nbytes / GB:.2f} GB"
+    return f"{nbytes / MB:.1f} MB"
+
+
+class TrafficPlan:
+    """流量计划：按小时的限速曲线 + 每日/每月流量配额
+
+    剩余配额按曲线的权重摊到本周期剩余的时间上，得出当前小时的目标速度，
+    每秒重新计算一次，某段时间没跑满会自动摊到之后的时段补回，周期结束时正好用完配额。
+    已用流量定期原子写入状态文件，容器重启后继续累计，不会重复或超额消耗。
+    """
+
+    def __init__(self, schedule=None, base_kbps=0, daily_quota=0, monthly_quota=0,
+                 state_file=None, update_interval=1.0, save_interval=10.0):
+        self.schedule = schedule or {}
+        self.base_kbps = base_kbps
+        self.daily_quota = daily_quota
+        self.monthly_quota = monthly_quota
+        self.state_file = state_file
+        self.update_interval = update_interval
+        self.save_interval = save_interval
+        self.day = None
+        self.day_bytes = 0
+        self.month = None
+        self.month_bytes = 0
+        # 当前目标速度 (KB/s)，0 表示不限速；暂停时 paused 为 True
+        self.target_kbps = base_kbps
+        self.paused = False
+        self.reason = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_total = None
+        self._last_save = 0.0
+        # 是否成功写入过状态文件
+        self._saved = False
+
+    @property
+    def enabled(self):
+        return bool(self.schedule) or self.daily_quota > 0 or self.monthly_quota > 0
+
+    def hour_kbps(self, hour):
+        """该小时的限速 (KB/s)，0 为不限速，None 为暂停"""
+        return self.schedule.get(hour, self.base_kbps)
+
+    def _weight(self, hour):
+        """分摊配额时该小时的权重：按曲线限速的比例，不限速的小时按曲线中的最高限速计"""
+        rate = self.hour_kbps(hour)
+        if rate is None:
+            return 0.0
+        if rate > 0:
+            return rate
+        caps = [r for r in list(self.schedule.values()) + [self.base_kbps] if r]
+        return max(caps) if caps else 1.0
+
+    def _remaining_weight(self, now, end):
+        """[now, end) 区间内 权重 × 秒数 的积分"""
+        total = 0.0
+        cursor = now
+        while cursor < end:
+            next_hour = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            segment_end = min(next_hour, end)
+            total += self._weight(cursor.hour) * (segment_end - cursor).total_seconds()
+            cursor = segment_end
+        return total
+
+    def _rollover(self, now):
+        """跨天/跨月时清零对应的计数（调用方持有锁）"""
+        day = now.strftime('%Y-%m-%d')
+        month = now.strftime('%Y-%m')
+        if day != self.day:
+            self.day = day
+            self.day_bytes = 0
+        if month != self.month:
+            self.month = month
+            self.month_bytes = 0
+
+    def record(self, nbytes, now=None):
+        """累计已消耗的流量"""
+        now = now or datetime.now()
+        with self._lock:
+            self._rollover(now)
+            self.day_bytes += nbytes
+            self.month_bytes += nbytes
+
+    def compute(self, now=None):
+        """计算当前的目标速度，返回 (KB/s, 暂停原因)，KB/s 为 0 表示不限速，暂停原因非空表示应暂停下载"""
+        now = now or datetime.now()
+        rate = self.hour_kbps(now.hour)
+        if rate is None:
+            return 0, f"计划暂停时段 ({now.hour} 点)"
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = day_start.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        with self._lock:
+            self._rollover(now)
+            quotas = (('今日', self.daily_quota, self.day_bytes, day_start + timedelta(days=1)),
+                      ('本月', self.monthly_quota, self.month_bytes, next_month))
+        for name, quota, used, end in quotas:
+            if quota <= 0:
+                continue
+            remaining = quota - used
+            if remaining <= 0:
+                return 0, f"{name}配额已用完"
+            weight = self._remaining_weight(now, end)
+            if weight <= 0:
+                continue
+            pace_kbps = remaining * self._weight(now.hour) / weight / 1024
+            rate = pace_kbps if rate == 0 else min(rate, pace_kbps)
+        # 剩余配额很少时也保持可用的最低速度，避免下载被看门狗判为停滞
+        return (max(1.0, rate) if rate else 0), None
+
+    def load(self):
+        """从状态文件恢复已用流量"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 流量计划状态文件读取失败，重新计数: {e}")
+            return
+        now = datetime.now()
+        with self._lock:
+            self._rollover(now)
+            if state.get('day') == self.day:
+                self.day_bytes = int(state.get('day_bytes', 0))
+            if state.get('month') == self.month:
+                self.month_bytes = int(state.get('month_bytes', 0))
+        if self.day_bytes or self.month_bytes:
+            logger.info(f"📂 已恢复流量计划进度: 今日 {_format_bytes(self.day_bytes)}, "
+                        f"本月 {_format_bytes(self.month_bytes)}")
+
+    def save(self):
+        """原子写入状态文件：先写临时文件再替换，中途崩溃不会留下损坏的状态"""
+        if not self.state_file:
+            return
+        with self._lock:
+            state = {
+                'day': self.day,
+                'day_bytes': self.day_bytes,
+                'month': self.month,
+                'month_bytes': self.month_bytes,
+                'updated_at': datetime.now().isoformat(timespec='seconds'),
+            }
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.traffic_plan.', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.state_file)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            if not self._saved:
+                # 第一次就写不进去多半是目录不可写（例如未挂载卷），关闭持久化而不是每次保存都告警
+                logger.warning(f"⚠️ 流量计划状态无法写入 {self.state_file}: {e}，本次运行不再保存进度 "
+                               f"(可挂载可写目录或设置 TRAFFIC_STATE_FILE)")
+                self.state_file = None
+            else:
+                logger.warning(f"⚠️ 流量计划状态保存失败: {e}")
+        else:
+            self._saved = True
+        self._last_save = time.monotonic()
+
+    def apply(self, manager):
+        """把已下载的字节计入配额，并按当前目标调整管理器的全局限速和暂停状态"""
+        # 导出计数器单调递增，不受每轮重置统计影响
+        total = manager.metrics.downloaded_bytes()
+        if self._last_total is not None and total > self._last_total:
+            self.record(total - self._last_total)
+        self._last_total = total
+
+        kbps, reason = self.compute()
+        if reason != self.reason:
+            if reason:
+                logger.info(f"⏸️ 流量计划: {reason}，暂停新的下载")
+            elif self.reason:
+                logger.info(f"▶️ 流量计划: 恢复下载，目标速度 {kbps:.0f} KB/s" if kbps else
+                            "▶️ 流量计划: 恢复下载")
+            self.reason = reason
+        self.paused = reason is not None
+        manager.paused = self.paused
+        if not self.paused:
+            self.target_kbps = kbps
+            manager.rate_limiter.set_rate(kbps)
+
+    def start(self, manager):
+        """恢复已保存的进度并启动后台线程，每 update_interval 秒更新一次目标速度"""
+        if not self.enabled or self._thread is not None:
+            return
+        self.load()
+        self.apply(manager)
+        self._thread = threading.Thread(target=self._run, args=(manager,),
+                                        name='traffic-plan', daemon=True)
+        self._thread.start()
+
+    def stop(self, manager=None):
+        """停止后台线程并保存最终进度"""
+        self._stop_event.set()
+        if self._thread is None:
+            # 未启动时没有读取过状态文件，不能覆盖已有进度
+            return
+        if manager is not None:
+            self.apply(manager)
+        self.save()
+
+    def _run(self, manager):
+        while not self._stop_event.wait(self.update_interval):
+            self.apply(manager)
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self.save()
+
+    def describe(self):
+        """返回便于打印的计划配置"""
+        parts = []
+        if self.schedule:
+            off = sum(1 for rate in self.schedule.values() if rate is None)
+            text = f"限速曲线 {len(self.schedule)} 个小时"
+            if off:
+                text += f" (其中 {off} 个小时暂停)"
+            parts.append(text)
+        if self.daily_quota > 0:
+            parts.append(f"每日配额 {_format_bytes(self.daily_quota)}")
+        if self.monthly_quota > 0:
+            parts.append(f"每月配额 {_format_bytes(self.monthly_quota)}")
+        if self.state_file:
+            parts.append(f"进度保存到 {self.state_file}")
+        return ', '.join(parts)
+
+    def summary(self):
+        """返回便于打印的当前进度"""
+        with self._lock:
+            day_bytes, month_bytes = self.day_bytes, self.month_bytes
+        parts = []
+        if self.daily_quota > 0:
+            parts.append(f"今日 {_format_bytes(day_bytes)} / {_format_bytes(self.daily_quota)}")
+        if self.monthly_quota > 0:
+            parts.append(f"本月 {_format_bytes(month_bytes)} / {_format_bytes(self.monthly_quota)}")
+        if self.paused:
+            parts.append(f"已暂停 ({self.reason})")
+        elif self.target_kbps:
+            parts.append(f"目标速度 {self.target_kbps:.0f} KB/s")
+        else:
+            parts.append("不限速")
+        return ', '.join(parts)
@@ -0,0 +1,173 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+from log_config import get_logger
+from scheduler import DEFAULT_URLS, URLEntry, WeightedURLScheduler, parse_url_line
+
+logger = get_logger('catalog')
+
+
+class URLCatalog:
+    """流式URL目录
+
+    每一轮从头逐行读取 urls.txt，不在内存中保存整个列表，内存占用和启动时间与列表长度无关；
+    按修改时间轮询文件，编辑后在下一轮（连续调度时在 reload_interval 秒内）生效，无需重启容器。
+    多进程分片时每个进程只取行号对 shard_count 取模等于 shard_index 的URL。
+    """
+
+    def __init__(self, filename=None, urls=None, url_weights=None, reload_interval=5.0,
+                 shard_index=0, shard_count=1):
+        self.filename = filename
+        # 直接传入的URL列表（测试或旧接口），此时不读文件
+        self.urls = list(urls) if urls is not None else None
+        self.url_weights = url_weights or {}
+        self.reload_interval = reload_interval
+        self.shard_index = shard_index
+        self.shard_count = max(1, shard_count)
+        # 上一轮读到的URL数量，尚未读完一轮时为 None
+        self.last_count = None
+        self._pass_signature = None
+        self._last_check = 0.0
+
+    @classmethod
+    def from_list(cls, urls, url_weights=None):
+        """用内存中的URL列表创建目录"""
+        return cls(urls=urls, url_weights=url_weights)
+
+    def _signature(self):
+        try:
+            st = os.stat(self.filename)
+        except (OSError, TypeError):
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _iter_all(self):
+        """按顺序产出所有URL条目"""
+        if self.urls is not None:
+            for url in self.urls:
+                yield URLEntry(url, self.url_weights.get(url, 1.0))
+            return
+        if self.filename and os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        yield parse_url_line(line)
+            return
+        for url in DEFAULT_URLS:
+            yield URLEntry(url)
+
+    def entries(self):
+        """读取一轮URL条目（生成器）"""
+        signature = self._signature()
+        if self._pass_signature is not None and signature != self._pass_signature:
+            logger.info(f"🔄 检测到 {self.filename} 已更新，重新加载URL列表")
+        self._pass_signature = signature
+        self._last_check = time.monotonic()
+
+        seen = 0
+        yielded = 0
+        for entry in self._iter_all():
+            if seen % self.shard_count == self.shard_index:
+                yielded += 1
+                yield entry
+            seen += 1
+        if yielded == 0 and seen > 0:
+            # URL 少于进程数时，分不到URL的进程下载全部URL
+            for entry in self._iter_all():
+                yielded += 1
+                yield entry
+        self.last_count = yielded
+
+    def changed(self):
+        """文件自本轮开始以来是否被修改（按 reload_interval 节流检查）"""
+        if self.urls is not None or self.reload_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return False
+        self._last_check = now
+        return self._signature() != self._pass_signature
+
+    def describe(self):
+        """返回便于打印的来源描述"""
+        if self.urls is not None:
+            return f"{len(self.urls)} 个"
+        if not self.filename or not os.path.exists(self.filename):
+            return f"默认测试URL ({len(DEFAULT_URLS)} 个)"
+        text = f"{self.filename} (流式读取"
+        if self.reload_interval > 0:
+            text += f", 每 {self.reload_interval:g} 秒检查更新"
+        if self.shard_count > 1:
+            text += f", 分片 {self.shard_index + 1}/{self.shard_count}"
+        return text + ")"
+
+
+class CatalogScheduler:
+    """连续调度：从目录按窗口流式读取URL，窗口内做平滑加权轮询
+
+    每个窗口最多 window 条URL，领取次数至少为窗口内URL数，并保证权重最小的URL也能领到一次，
+    其余URL按权重比例领取；
+    读完整个目录算一轮，passes 为 None 时无限循环。目录文件变化时放弃当前轮次，从新文件开头重新开始。
+    """
+
+    def __init__(self, catalog, host_weights=None, passes=None, window=1024):
+        self.catalog = catalog
+        self.host_weights = host_weights or {}
+        self.passes = passes
+        self.window = window
+        self.completed_passes = 0
+        self._lock = threading.Lock()
+        self._entries = None
+        self._scheduler = None
+        self._window_entries = {}
+        # 本轮中权重大于0的URL数，整轮都没有可调度的URL时停止
+        self._schedulable = 0
+
+    def next(self):
+        """返回下一个要下载的 URLEntry，轮次用完或目录为空时返回 None"""
+        with self._lock:
+            if self._entries is not None and self.catalog.changed():
+                # 文件已更新：放弃当前轮次剩余部分，从新文件开头开始
+                self._entries.close()
+                self._entries = None
+                self._scheduler = None
+            while True:
+                if self._scheduler is not None:
+                    url = self._scheduler.next()
+                    if url is not None:
+                        return self._window_entries[url]
+                if not self._load_window():
+                    return None
+
+    def _load_window(self):
+        """读取下一个窗口，没有更多URL时返回 False（调用方持有锁）"""
+        if self._entries is None:
+            if self.passes is not None and self.completed_passes >= self.passes:
+                return False
+            self._entries = self.catalog.entries()
+            self._schedulable = 0
+
+        batch = list(itertools.islice(self._entries, self.window))
+        if not batch:
+            self._entries = None
+            self._scheduler = None
+            self.completed_passes += 1
+            if not self._schedulable:
+                logger.error("❌ 没有可调度的URL（列表为空或权重均为0）")
+                return False
+            return True
+
+        self._window_entries = {entry.url: entry for entry in batch}
+        url_weights = {entry.url: entry.weight for entry in batch}
+        scheduler = WeightedURLScheduler([entry.url for entry in batch], url_weights, self.host_weights)
+        if scheduler.urls:
+            # 一个完整的加权轮询周期：总权重 / 最小权重，上限为窗口大小的100倍
+            cycle = math.ceil(scheduler.total_weight / min(scheduler.weights) - 1e-9)
+            scheduler.max_picks = max(len(batch), min(cycle, len(batch) * 100))
+        self._scheduler = scheduler
+        self._schedulable += len(scheduler.urls)
+        return True
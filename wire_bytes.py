@@ -0,0 +1,20 @@
+"""线路字节计数
+
+开启后请求带 Accept-Encoding: identity，响应体按收到的原始字节计数、不做解压，
+并把响应头计入下载量，统计结果与运营商计量的下行流量一致。
+"""
+
+# 要求服务器不压缩响应体；服务器仍然压缩时也只计数原始字节，不解压
+IDENTITY_HEADERS = {'Accept-Encoding': 'identity'}
+
+
+def response_head_size(version, status, reason, headers):
+    """按状态行和响应头估算响应头在线路上的字节数
+
+    requests/aiohttp 解析后不保留原始字节，这里按 "名称: 值\\r\\n" 重新计算，
+    与实际字节只在头部折行等罕见写法上有差别。version 为 '1.1' 形式，headers 为 (名称, 值) 序列。
+    """
+    size = len(f"HTTP/{version} {status} {reason}\r\n") + 2
+    for name, value in headers:
+        size += len(name) + len(value) + 4
+    return size